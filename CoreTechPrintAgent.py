@@ -1,26 +1,81 @@
+# First, so the startup timing report includes loading the other modules
+from startup_timer import StartupTimer
+import atexit
+import copy
 import cx_Oracle
 import os
+import random
 import subprocess
 import json
 from cryptography.fernet import Fernet, InvalidToken
 import logging
 from logging.handlers import RotatingFileHandler
 import time
+import shutil
 import signal
+import socket
 import sys
-from jsondiff import diff
+import threading
 from datetime import datetime, timedelta
-import smtplib
-from email.message import EmailMessage
+from print_dispatcher import PrintDispatcher
+from job_fetcher import JobFetcher
+from ack_batcher import AckBatcher
+from connection_poller import ConnectionPoller
+from job_journal import JobJournal, DISPATCHED, PRINTED
+from agent_metrics import AgentMetrics, STAGE_TEMP_FILE_WRITE, STAGE_PRINT_SPAWN
+from printer_transport import LpdTransport, RawTransport, CommandTransport, PrinterTransportError
+from print_command import run_command
+from print_spool import PrintSpool
+from text_encoder import TextEncoder
+from laser_backend import SpawnLaserBackend, BatchLaserBackend, BATCH
+from document_cache import DocumentCache
+from alert_mailer import AlertMailer, AlertMailerHandler
+from agent_logging import LogListener, JsonLinesFormatter, job_log_fields
+from config_watcher import ConfigWatcher, changed_keys
+from wakeup import Wakeup, DbmsAlertSource, PRINT_ALERT_NAME
+from schema_support import Housekeeper
 
 
 # import ipaddress
 # import pyimod02_importers
 
+# Settings of "main" applied by the config hot-reload, grouped by what they need to be applied. Any other setting
+# (e.g. print_worker_count, metrics, job journal) needs a restart of the agent.
+LOGGER_CONFIG_KEYS = {"logging_backup_count", "logging_max_file_size", "logging_file_name", "stats_backup_count",
+                      "stats_max_file_size", "stats_file_name", "logging_format", "logging_job_sample_rate"}
+PAUSE_CONFIG_KEYS = {"execution_pause_time", "wakeup_adaptive_polling", "wakeup_min_pause_time",
+                     "wakeup_max_pause_time", "wakeup_backoff_factor"}
+FETCHER_CONFIG_KEYS = {"fetch_streaming", "fetch_page_size", "fetch_arraysize", "fetch_prefetchrows",
+                       "fetch_max_rows_per_cycle", "lease_time", "print_queue_size", "priority_column",
+                       "fetch_lazy_lobs", "lob_inline_threshold", "document_hash_expression", "fetch_pending_index"}
+SCHEDULER_CONFIG_KEYS = {"printer_priorities", "category_priorities", "priority_aging_time", "printer_rate_limit",
+                         "printer_rate_limits", "printer_failure_threshold", "printer_open_time",
+                         "printer_max_open_time", "print_max_attempts", "print_retry_wait_time"}
+PRINT_COMMAND_CONFIG_KEYS = {"sumatra_command", "lpr_command", "print_command_shell", "print_command_timeout",
+                             "laser_print_backend", "laser_batch_size"}
+PRINT_TRANSPORT_CONFIG_KEYS = {"text_print_transport", "printer_socket_timeout", "lpd_queue_name", "lpd_file_type",
+                               "raw_keep_connections", "text_encoding", "text_newline", "text_encoding_errors",
+                               "text_printer_transforms"}
+EMAIL_CONFIG_KEYS = {"email_on_critical", "email_server", "email_port", "email_sender", "email_queue_size",
+                     "email_timeout"}
+POLLER_CONFIG_KEYS = {"wakeup_source", "wakeup_alert_name"}
+HOUSEKEEPING_CONFIG_KEYS = {"housekeeping", "housekeeping_interval", "housekeeping_retention_days",
+                            "housekeeping_batch_size", "housekeeping_max_batches", "housekeeping_date_column",
+                            "housekeeping_archive_table"}
+CONNECTION_CONFIG_KEYS = {"oracle_pool_min", "oracle_pool_max", "oracle_statement_cache_size", "oracle_ping_interval",
+                          "oracle_retry_max_wait_time", "ack_batch_size", "ack_max_wait_time"}
+# Read when they are used
+DYNAMIC_CONFIG_KEYS = {"client_name", "email_on_error", "logging_set_level", "config_debounce_time"}
+
 
 class OracleConnection:
+    # Backed by a session pool with statement caching. The poller keeps one session (self.connection), other
+    # threads borrow one with acquire_session()/release_session(). An idle session is pinged every ping_interval
+    # seconds and failed reconnections back off exponentially, with jitter, from oracle_retry_wait_time up to
+    # retry_max_wait_time seconds.
     def __init__(self, oracle_connection_index, oracle_connection_name, username, password, host, port, service,
-                 oracle_retry_wait_time, connection_status, email_on_error, email_on_error_freq):
+                 oracle_retry_wait_time, connection_status, email_on_error, email_on_error_freq, pool_min=1,
+                 pool_max=4, statement_cache_size=50, ping_interval=60, retry_max_wait_time=300):
         self.oracle_connection_index = oracle_connection_index
         self.oracle_connection_name = oracle_connection_name
         self.username = username
@@ -32,27 +87,88 @@ class OracleConnection:
         self.connection_status = connection_status
         self.email_on_error = email_on_error
         self.connection = None
-        self.last_connection_attempt = None
-        self.last_email_attempt = None
+        self.pool = None
+        self.pool_min = int(pool_min)
+        self.pool_max = max(int(pool_max), self.pool_min, 1)
+        self.statement_cache_size = int(statement_cache_size)
+        self.ping_interval = float(ping_interval)
+        self.retry_max_wait_time = float(retry_max_wait_time)
+        self.connection_failures = 0
+        self.next_connection_attempt = None
+        self.last_used = None
         self.email_on_error_freq = email_on_error_freq
         self.last_error_message = None
+        self.ack_batcher = None
 
     def connect(self, logger):
         dsn = cx_Oracle.makedsn(self.host, self.port, service_name=self.service)
         try:
-            self.connection = cx_Oracle.connect(self.username, self.password, dsn)
+            if self.pool is None:
+                # threaded, the sessions are used by the poller and the other threads of the agent
+                self.pool = cx_Oracle.SessionPool(user=self.username, password=self.password, dsn=dsn,
+                                                  min=self.pool_min, max=self.pool_max, increment=1, threaded=True,
+                                                  getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+                                                  stmtcachesize=self.statement_cache_size)
+            self.connection = self.pool.acquire()
             self.connection_status = 'SUCCESS'
+            self.connection_failures = 0
+            self.last_used = time.monotonic()
         except Exception as err:
-            self.connection_status = 'NOT_SUCCESS'
-            self.last_error_message = err.__str__()
+            self.set_failed(logger, err)
             logger.error(
                 'Unable to connect to Oracle Database ' + self.oracle_connection_name + ': ' + err.__str__())
 
+    def set_failed(self, logger, err):
+        # Drop the broken session and schedule the next attempt
+        self.connection_status = 'NOT_SUCCESS'
+        self.last_error_message = err.__str__()
+        self.connection_failures += 1
+
+        if self.connection is not None:
+            try:
+                self.pool.drop(self.connection)
+            except cx_Oracle.Error:
+                pass
+            self.connection = None
+
+        retry_wait_time = min(float(self.oracle_retry_wait_time) * 2 ** (self.connection_failures - 1),
+                              self.retry_max_wait_time)
+        # Jitter, so the agents of a site don't all reconnect at the same moment after an outage
+        retry_wait_time *= random.uniform(0.5, 1.0)
+        self.next_connection_attempt = datetime.now() + timedelta(seconds=retry_wait_time)
+        logger.debug('Next connection attempt to ' + self.oracle_connection_name + ' in ' +
+                     str(round(retry_wait_time, 1)) + ' seconds')
+
+    def health_check(self, logger):
+        # Ping the session if it has been idle longer than ping_interval
+        if self.connection is None or time.monotonic() - self.last_used < self.ping_interval:
+            return
+        try:
+            self.connection.ping()
+            self.last_used = time.monotonic()
+        except cx_Oracle.Error as err:
+            logger.error('Connection ' + self.oracle_connection_name + ' lost: ' + err.__str__())
+            self.set_failed(logger, err)
+
+    def acquire_session(self):
+        if self.pool is None:
+            raise cx_Oracle.DatabaseError('Connection ' + self.oracle_connection_name + ' is not open')
+        return self.pool.acquire()
+
+    def release_session(self, session):
+        try:
+            self.pool.release(session)
+        except cx_Oracle.Error:
+            pass
+
     def close(self, logger):
-        if self.connection:
+        if self.pool:
             try:
-                self.connection.close()
+                if self.connection is not None:
+                    self.pool.release(self.connection)
+                self.pool.close(force=True)
                 self.connection = None
+                self.pool = None
                 self.connection_status = 'NOT_SUCCESS'
                 logger.debug("Connection " + self.oracle_connection_name + " closed Successfully")
             except cx_Oracle.Error as error:
@@ -65,13 +181,35 @@ class OracleConnection:
 class pyAgent:
     def __init__(self):
         # Initialize object variables to default values
-        self.printer_name = None
-        self.text_file = None
-        self.current_rows_fetched = None
-        self.out = None
+        self.dispatcher = None
+        self.fetcher = None
+        self.print_queue_size = None
+        self.text_transport = None
+        self.spool = None
+        self.log_listener = None
+        self.stats_log_listener = None
+        # TEXT printer name -> TextEncoder, and the one of the other printers
+        self.text_encoders = {}
+        self.default_text_encoder = TextEncoder()
+        self.document_cache = None
+        self.journal = None
+        self.metrics = None
+        self.alert_mailer = None
+        self.housekeeper = None
+        # Records and alerts logged just before exiting are still written and sent, the log files last
+        atexit.register(self.stop_log_listeners)
+        atexit.register(self.stop_alert_mailer)
+        self.sumatra_command = None
+        self.laser_backend = None
+        self.laser_batch_size = 1
+        self.lpr_command = None
+        self.print_command_shell = False
         self.CurrentOracleConnection = None
         self.json_differences = None
         self.old_json_data = None
+        # config.JSON as read, with the credentials encrypted
+        self.raw_json_data = None
+        self.config_watcher = None
         self.logger_created = None
         self.handler_created = False
         self.loggerStats = None
@@ -82,22 +220,163 @@ class pyAgent:
         self.encryption_key = b'w1GLAgxA5AK3DMcESVcdb166UcdZS4J31iIG0aNN8dw='  # Stored in CENT_SYS_CONFIGURATION 'CoreTechPrintAgent'/'Encryption KEY'
         self.cfg_logging_file_name = "CoreTechPrintAgent.log"  # Fallback
         self.cfg_execution_pause_time = 10  # in seconds. Fallback
-        self.config_file_timestamp = None
+        self.cfg_print_worker_count = 4  # Fallback
+        self.cfg_printer_max_concurrency = 1  # Fallback
+        self.cfg_print_queue_size = 200  # Max jobs queued or printing. Fallback
+        self.cfg_priority_aging_time = 60  # in seconds per priority level. Fallback
+        self.cfg_printer_rate_limit = 0  # jobs per minute. Fallback
+        self.cfg_fetch_streaming = True  # Fallback
+        self.cfg_fetch_page_size = 50  # Fallback
+        self.cfg_fetch_arraysize = 50  # Fallback
+        self.cfg_fetch_prefetchrows = 50  # Fallback
+        self.cfg_fetch_max_rows_per_cycle = 1000  # 0 = no limit. Fallback
+        self.cfg_fetch_lazy_lobs = True  # Fallback
+        self.cfg_fetch_pending_index = False  # Needs schema_support.PENDING_JOBS_INDEX_DDL. Fallback
+        self.cfg_lob_inline_threshold = 262144  # in bytes. Fallback
+        self.cfg_document_cache = False  # Needs fetch_lazy_lobs and a hash column or DBMS_CRYPTO. Fallback
+        self.cfg_document_cache_dir = 'cache'  # Fallback
+        self.cfg_document_cache_max_size = 268435456  # in bytes. Fallback
+        self.cfg_document_hash_expression = "DBMS_CRYPTO.HASH(cip_blob, 4)"  # SHA-256 of the BLOB. Fallback
+        self.cfg_ack_batch_size = 50  # Fallback
+        self.cfg_ack_max_wait_time = 2  # in seconds. Fallback
+        self.cfg_job_leasing = False  # Needs job_fetcher.JOB_LEASING_DDL. Fallback
+        self.cfg_lease_time = 300  # in seconds. Fallback
+        self.cfg_housekeeping = False  # Removes the old processed rows. Fallback
+        self.cfg_housekeeping_interval = 3600  # in seconds. Fallback
+        self.cfg_housekeeping_retention_days = 30  # Fallback
+        self.cfg_housekeeping_batch_size = 500  # rows per commit, 500 at most. Fallback
+        self.cfg_housekeeping_max_batches = 20  # per run and connection. Fallback
+        self.cfg_housekeeping_date_column = 'cip_insert_date'  # Needs schema_support.HOUSEKEEPING_DATE_DDL. Fallback
+        self.cfg_job_journal = False  # Fallback
+        self.cfg_job_journal_file_name = "CoreTechPrintAgent.journal"  # Fallback
+        self.cfg_job_journal_fsync_interval = 0.2  # in seconds. Fallback
+        self.cfg_metrics_enabled = True  # Fallback
+        self.cfg_metrics_file_name = "CoreTechPrintAgent.prom"  # Fallback
+        self.cfg_metrics_export_interval = 15  # in seconds. Fallback
+        self.cfg_metrics_http_port = 0  # 0 = no http endpoint. Fallback
+        self.cfg_config_check_time = 5  # in seconds, without watchdog. Fallback
+        self.cfg_config_debounce_time = 1  # in seconds. Fallback
+        self.cfg_email_port = 25  # Fallback
+        self.cfg_email_sender = 'pritning.agent@coretechnology.ie'  # Fallback
+        self.cfg_email_queue_size = 100  # Fallback
+        self.cfg_email_timeout = 10  # in seconds. Fallback
+        self.cfg_oracle_pool_min = 1  # Fallback
+        self.cfg_oracle_pool_max = 4  # Fallback
+        self.cfg_oracle_statement_cache_size = 50  # Fallback
+        self.cfg_oracle_ping_interval = 60  # in seconds. Fallback
+        self.cfg_oracle_retry_max_wait_time = 300  # in seconds. Fallback
+        self.cfg_sumatra_command = 'SumatraPDF.exe'  # Fallback
+        self.cfg_lpr_command = 'lpr'  # Fallback
+        self.cfg_print_command_shell = False  # Fallback
+        self.cfg_logging_format = 'TEXT'  # TEXT or JSON (lines). Fallback
+        self.cfg_logging_job_sample_rate = 1  # Share of the jobs with DEBUG and INFO records logged. Fallback
+        self.cfg_print_command_timeout = 120  # in seconds, then the command is killed. Fallback
+        self.cfg_laser_print_backend = 'SPAWN'  # SPAWN (one SumatraPDF per job) or BATCH. Fallback
+        self.cfg_laser_batch_size = 10  # LASER jobs of a printer printed by one SumatraPDF with BATCH. Fallback
+        self.cfg_print_max_attempts = 3  # Fallback
+        self.cfg_print_retry_wait_time = 10  # in seconds. Fallback
+        self.cfg_printer_failure_threshold = 5  # Failures in a row that park the jobs of a printer. Fallback
+        self.cfg_printer_open_time = 30  # in seconds, doubled on each failed probe. Fallback
+        self.cfg_printer_max_open_time = 600  # in seconds. Fallback
+        self.cfg_text_print_transport = 'LPR'  # LPR, STDIN (lpr reading stdin), LPD or RAW. Fallback
+        self.cfg_spool_dir = 'temp'  # Can be a RAM disk. Fallback
+        self.cfg_spool_chunk_size = 262144  # in bytes. Fallback
+        self.cfg_printer_socket_timeout = 30  # in seconds. Fallback
+        self.cfg_lpd_queue_name = 'lp'  # Fallback
+        self.cfg_lpd_file_type = 'f'  # Fallback
+        self.cfg_raw_keep_connections = False  # Checked before reuse. Fallback
+        self.cfg_text_encoding = 'ISO-8859-1'  # Fallback
+        self.cfg_text_newline = 'strip'  # strip, keep, crlf or lf. Fallback
+        self.cfg_text_encoding_errors = 'replace'  # strict fails the job. Fallback
+        self.cfg_wakeup_source = 'POLLING'  # POLLING or DBMS_ALERT. Fallback
+        self.cfg_wakeup_adaptive_polling = False  # Fallback
+        self.cfg_wakeup_min_pause_time = 0.5  # in seconds. Fallback
+        self.cfg_wakeup_max_pause_time = 10  # in seconds, execution_pause_time at most. Fallback
+        self.cfg_wakeup_backoff_factor = 2  # Fallback
         self.oracle_connections_list = []
+        self.pollers = []
+        self.stop_event = threading.Event()
+        self.startup_timer = StartupTimer()
+        # Supervisor mode, set in the worker processes: its name (used in its file names), the oracle_connections
+        # it polls and its heartbeat for the supervisor
+        self.worker_name = None
+        self.worker_number = 0
+        self.connection_indexes = None
+        self.heartbeat = None
+        self.cfg_supervisor_mode = False  # Worker processes started by a supervisor. Fallback
+        self.cfg_supervisor_workers = 0  # 0 = one worker per oracle connection. Fallback
+        self.cfg_supervisor_heartbeat_timeout = 300  # in seconds without progress, then killed. Fallback
+        self.cfg_supervisor_max_worker_memory = 0  # in bytes, needs psutil. 0 = no limit. Fallback
+        self.cfg_supervisor_drain_time = 60  # in seconds to finish the jobs printing on stop. Fallback
+        self.cfg_supervisor_restart_wait_time = 5  # in seconds, doubles after every crash in a row. Fallback
 
     # Define a signal handler function
     def signal_handler(self, signal, frame):
         print(signal)
 
+        # run() stops the pollers and the print workers and closes the connections
+        self.stop_event.set()
+
+    def shutdown(self):
+        self.logger.debug('Shutting down...')
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+
+        if self.housekeeper is not None:
+            self.housekeeper.stop()
+
+        self.stop_pollers(drain=False)
+
+        if self.dispatcher is not None:
+            # The jobs printing are finished before the rows are updated and the journal closed. A supervisor
+            # kills its workers supervisor_drain_time seconds after asking them to stop, a few seconds are kept
+            # for the updates
+            drain_time = float(self.get_main_config("supervisor_drain_time", self.cfg_supervisor_drain_time))
+            self.dispatcher.stop(timeout=max(1.0, drain_time - 5))
+            # Update the jobs printed before the workers stopped
+            for job in self.dispatcher.get_completed_jobs(timeout=0):
+                job.oracle_connection.ack_batcher.add(job.cip_id, job.out)
+
+        self.flush_all_acks()
         self.close_all_oracle_connections()
-        sys.exit(0)
+
+        if self.text_transport is not None:
+            self.text_transport.close()
+
+        if self.document_cache is not None:
+            self.document_cache.log_stats()
+
+        if self.spool is not None:
+            self.spool.close()
+
+        if self.journal is not None:
+            self.journal.close()
+
+        if self.metrics is not None:
+            self.metrics.stop()
+
+        self.stop_alert_mailer()
 
     def add_oracle_connection(self, connection_index, connection_name, username, password, host, port, service,
                               oracle_retry_wait_time, connection_status, email_on_error, email_on_error_freq):
         connection = OracleConnection(connection_index, connection_name, username, password, host, port, service,
-                                      oracle_retry_wait_time, connection_status, email_on_error, email_on_error_freq)
+                                      oracle_retry_wait_time, connection_status, email_on_error, email_on_error_freq,
+                                      self.get_main_config("oracle_pool_min", self.cfg_oracle_pool_min),
+                                      self.get_main_config("oracle_pool_max", self.cfg_oracle_pool_max),
+                                      self.get_main_config("oracle_statement_cache_size",
+                                                           self.cfg_oracle_statement_cache_size),
+                                      self.get_main_config("oracle_ping_interval", self.cfg_oracle_ping_interval),
+                                      self.get_main_config("oracle_retry_max_wait_time",
+                                                           self.cfg_oracle_retry_max_wait_time))
+        connection.ack_batcher = AckBatcher(connection, self.logger,
+                                            self.get_main_config("ack_batch_size", self.cfg_ack_batch_size),
+                                            self.get_main_config("ack_max_wait_time", self.cfg_ack_max_wait_time))
+        connection.ack_batcher.journal = self.journal
+        connection.ack_batcher.metrics = self.metrics
+        connection.ack_batcher.agent_id = self.leasing_agent_id()
         # print(connection.oracle_connection_name)
         self.oracle_connections_list.append(connection)
+        return connection
 
     def connect_all_oracle_connections(self):
         for connection in self.oracle_connections_list:
@@ -126,15 +405,20 @@ class pyAgent:
         else:
             logger.setLevel(logging.NOTSET)
 
+        # The listener of the previous settings writes its pending records first
+        if self.log_listener is not None:
+            self.log_listener.stop()
+            self.log_listener = None
+
         if logger.hasHandlers():
             # Retrieve existing handlers
-            existing_handlers = logger.handlers
+            existing_handlers = list(logger.handlers)
 
             # Remove existing handlers
             for handler in existing_handlers:
                 logger.removeHandler(handler)
 
-        handler = RotatingFileHandler(self.json_data["main"]["logging_file_name"], mode='a',
+        handler = RotatingFileHandler(self.worker_file_name(self.json_data["main"]["logging_file_name"]), mode='a',
                                       maxBytes=self.json_data["main"]["logging_max_file_size"],
                                       backupCount=self.json_data["main"]["logging_backup_count"])
 
@@ -153,10 +437,18 @@ class pyAgent:
         else:
             handler.setLevel(logging.NOTSET)
 
-        formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+        # TEXT, or JSON lines with the job, printer and connection of the records about a job
+        if self.get_main_config("logging_format", self.cfg_logging_format) == 'JSON':
+            formatter = JsonLinesFormatter()
+        else:
+            formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
         handler.setFormatter(formatter)
 
-        logger.addHandler(handler)
+        # The file is written and rotated by the listener thread
+        self.log_listener = LogListener(logger, [handler],
+                                        self.get_main_config("logging_job_sample_rate",
+                                                             self.cfg_logging_job_sample_rate))
+        self.log_listener.start()
 
         return logger
 
@@ -164,27 +456,38 @@ class pyAgent:
         logger = logging.getLogger('CoreTechPrintAgentStats')
         logger.setLevel(logging.DEBUG)
 
+        if self.stats_log_listener is not None:
+            self.stats_log_listener.stop()
+            self.stats_log_listener = None
+
         # DELETE EXISTING HANDLERS
         if logger.hasHandlers():
             # Retrieve existing handlers
-            existing_handlers = logger.handlers
+            existing_handlers = list(logger.handlers)
 
             # Remove existing handlers
             for handler in existing_handlers:
                 logger.removeHandler(handler)
 
         # CREATE NEW HANDLER
-        handler = RotatingFileHandler(self.json_data["main"]["stats_file_name"], mode='a',
+        stats_file_name = self.worker_file_name(self.json_data["main"]["stats_file_name"])
+        handler = RotatingFileHandler(stats_file_name, mode='a',
                                       maxBytes=self.json_data["main"]["stats_max_file_size"],
                                       backupCount=self.json_data["main"]["stats_backup_count"])
         handler.setLevel(logging.DEBUG)
 
         formatter = logging.Formatter("%(asctime)s,%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-        # header = '"Timestamp","Jobs Fetched","Jobs Printed","Jobs Failed"'
+
+        # CSV header on new stats files. One line per poller cycle
+        if not os.path.exists(stats_file_name) or os.path.getsize(stats_file_name) == 0:
+            handler.stream.write('"Timestamp","Connection","Jobs Fetched","Jobs Printed","Jobs Failed",'
+                                 '"Queue Depth","Backlog Age"\n')
+            handler.flush()
 
         handler.setFormatter(formatter)
 
-        logger.addHandler(handler)
+        self.stats_log_listener = LogListener(logger, [handler])
+        self.stats_log_listener.start()
 
         return logger
 
@@ -196,14 +499,58 @@ class pyAgent:
         self.loggerStats = self.setup_logger_stats()
         self.logger.debug('CoreTechPrintAgentStats Logger Enabled ')
 
+        self.setup_alert_mailer()
+
+    def stop_log_listeners(self):
+        for log_listener in (self.log_listener, self.stats_log_listener):
+            if log_listener is not None:
+                log_listener.stop()
+        self.log_listener = None
+        self.stats_log_listener = None
+
+    def setup_alert_mailer(self):
+        # Pending alerts of the old settings are sent (if due) before the new mailer starts
+        self.stop_alert_mailer()
+
+        self.alert_mailer = AlertMailer(self.logger, self.json_data["main"]["email_server"],
+                                        self.get_main_config("email_port", self.cfg_email_port),
+                                        self.get_main_config("email_sender", self.cfg_email_sender),
+                                        self.get_main_config("email_queue_size", self.cfg_email_queue_size),
+                                        self.get_main_config("email_timeout", self.cfg_email_timeout))
+        self.alert_mailer.start()
+
+        # CRITICAL messages are emailed too, by the new mailer only. The handler of the previous mailer is still on
+        # the logger when only the email settings were reloaded
+        for handler in list(self.logger.handlers):
+            if isinstance(handler, AlertMailerHandler):
+                self.logger.removeHandler(handler)
+        if self.get_main_config("email_on_critical", ""):
+            self.logger.addHandler(AlertMailerHandler(self.alert_mailer, self.json_data["main"]["email_on_critical"],
+                                                      'CoreTechPrintAgent CRITICAL - ' +
+                                                      self.json_data["main"]["client_name"]))
+
+    def stop_alert_mailer(self):
+        if self.alert_mailer is not None:
+            self.alert_mailer.stop()
+            self.alert_mailer = None
+
+    def report_connection_error(self, item_connection):
+        # Coalesced by the mailer, one email per email_on_error_freq seconds at most
+        self.alert_mailer.alert('CONNECTION ' + item_connection.oracle_connection_name,
+                                self.get_main_config("email_on_error", ""),
+                                'CoreTechPrintAgent ERROR - ' + self.json_data["main"]["client_name"],
+                                'Unable to connect to database - ' + item_connection.oracle_connection_name +
+                                ' -> ' + str(item_connection.last_error_message),
+                                item_connection.email_on_error_freq)
+
     def read_config_json(self):
 
         try:
             with open('config.JSON', 'r') as file:
 
                 # In case there was an old config, we store it to compare it
-                if self.json_data is not None:
-                    self.old_json_data = self.json_data
+                if self.raw_json_data is not None:
+                    self.old_json_data = self.raw_json_data
 
                 self.json_data = None
                 self.logger = None
@@ -211,15 +558,14 @@ class pyAgent:
                 self.logger_created = False
                 self.handler_created = False
 
-                # Get the Timestamp of the file
-                self.config_file_timestamp = os.path.getmtime('config.JSON')
-                # print(str(self.config_file_timestamp))
-
                 # Parse the JSON data
-                self.json_data = json.load(file)
+                self.json_data = self.select_worker_connections(json.load(file))
+                self.raw_json_data = copy.deepcopy(self.json_data)
 
-                # Compare old and new JSON
-                self.json_differences = diff(self.old_json_data, self.json_data)
+                # Compare old and new JSON. jsondiff is only loaded when there is an old one, it is slow to import
+                if self.old_json_data is not None:
+                    from jsondiff import diff
+                    self.json_differences = diff(self.old_json_data, self.json_data)
                 # print(self.json_differences)
 
         except FileNotFoundError as e:
@@ -228,83 +574,467 @@ class pyAgent:
             exit(1)
 
     def connect_to_db(self):
-        # Create the Oracle database connections
+        # Create the Oracle database connections and connect them all at the same time, each one on its own
+        # thread: the start of the agent waits for the slowest database (or the connect timeout of one that is
+        # down), not for all of them one after another
+        connections = []
         for oracle_connection_index, oracle_connection_data in self.json_data["oracle_connections"].items():
-            try:
-                self.add_oracle_connection(oracle_connection_index,
-                                           oracle_connection_data["oracle_connection_name"],
-                                           oracle_connection_data["oracle_username"],
-                                           oracle_connection_data["oracle_password"],
-                                           oracle_connection_data["oracle_host"],
-                                           oracle_connection_data["oracle_port"],
-                                           oracle_connection_data["oracle_service"],
-                                           oracle_connection_data["oracle_retry_wait_time"],
-                                           "NOT_SUCCESS",
-                                           oracle_connection_data["email_on_error"],
-                                           oracle_connection_data["email_on_error_freq"])
-
-                # Connect and close the Oracle connections through OracleConnection Class
-                self.connect_all_oracle_connections()
-
-            except Exception as err:
-                print(err.__str__())
-                self.logger.error(
-                    'Unable to connect to Oracle Database ' + oracle_connection_data[
-                        "oracle_connection_name"] + ': ' + err.__str__())
-
-            # print('STATUS after connection: ' + self.oracle_connections_list[0].connection_status)
-
-    def connection_alive(self):
-
-        for index, item_connection in enumerate(self.oracle_connections_list):
-            if item_connection.connection_status == 'NOT_SUCCESS':
-
-                # print('oracle_retry_wait_time:' + str(item_connection.oracle_retry_wait_time))
-                # print('email_on_error_freq:' + str(item_connection.email_on_error_freq))
-                # print (str(datetime.now()) + ' vs ' + str(item_connection.last_connection_attempt + timedelta(seconds=10)))
-
-                if datetime.now() > item_connection.last_connection_attempt + timedelta(
-                        seconds=int(item_connection.oracle_retry_wait_time)):
-                    item_connection.last_connection_attempt = datetime.now()
-                    item_connection.connect(self.logger)
-
-                if datetime.now() > item_connection.last_email_attempt + timedelta(
-                        seconds=int(item_connection.email_on_error_freq)):
-                    # print('EMAIL!')
-                    item_connection.last_email_attempt = datetime.now()
-                    self.logger.debug(
-                        "Sending email on Connection error to " + self.json_data["main"]["email_on_error"])
-                    self.send_email_on_connection_error('pritning.agent@coretechnology.ie',
-                                                        self.json_data["main"]["email_on_error"],
-                                                        item_connection.oracle_connection_name,
-                                                        item_connection.last_error_message)
-
-    def print_to_ip_printer(self):
+            connection = self.create_oracle_connection(oracle_connection_index, oracle_connection_data)
+            if connection is not None:
+                connections.append(connection)
+
+        threads = []
+        for connection in connections:
+            thread = threading.Thread(target=self.connect_oracle_connection, args=(connection,),
+                                      name='Connect-' + connection.oracle_connection_name, daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def open_oracle_connection(self, oracle_connection_index, oracle_connection_data):
+        connection = self.create_oracle_connection(oracle_connection_index, oracle_connection_data)
+        if connection is not None:
+            self.connect_oracle_connection(connection)
+        return connection
+
+    def create_oracle_connection(self, oracle_connection_index, oracle_connection_data):
+        connection = None
+        try:
+            connection = self.add_oracle_connection(oracle_connection_index,
+                                                    oracle_connection_data["oracle_connection_name"],
+                                                    oracle_connection_data["oracle_username"],
+                                                    oracle_connection_data["oracle_password"],
+                                                    oracle_connection_data["oracle_host"],
+                                                    oracle_connection_data["oracle_port"],
+                                                    oracle_connection_data["oracle_service"],
+                                                    oracle_connection_data["oracle_retry_wait_time"],
+                                                    "NOT_SUCCESS",
+                                                    oracle_connection_data["email_on_error"],
+                                                    oracle_connection_data["email_on_error_freq"])
+
+        except Exception as err:
+            print(err.__str__())
+            self.logger.error(
+                'Unable to connect to Oracle Database ' + oracle_connection_data[
+                    "oracle_connection_name"] + ': ' + err.__str__())
+
+        return connection
+
+    def connect_oracle_connection(self, connection):
+        # Connect through OracleConnection Class
+        try:
+            connection.connect(self.logger)
+        except Exception as err:
+            print(err.__str__())
+            self.logger.error('Unable to connect to Oracle Database ' + connection.oracle_connection_name + ': ' +
+                              err.__str__())
+
+        # print('STATUS after connection: ' + self.oracle_connections_list[0].connection_status)
+
+        if connection.connection_status == 'NOT_SUCCESS':
+            self.report_connection_error(connection)
+
+    def get_connection_config(self, item_connection, key, fallback):
+        # Settings of an oracle_connections entry, or the ones in "main" for all the connections
+        value = self.json_data["oracle_connections"][item_connection.oracle_connection_index].get(key)
+        return self.get_main_config(key, fallback) if value is None else value
+
+    def wakeup_pause_settings(self, item_connection):
+        # (min_pause_time, max_pause_time, backoff_factor, adaptive) of a connection. Fixed pause time between
+        # cycles unless adaptive polling is on
+        pause_time = self.get_connection_config(item_connection, "execution_pause_time",
+                                                None) or self.cfg_execution_pause_time
+        if not self.get_connection_config(item_connection, "wakeup_adaptive_polling",
+                                          self.cfg_wakeup_adaptive_polling):
+            return pause_time, pause_time, 1, False
+
+        # Idle connections are never polled less often than every execution_pause_time seconds
+        return (self.get_connection_config(item_connection, "wakeup_min_pause_time", self.cfg_wakeup_min_pause_time),
+                min(float(self.get_connection_config(item_connection, "wakeup_max_pause_time",
+                                                     self.cfg_wakeup_max_pause_time)), float(pause_time)),
+                self.get_connection_config(item_connection, "wakeup_backoff_factor", self.cfg_wakeup_backoff_factor),
+                True)
+
+    def create_wakeup(self, item_connection):
+        wakeup = Wakeup(self.logger, *self.wakeup_pause_settings(item_connection))
+
+        wakeup_source = self.get_connection_config(item_connection, "wakeup_source", self.cfg_wakeup_source)
+        if wakeup_source == 'DBMS_ALERT':
+            wakeup.add_source(DbmsAlertSource(item_connection, self.logger,
+                                              self.get_connection_config(item_connection, "wakeup_alert_name",
+                                                                         PRINT_ALERT_NAME),
+                                              retry_wait_time=item_connection.oracle_retry_wait_time))
+
+        return wakeup
+
+    def start_pollers(self):
+        # One poller per connection, each one with its own wakeup
+        for item_connection in self.oracle_connections_list:
+            self.start_poller(item_connection)
+
+        self.logger.info('Number of Config Database Connections: ' + str(len(self.pollers)))
+
+    def start_poller(self, item_connection):
+        poller = ConnectionPoller(self, item_connection, self.create_wakeup(item_connection))
+        poller.start()
+        self.pollers.append(poller)
+
+    def stop_poller(self, item_connection):
+        # Stops the poller of one connection once its current cycle is done
+        for poller in self.pollers:
+            if poller.oracle_connection is item_connection:
+                poller.stop()
+                poller.join()
+                self.pollers.remove(poller)
+                return
+
+    def stop_pollers(self, drain=True):
+        for poller in self.pollers:
+            poller.stop(drain)
+        for poller in self.pollers:
+            poller.join()
+        self.pollers = []
+
+    def connection_alive(self, item_connection):
+
+        # Ping the session now and then, a dropped connection is noticed before the next query
+        if item_connection.connection_status == 'SUCCESS':
+            item_connection.health_check(self.logger)
+
+        if item_connection.connection_status == 'NOT_SUCCESS':
+
+            if datetime.now() > item_connection.next_connection_attempt:
+                item_connection.connect(self.logger)
+
+                # The mailer never blocks, a slow mail server doesn't delay the poller
+                if item_connection.connection_status == 'SUCCESS':
+                    self.alert_mailer.resolve('CONNECTION ' + item_connection.oracle_connection_name)
+                else:
+                    self.report_connection_error(item_connection)
+
+    def print_to_ip_printer(self, printer_name, text_file, log_fields=None):
         # Construct the LPR command
-        # lpr_command = ["lpr", "-S", self.printer_name, "-P", "lp", self.text_file]
-        lpr_command = ["lpr", "-S", self.printer_name.split(',')[0], "-P", "lp", self.text_file]
+        # lpr_command = ["lpr", "-S", printer_name, "-P", "lp", text_file]
+        lpr_command = self.lpr_command + ["-S", printer_name.split(',')[0], "-P", "lp", text_file]
 
         # Execute the LPR command
         try:
-            self.out = subprocess.run(lpr_command, shell=True, check=True, capture_output=True, text=True)
-            self.logger.debug("File sent to IP printer successfully.")
+            out = run_command(lpr_command, self.print_command_shell, self.print_command_timeout, text=True)
+            out.check_returncode()
+            self.logger.debug("File %s sent to IP printer successfully.", text_file, extra=log_fields)
         except subprocess.CalledProcessError as e:
             # Handle the error here
-            self.out = str(e)
-            self.logger.error(f"Command execution failed with exit code {e.returncode}")
+            out = str(e)
+            self.logger.error("Command execution failed with exit code %s", e.returncode, extra=log_fields)
+        except subprocess.TimeoutExpired as e:
+            # run_command killed lpr and the processes it started
+            out = str(e)
+            self.logger.error("Command killed -> %s", e, extra=log_fields)
+        except OSError as e:
+            out = str(e)
+            self.logger.error("Command execution failed -> %s", e, extra=log_fields)
+
+        return out
+
+    def print_job(self, job):
+        # Called from the PrintDispatcher worker threads. Returns the output stored in cip_process_error
+        out = None
+        temp_file = job.file_id
+        metrics = self.metrics
+        # Formatted by the log listener thread, only when the level is enabled
+        log_fields = job_log_fields(job)
+        self.startup_timer.job_started(self.logger)
+
+        if job.printer_category == 'LASER':
+            laser_file = self.laser_job_file(job, log_fields)
+
+            # Print the file using SumatraPDF
+            try:
+                with metrics.timer(STAGE_PRINT_SPAWN, printer=job.printer_name):
+                    out = self.laser_backend.print_files(job.printer_name, [laser_file])[0]
+                self.laser_job_printed(job, out, log_fields)
+            except Exception as e:
+                # Handle the error here. On timeout run_command killed SumatraPDF
+                out = str(e)
+                job.failed = True
+                self.logger.error("Command execution failed -> %s", e, extra=log_fields)
+
+        elif job.printer_category == 'TEXT':
+            # Large CLOBs were encoded into a spool file by the poller as they were read
+            text_file = job.spool_file
+            encoder = self.text_encoder(job.printer_name)
+
+            if self.text_transport is not None:
+                # Send the CLOB data straight to the printer or to lpr stdin, without temp file
+                try:
+                    with metrics.timer(STAGE_PRINT_SPAWN, printer=job.printer_name):
+                        if text_file is not None:
+                            with open(text_file, 'rb') as file:
+                                out = self.text_transport.send(job.printer_name, file,
+                                                               temp_file + '_' + str(job.cip_id))
+                        else:
+                            out = self.text_transport.send(job.printer_name, encoder.encode(job.clob_data),
+                                                           temp_file + '_' + str(job.cip_id))
+                except (PrinterTransportError, UnicodeError, OSError) as e:
+                    out = str(e)
+                    job.failed = True
+                    self.logger.error("Job %s failed -> %s", job.cip_id, e, extra=log_fields)
+                return out
+
+            # Save the CLOB data to a file, kept for the retries
+            if text_file is None:
+                try:
+                    with metrics.timer(STAGE_TEMP_FILE_WRITE, printer=job.printer_name):
+                        text_file = job.spool_file = self.spool.spool_text(job.clob_data, job.cip_id, temp_file,
+                                                                           encoder)
+                    job.clob_data = None
+                except UnicodeError as e:
+                    job.failed = True
+                    self.logger.error("Job %s failed -> %s", job.cip_id, e, extra=log_fields)
+                    return str(e)
+
+            # Send it to the Printer through LPR
+            with metrics.timer(STAGE_PRINT_SPAWN, printer=job.printer_name):
+                out = self.print_to_ip_printer(job.printer_name, text_file, log_fields)
+            # print_to_ip_printer returns the error message when lpr fails
+            job.failed = isinstance(out, str)
+
+        return out
+
+    def print_job_batch(self, jobs):
+        # Called from the PrintDispatcher worker threads with LASER jobs queued for the same printer, printed by the
+        # BATCH backend with a single SumatraPDF. Sets the output and failed of every job. SumatraPDF doesn't tell
+        # which files of a failed batch it printed, the jobs are not printed again: they fail for good
+        metrics = self.metrics
+        printer_name = jobs[0].printer_name
+        self.startup_timer.job_started(self.logger)
+        if self.journal is not None:
+            for job in jobs:
+                self.journal.record_job(job, DISPATCHED)
+
+        jobs_log_fields = [job_log_fields(job) for job in jobs]
+        laser_files = [self.laser_job_file(job, log_fields) for job, log_fields in zip(jobs, jobs_log_fields)]
+        try:
+            with metrics.timer(STAGE_PRINT_SPAWN, printer=printer_name):
+                outs = self.laser_backend.print_files(printer_name, laser_files)
+            for job, out, log_fields in zip(jobs, outs, jobs_log_fields):
+                job.out = out
+                self.laser_job_printed(job, out, log_fields)
+        except Exception as e:
+            # On timeout run_command killed SumatraPDF, maybe after it printed some of the files
+            for job, log_fields in zip(jobs, jobs_log_fields):
+                job.out = 'Batch of ' + str(len(jobs)) + ' files failed, the file may have printed already -> ' + str(e)
+                job.failed = True
+                self.logger.error("Command execution failed -> %s", e, extra=log_fields)
+
+        for job in jobs:
+            if job.failed:
+                job.retry = False
+
+    def laser_job_file(self, job, log_fields):
+        # Usually spooled by the poller as the BLOB was read, or in the document cache. Kept for the retries
+        laser_file = job.cached_document or job.spool_file
+        if laser_file is None:
+            with self.metrics.timer(STAGE_TEMP_FILE_WRITE, printer=job.printer_name):
+                laser_file = job.spool_file = self.spool.spool_bytes(job.blob_data, job.cip_id, job.file_id)
+            job.blob_data = None
+            self.logger.debug("File saved to %s successfully.", laser_file, extra=log_fields)
+        return laser_file
+
+    def laser_job_printed(self, job, out, log_fields):
+        job.failed = out.returncode != 0
+        if job.failed:
+            self.logger.error("SumatraPDF failed printing %s -> %s", job.file_id, out, extra=log_fields)
+        else:
+            self.logger.debug("File %s sent to the printer successfully. %s", job.file_id, out, extra=log_fields)
+
+    def job_finished(self, job):
+        # Called by the dispatcher once the job won't be printed again: printed, or failed for good. A failed job
+        # printed again later stays DISPATCHED in the journal, it is printed again after a crash.
+        # The spool files are deleted by the spool thread, off the worker, the cached documents stay for the next jobs
+        if self.journal is not None:
+            self.journal.record_job(job, PRINTED)
+        if job.cached_document is not None:
+            self.document_cache.release(job.cached_document)
+            job.cached_document = None
+        if job.spool_file is not None:
+            self.spool.remove(job.spool_file)
+            job.spool_file = None
+
+    def print_journaled_job(self, job):
+        # The journal knows the job was printed even if the agent stops before the row is updated, see job_finished
+        self.journal.record_job(job, DISPATCHED)
+        return self.print_job(job)
+
+    def flush_all_acks(self):
+        for connection in self.oracle_connections_list:
+            connection.ack_batcher.flush()
+
+    def setup_fetcher(self):
+        # job_leasing and agent_id need a restart: the rows leased to this agent are renewed and updated with the
+        # agent_id they were leased with until they are printed
+        if self.fetcher is None:
+            job_leasing = self.get_main_config("job_leasing", self.cfg_job_leasing)
+            agent_id = self.get_main_config("agent_id", None) or socket.gethostname()
+        else:
+            job_leasing = self.fetcher.leasing
+            agent_id = self.fetcher.agent_id
+
+        self.fetcher = JobFetcher(self.logger,
+                                  self.get_main_config("fetch_streaming", self.cfg_fetch_streaming),
+                                  self.get_main_config("fetch_page_size", self.cfg_fetch_page_size),
+                                  self.get_main_config("fetch_arraysize", self.cfg_fetch_arraysize),
+                                  self.get_main_config("fetch_prefetchrows", self.cfg_fetch_prefetchrows),
+                                  self.get_main_config("fetch_max_rows_per_cycle", self.cfg_fetch_max_rows_per_cycle),
+                                  job_leasing, agent_id,
+                                  self.get_main_config("lease_time", self.cfg_lease_time),
+                                  self.get_main_config("priority_column", None),
+                                  self.get_main_config("fetch_lazy_lobs", self.cfg_fetch_lazy_lobs),
+                                  self.get_main_config("lob_inline_threshold", self.cfg_lob_inline_threshold),
+                                  self.document_cache,
+                                  self.get_main_config("document_hash_expression",
+                                                       self.cfg_document_hash_expression),
+                                  self.get_main_config("fetch_pending_index", self.cfg_fetch_pending_index))
+        self.print_queue_size = max(1, int(self.get_main_config("print_queue_size", self.cfg_print_queue_size)))
+        for connection in self.oracle_connections_list:
+            connection.ack_batcher.agent_id = self.leasing_agent_id()
+
+    def leasing_agent_id(self):
+        # The printed rows are only updated while they are leased to this agent
+        if self.fetcher is None or not self.fetcher.leasing:
+            return None
+        return self.fetcher.agent_id
+
+    def setup_housekeeper(self):
+        # Processed rows older than housekeeping_retention_days purged, or moved to housekeeping_archive_table (see
+        # schema_support.ARCHIVE_TABLE_DDL), in the background
+        if self.housekeeper is not None:
+            self.housekeeper.stop()
+            self.housekeeper = None
+
+        if not self.get_main_config("housekeeping", self.cfg_housekeeping):
+            return
+
+        self.housekeeper = Housekeeper(self.logger, lambda: list(self.oracle_connections_list),
+                                       self.get_main_config("housekeeping_interval", self.cfg_housekeeping_interval),
+                                       self.get_main_config("housekeeping_retention_days",
+                                                            self.cfg_housekeeping_retention_days),
+                                       self.get_main_config("housekeeping_batch_size",
+                                                            self.cfg_housekeeping_batch_size),
+                                       self.get_main_config("housekeeping_max_batches",
+                                                            self.cfg_housekeeping_max_batches),
+                                       self.get_main_config("housekeeping_date_column",
+                                                            self.cfg_housekeeping_date_column),
+                                       self.get_main_config("housekeeping_archive_table", None))
+        self.housekeeper.start()
+
+    def setup_scheduler(self):
+        # Priorities are numbers, higher prints first. Rate limits are jobs per minute, 0 for no limit
+        self.dispatcher.configure_scheduler(self.get_main_config("printer_priorities", {}),
+                                            self.get_main_config("category_priorities", {}),
+                                            self.get_main_config("priority_aging_time",
+                                                                 self.cfg_priority_aging_time),
+                                            self.get_main_config("printer_rate_limit", self.cfg_printer_rate_limit),
+                                            self.get_main_config("printer_rate_limits", {}))
+        self.dispatcher.configure_printer_health(self.get_main_config("printer_failure_threshold",
+                                                                      self.cfg_printer_failure_threshold),
+                                                 self.get_main_config("printer_open_time", self.cfg_printer_open_time),
+                                                 self.get_main_config("printer_max_open_time",
+                                                                      self.cfg_printer_max_open_time),
+                                                 self.get_main_config("print_max_attempts",
+                                                                      self.cfg_print_max_attempts),
+                                                 self.get_main_config("print_retry_wait_time",
+                                                                      self.cfg_print_retry_wait_time))
+
+    def setup_print_commands(self):
+        # The commands can be a string or a list, e.g. a stub printer for the benchmarks
+        self.sumatra_command = self.get_main_config("sumatra_command", self.cfg_sumatra_command)
+        if isinstance(self.sumatra_command, str):
+            self.sumatra_command = [self.sumatra_command]
+        self.lpr_command = self.get_main_config("lpr_command", self.cfg_lpr_command)
+        if isinstance(self.lpr_command, str):
+            self.lpr_command = [self.lpr_command]
+        self.print_command_shell = self.get_main_config("print_command_shell", self.cfg_print_command_shell)
+        # 0 for no timeout
+        self.print_command_timeout = float(self.get_main_config("print_command_timeout",
+                                                                self.cfg_print_command_timeout)) or None
+
+        # LASER jobs printed one SumatraPDF per job, or a batch of the jobs queued for a printer at a time
+        if self.get_main_config("laser_print_backend", self.cfg_laser_print_backend) == BATCH:
+            self.laser_backend = BatchLaserBackend(self.logger, self.sumatra_command, self.print_command_shell,
+                                                   self.print_command_timeout)
+            self.laser_batch_size = max(1, int(self.get_main_config("laser_batch_size", self.cfg_laser_batch_size)))
+        else:
+            self.laser_backend = SpawnLaserBackend(self.logger, self.sumatra_command, self.print_command_shell,
+                                                   self.print_command_timeout)
+            self.laser_batch_size = 1
+        if self.dispatcher is not None:
+            self.dispatcher.configure_batching(self.laser_batch_size, ('LASER',))
+
+    def setup_print_transports(self):
+        # In-process LPD or RAW client for TEXT printers, or None to keep spawning lpr
+        if self.text_transport is not None:
+            self.text_transport.close()
+
+        text_print_transport = self.get_main_config("text_print_transport", self.cfg_text_print_transport)
+        timeout = self.get_main_config("printer_socket_timeout", self.cfg_printer_socket_timeout)
+
+        if text_print_transport == 'LPD':
+            self.text_transport = LpdTransport(self.logger,
+                                               self.get_main_config("lpd_queue_name", self.cfg_lpd_queue_name),
+                                               self.get_main_config("lpd_file_type", self.cfg_lpd_file_type),
+                                               timeout)
+        elif text_print_transport == 'RAW':
+            self.text_transport = RawTransport(self.logger, timeout,
+                                               self.get_main_config("raw_keep_connections",
+                                                                    self.cfg_raw_keep_connections))
+        elif text_print_transport == 'STDIN':
+            self.text_transport = CommandTransport(self.logger, self.lpr_command, self.print_command_shell,
+                                                   timeout=self.print_command_timeout)
+        else:
+            self.text_transport = None
 
-    def refresh_config_file(self):
+        self.logger.debug('TEXT print transport: ' + str(text_print_transport))
 
-        if self.config_file_timestamp < os.path.getmtime('config.JSON'):
-            self.logger.debug(
-                'Config File updated => Old Timestamp[' + str(self.config_file_timestamp) + '] vs New Timestamp[' + str(
-                    os.path.getmtime('config.JSON')) + ']')
-            return True
+        self.setup_text_encoders()
 
-    def run(self):
+    def setup_text_encoders(self):
+        # text_printer_transforms overrides the encoding, newline policy and error handling per TEXT printer, e.g.
+        # {"10.0.0.5": {"encoding": "cp437", "newline": "crlf"}, "ZEBRA01": {"passthrough": true}}
+        default_settings = {"encoding": self.get_main_config("text_encoding", self.cfg_text_encoding),
+                            "newline": self.get_main_config("text_newline", self.cfg_text_newline),
+                            "errors": self.get_main_config("text_encoding_errors", self.cfg_text_encoding_errors)}
+        try:
+            default_text_encoder = TextEncoder(**default_settings)
+        except (LookupError, ValueError) as e:
+            self.logger.error('Invalid TEXT encoding settings, ISO-8859-1 used -> ' + str(e))
+            default_text_encoder = TextEncoder()
+
+        text_encoders = {}
+        for printer_name, settings in self.get_main_config("text_printer_transforms", {}).items():
+            try:
+                text_encoders[printer_name] = TextEncoder(**dict(default_settings, **settings))
+            except (LookupError, ValueError, TypeError) as e:
+                self.logger.error('Invalid text_printer_transforms for ' + printer_name + ' -> ' + str(e))
+
+        # Replaced at once, the workers and the pollers may be using them
+        self.text_encoders = text_encoders
+        self.default_text_encoder = default_text_encoder
+
+    def text_encoder(self, printer_name):
+        # By cip_printer_name, or by the host lpr -S gets
+        text_encoder = self.text_encoders.get(printer_name)
+        if text_encoder is None:
+            text_encoder = self.text_encoders.get(printer_name.split(',')[0], self.default_text_encoder)
+        return text_encoder
+
+    def get_main_config(self, key, fallback):
+        # Optional settings in the "main" section of config.JSON
+        value = self.json_data["main"].get(key)
+        return fallback if value is None else value
 
-        blob_data = None
-        clob_data = None
+    def run(self):
 
         self.logger.debug('Run() - Process start')
 
@@ -314,12 +1044,14 @@ class pyAgent:
 
         # Check for Sumatra app
         # Handle the "command not found" error here
-        if not os.path.exists('SumatraPDF.exe'):
+        self.setup_print_commands()
+        if not os.path.exists(self.sumatra_command[0]) and shutil.which(self.sumatra_command[0]) is None:
             self.logger.critical(
                 "SumatraPDF.exe command not found in App root folder. Make sure it is in the App root folder.")
             print(
                 "SumatraPDF.exe command not found in App root folder. Make sure it is in the App root folder.")
             exit(1)
+        self.startup_timer.phase_done('print_commands')
 
         try:
             cx_Oracle.init_oracle_client(lib_dir=self.json_data["main"]["oracle_client"])
@@ -328,157 +1060,306 @@ class pyAgent:
             self.logger.critical("Unable to find the Oracle Instance " + err.__str__())
             print('ERROR - Unable to find the Oracle Instance in folder: ' + self.json_data["main"]["oracle_client"])
             exit(1)
+        self.startup_timer.phase_done('oracle_client')
+
+        # Counters and stage timings
+        self.metrics = AgentMetrics(self.logger, self.get_main_config("metrics_enabled", self.cfg_metrics_enabled))
+
+        # Open the local job journal before any job is fetched
+        if self.get_main_config("job_journal", self.cfg_job_journal):
+            self.journal = JobJournal(self.logger,
+                                      self.worker_file_name(self.get_main_config("job_journal_file_name",
+                                                                                 self.cfg_job_journal_file_name)),
+                                      self.get_main_config("job_journal_fsync_interval",
+                                                           self.cfg_job_journal_fsync_interval))
+            self.journal.open()
+
+        # Print files, created by the pollers and deleted after printing
+        self.spool = PrintSpool(self.logger, self.worker_dir(self.get_main_config("spool_dir", self.cfg_spool_dir)),
+                                self.get_main_config("spool_chunk_size", self.cfg_spool_chunk_size))
+        self.spool.open()
+
+        # Documents printed again are taken from the cache
+        if self.get_main_config("document_cache", self.cfg_document_cache):
+            self.document_cache = DocumentCache(self.logger, self.spool,
+                                                self.worker_dir(self.get_main_config("document_cache_dir",
+                                                                                     self.cfg_document_cache_dir)),
+                                                self.get_main_config("document_cache_max_size",
+                                                                     self.cfg_document_cache_max_size))
+            self.document_cache.open()
+        self.startup_timer.phase_done('local_files')
 
         # Connect to all Databases
         self.connect_to_db()
-
-        # after first time connection attempt, we can store the time to use it later so send emails
-        for index, item_connection in enumerate(self.oracle_connections_list):
-            item_connection.last_connection_attempt = datetime.now()
-            item_connection.last_email_attempt = datetime.now()
-
-        while True:
+        self.startup_timer.phase_done('connect')
+
+        # Start the print workers
+        self.dispatcher = PrintDispatcher(self.print_job if self.journal is None else self.print_journaled_job,
+                                          self.logger,
+                                          self.get_main_config("print_worker_count", self.cfg_print_worker_count),
+                                          self.get_main_config("printer_max_concurrency",
+                                                               self.cfg_printer_max_concurrency),
+                                          self.job_finished, self.print_job_batch)
+        self.dispatcher.configure_batching(self.laser_batch_size, ('LASER',))
+        self.dispatcher.metrics = self.metrics
+        self.setup_scheduler()
+        self.dispatcher.start()
+
+        self.metrics.register_gauge('queue_depth', self.dispatcher.pending_jobs)
+        self.metrics.register_gauge('backlog_age_seconds', self.dispatcher.oldest_pending_age)
+        if self.document_cache is not None:
+            self.metrics.register_gauge('document_cache_hit_ratio', self.document_cache.hit_ratio)
+            self.metrics.register_gauge('document_cache_bytes_saved', lambda: self.document_cache.bytes_saved)
+            self.metrics.register_gauge('document_cache_size_bytes', lambda: self.document_cache.size)
+        metrics_http_port = int(self.get_main_config("metrics_http_port", self.cfg_metrics_http_port))
+        if metrics_http_port and self.worker_number:
+            # One port per worker, from metrics_http_port on
+            metrics_http_port += self.worker_number - 1
+        self.metrics.start(self.worker_file_name(self.get_main_config("metrics_file_name",
+                                                                      self.cfg_metrics_file_name)),
+                           self.get_main_config("metrics_export_interval", self.cfg_metrics_export_interval),
+                           metrics_http_port)
+
+        self.setup_fetcher()
+        self.setup_print_transports()
+
+        self.startup_timer.phase_done('dispatcher')
+
+        # Start polling every connection on its own thread
+        self.start_pollers()
+        self.startup_timer.phase_done('pollers')
+
+        self.setup_housekeeper()
+        self.metrics.register_gauge('housekeeping_rows_removed',
+                                    lambda: self.housekeeper.rows_removed if self.housekeeper is not None else 0)
+
+        # The coordinator only looks after config changes until it is asked to stop
+        self.config_watcher = ConfigWatcher(self.logger, 'config.JSON',
+                                            self.get_main_config("config_debounce_time",
+                                                                 self.cfg_config_debounce_time),
+                                            self.cfg_config_check_time)
+        self.config_watcher.start()
+        self.startup_timer.ready(self.logger)
+
+        while not self.stop_event.is_set():
+            self.send_heartbeat()
 
             # Check for changes in the Config File
-            if self.refresh_config_file():
+            if self.config_watcher.changed_event.wait(1):
+                self.config_watcher.changed_event.clear()
                 self.logger.debug('Config Data was updated. Proceed to reload config...')
-                # Close existing Connections
-                self.logger.debug('Closing existing Database Connections for safety...')
-                self.close_all_oracle_connections()
-                # Reset the connections List
-                self.oracle_connections_list = []
-                # Read Config File again
-                self.logger.debug('Reading the new configuration from file...')
-                self.read_config_json()
-                self.setup_loggers()
-                self.logger.info('Config Changes in file: ' + str(self.json_differences))
-                self.logger.debug('Decrypting credentials...')
-                # Decrypt data
-                self.decrypt_credentials()
-                # Connect to DBs
-                self.logger.debug('Reconnecting to Database ...')
-                self.connect_to_db()
-                continue
-
-            self.logger.info('Number of Config Database Connections: ' + str(len(self.oracle_connections_list)))
-
-            # Now we have the connections, so loop on Connections and execute the queries
-            for index, item_connection in enumerate(self.oracle_connections_list):
-
-                # Check if connection is alive. If it is not, try to reconnect
-                self.connection_alive()
-
-                # print(item_connection.last_connection_attempt)
-
-                # If a connection is down, we don't try to run any query
-                if item_connection.connection_status == 'NOT_SUCCESS':
+                self.reload_config()
+
+        self.shutdown()
+
+    def send_heartbeat(self):
+        # Supervisor mode: the last time all the pollers made progress. A poller stuck in a query or an update
+        # holds it back, then the supervisor kills the worker
+        if self.heartbeat is None:
+            return
+        now = time.monotonic()
+        self.heartbeat.value = min([now if poller.sleeping else poller.last_active for poller in self.pollers] +
+                                   [now])
+
+    def worker_file_name(self, file_name):
+        # Every worker has its own files in supervisor mode, e.g. CoreTechPrintAgent-worker1.log
+        if not file_name or self.worker_name is None:
+            return file_name
+        root, extension = os.path.splitext(file_name)
+        return root + '-' + self.worker_name + extension
+
+    def worker_dir(self, dir_name):
+        # And its own folders, inside the configured ones
+        if self.worker_name is None:
+            return dir_name
+        return os.path.join(dir_name, self.worker_name)
+
+    def select_worker_connections(self, json_data):
+        # A worker only sees its own oracle_connections, the ones added later are given to the workers by the
+        # supervisor
+        if self.connection_indexes is not None:
+            json_data["oracle_connections"] = {index: oracle_connection_data for index, oracle_connection_data
+                                               in json_data["oracle_connections"].items()
+                                               if index in self.connection_indexes}
+        return json_data
+
+    def supervisor_partitions(self, json_data):
+        from agent_supervisor import partition_connections
+        return partition_connections(json_data["oracle_connections"].keys(),
+                                     json_data["main"].get("supervisor_workers") or self.cfg_supervisor_workers)
+
+    def run_supervisor(self):
+        # Supervisor mode: this process only starts and watches the worker processes (see AgentSupervisor). Not
+        # imported otherwise, multiprocessing slows down the start of the agent
+        from agent_supervisor import AgentSupervisor
+
+        self.logger.debug('Run() - Supervisor start')
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        signal.signal(signal.SIGINT, self.signal_handler)
+
+        supervisor = AgentSupervisor(self.logger, run_worker,
+                                     self.get_main_config("supervisor_heartbeat_timeout",
+                                                          self.cfg_supervisor_heartbeat_timeout),
+                                     self.get_main_config("supervisor_max_worker_memory",
+                                                          self.cfg_supervisor_max_worker_memory),
+                                     self.get_main_config("supervisor_drain_time", self.cfg_supervisor_drain_time),
+                                     self.get_main_config("supervisor_restart_wait_time",
+                                                          self.cfg_supervisor_restart_wait_time))
+        partitions = self.supervisor_partitions(self.json_data)
+        supervisor.start(partitions)
+
+        # The workers reload their own config, the supervisor only shares the connections out again when they
+        # are added or removed
+        config_watcher = ConfigWatcher(self.logger, 'config.JSON',
+                                       self.get_main_config("config_debounce_time", self.cfg_config_debounce_time),
+                                       self.cfg_config_check_time)
+        config_watcher.start()
+
+        while not self.stop_event.is_set():
+            supervisor.check()
+
+            if config_watcher.changed_event.wait(1):
+                config_watcher.changed_event.clear()
+                try:
+                    with open('config.JSON', 'r') as file:
+                        new_partitions = self.supervisor_partitions(json.load(file))
+                except (OSError, ValueError, KeyError) as e:
+                    self.logger.error('Config File not reloaded, it could not be read -> ' + str(e))
                     continue
+                if new_partitions != partitions:
+                    self.logger.info('Oracle connections changed, the workers are started again')
+                    supervisor.stop()
+                    partitions = new_partitions
+                    supervisor.start(partitions)
+
+        config_watcher.stop()
+        self.logger.debug('Shutting down the workers...')
+        supervisor.stop()
+        self.stop_alert_mailer()
+
+    def reload_config(self):
+        # Applies what changed in config.JSON, according to jsondiff, and leaves the rest running: only the
+        # connections added, removed or changed are closed and opened
+        try:
+            with open('config.JSON', 'r') as file:
+                raw_json_data = self.select_worker_connections(json.load(file))
+        except (OSError, ValueError) as e:
+            self.logger.error('Config File not reloaded, it could not be read -> ' + str(e))
+            return
+
+        # Not imported at startup, it takes a while to load and is only needed when the config changes
+        from jsondiff import diff, replace
+
+        self.json_differences = diff(self.raw_json_data, raw_json_data)
+        if not self.json_differences:
+            return
+        self.logger.info('Config Changes in file: ' + str(self.json_differences))
+
+        old_raw_json_data = self.raw_json_data
+        old_json_data = self.json_data
+
+        main_differences = self.json_differences.get("main")
+        connections_differences = self.json_differences.get("oracle_connections")
+        if replace in self.json_differences or set(self.json_differences) - {"main", "oracle_connections"}:
+            # The file was rewritten rather than edited, the sections are compared key by key
+            main_differences = connections_differences = replace
+
+        main_keys = changed_keys(main_differences, old_raw_json_data["main"], raw_json_data["main"])
+        connection_indexes = changed_keys(connections_differences, old_raw_json_data["oracle_connections"],
+                                          raw_json_data["oracle_connections"])
 
-                # Open a new cursor
-                cursor = item_connection.connection.cursor()
-                # print(self.json_data["oracle_connections"][str(index)]["oracle_connection_name"])
-                self.logger.debug(
-                    'Run() - Prepare Query in Database ' + self.json_data["oracle_connections"][str(index)][
-                        "oracle_connection_name"])
-
-                # Retrieve rows from cent_iface_print table where cip_processed = 'N'
-                query = "SELECT cip_blob, cip_id, cip_file_id, cip_printer_name, cip_clob, cip_printer_category FROM cent_iface_print WHERE nvl(cip_process_ind, 'N') = 'N' "
-                cursor.execute(query)
-
-                self.logger.debug('Run() - Query Executed')
-
-                rows = cursor.fetchall()
-
-                # Get the number of rows fetched
-                self.current_rows_fetched = str(cursor.rowcount)
-                # print("Fetching " + str(current_rows_fetched) + " rows")
-                self.logger.debug('Number of rows fetched to be printed: ' + self.current_rows_fetched)
-
-                # Process each row
-                for row in rows:
-
-                    if row[0] is not None:
-                        blob_data = row[0].read()  # Assuming cip_blob_file is of BLOB type
-
-                    row_cip_id = row[1]
-                    temp_file = row[2]
-                    self.printer_name = row[3]
-
-                    if row[4] is not None:
-                        clob_data = row[4]
-
-                    # TEXT or LASER
-                    printer_type = row[5]
-
-                    # create the folder in advance if it doesn't exit
-                    if not os.path.exists('temp\\'):
-                        try:
-                            self.logger.warning(f"Folder temp\\ does not exist. Needs to be created.")
-                            os.makedirs('temp\\')
-                            self.logger.warning(f"Folder temp\\ created.")
-                        except FileExistsError:
-                            pass  # Ignore the error if the directory already exists
-
-                    if printer_type == 'LASER':
-                        # Create a file-like object from the BLOB data
-                        # Save the BLOB data to a file
-                        with open('temp\\' + temp_file, 'wb') as file:
-                            file.write(blob_data)
-                        self.logger.debug(f"File saved to temp\\" + temp_file + " successfully.")
-
-                        # Print the file using SumatraPDF
-                        try:
-                            print_command = ['SumatraPDF.exe', '-silent', '-print-to', self.printer_name,
-                                             'temp\\' + temp_file]
-                            self.out = subprocess.run(print_command, shell=True, capture_output=True, text=True)
-                            self.logger.debug(f"File {temp_file} sent to the printer successfully.")
-                            self.logger.debug(self.out)
-                        except Exception as e:
-                            # Handle the error here
-                            self.logger.error(f"Command execution failed with exit code {e}")
-                            self.logger.error(f"Error output: {e}")
-
-                        # Delete the file after successful printing
-                        os.remove('temp\\' + temp_file)
-                        self.logger.debug(f"File {temp_file} deleted.")
-
-                    elif printer_type == 'TEXT':
-                        # Save the CLOB data to a file
-                        self.text_file = 'temp\\' + temp_file + '_' + str(row_cip_id) + '.txt'
-
-                        # print(clob_data)
-
-                        with open(self.text_file, "w", encoding="ISO-8859-1") as file:
-                            # Write the CLOB data to the file
-                            file.write(clob_data.read().replace('\n', ''))
-
-                        # Send it to the Printer through LPR
-                        self.print_to_ip_printer()
-
-                        # Delete the file after successful printing
-                        os.remove(self.text_file)
-                        self.logger.debug(f"File {self.text_file} deleted.")
-
-                    # Update the row as cip_processed = 'Y'
-                    # Open a new cursor
-
-                    cursor = item_connection.connection.cursor()
-                    cursor.execute(
-                        "UPDATE cent_iface_print SET cip_process_ind = 'Y', cip_process_error = substr(:msg, 1, 250) WHERE cip_id = :id",
-                        id=row_cip_id, msg=str(self.out))
-                    item_connection.connection.commit()
-                    self.logger.debug(f"Row {row_cip_id} updated to Printed Status.")
-
-                    # Close the cursor
-                    cursor.close()
-
-            # Log some stats
-            self.loggerStats.debug(
-                f"{self.current_rows_fetched},{self.current_rows_fetched},{self.current_rows_fetched}")
-
-            # Sleep for a defined period of seconds or the fallback
-            self.logger.debug("Sleeping for " + str(self.json_data["main"]["execution_pause_time"]) + " seconds")
-            time.sleep(self.json_data["main"]["execution_pause_time"] or self.cfg_execution_pause_time)
+        self.old_json_data = old_raw_json_data
+        self.raw_json_data = raw_json_data
+        self.json_data = copy.deepcopy(raw_json_data)
+
+        # Decrypt the credentials that changed only
+        fernet = Fernet(self.encryption_key)
+        for index, oracle_connection_data in self.json_data["oracle_connections"].items():
+            old_data = old_raw_json_data["oracle_connections"].get(index, {})
+            if old_data.get("oracle_username") == oracle_connection_data["oracle_username"] and \
+                    old_data.get("oracle_password") == oracle_connection_data["oracle_password"]:
+                old_connection_data = old_json_data["oracle_connections"][index]
+                oracle_connection_data["oracle_username"] = old_connection_data["oracle_username"]
+                oracle_connection_data["oracle_password"] = old_connection_data["oracle_password"]
+            else:
+                self.decrypt_connection_credentials(fernet, oracle_connection_data)
+
+        if "logging_set_level" in main_keys:
+            self.set_log_level()
+        if main_keys & LOGGER_CONFIG_KEYS:
+            self.setup_loggers()
+        elif main_keys & EMAIL_CONFIG_KEYS:
+            self.setup_alert_mailer()
+        if main_keys & FETCHER_CONFIG_KEYS:
+            self.setup_fetcher()
+        if main_keys & SCHEDULER_CONFIG_KEYS:
+            self.setup_scheduler()
+        if main_keys & HOUSEKEEPING_CONFIG_KEYS:
+            self.setup_housekeeper()
+        if main_keys & PRINT_COMMAND_CONFIG_KEYS:
+            self.setup_print_commands()
+        if main_keys & (PRINT_COMMAND_CONFIG_KEYS | PRINT_TRANSPORT_CONFIG_KEYS):
+            # The STDIN transport runs lpr_command
+            self.setup_print_transports()
+
+        restart_keys = main_keys - LOGGER_CONFIG_KEYS - PAUSE_CONFIG_KEYS - FETCHER_CONFIG_KEYS - \
+            PRINT_COMMAND_CONFIG_KEYS - PRINT_TRANSPORT_CONFIG_KEYS - EMAIL_CONFIG_KEYS - POLLER_CONFIG_KEYS - \
+            CONNECTION_CONFIG_KEYS - SCHEDULER_CONFIG_KEYS - HOUSEKEEPING_CONFIG_KEYS - DYNAMIC_CONFIG_KEYS
+        if restart_keys:
+            self.logger.warning('Config Changes applied on the next restart of the agent: ' +
+                                ', '.join(sorted(restart_keys)))
+
+        # Connections to close and open again, and pollers to restart or to give a new pause time
+        for item_connection in list(self.oracle_connections_list):
+            index = item_connection.oracle_connection_index
+
+            if main_keys & CONNECTION_CONFIG_KEYS or index in connection_indexes:
+                connection_differences = replace
+                if isinstance(connections_differences, dict) and replace not in connections_differences:
+                    connection_differences = connections_differences.get(index)
+                connection_keys = changed_keys(connection_differences,
+                                               old_raw_json_data["oracle_connections"].get(index),
+                                               raw_json_data["oracle_connections"].get(index))
+                if not main_keys & CONNECTION_CONFIG_KEYS and index in raw_json_data["oracle_connections"] and \
+                        connection_keys <= PAUSE_CONFIG_KEYS:
+                    self.reconfigure_wakeup(item_connection)
+                    connection_indexes.discard(index)
+                else:
+                    self.close_oracle_connection(item_connection)
+            elif main_keys & POLLER_CONFIG_KEYS:
+                self.stop_poller(item_connection)
+                self.start_poller(item_connection)
+            elif main_keys & PAUSE_CONFIG_KEYS:
+                self.reconfigure_wakeup(item_connection)
+
+        for index, oracle_connection_data in self.json_data["oracle_connections"].items():
+            if main_keys & CONNECTION_CONFIG_KEYS or index in connection_indexes:
+                self.logger.debug('Connecting to Database ' + oracle_connection_data["oracle_connection_name"] + '...')
+                connection = self.open_oracle_connection(index, oracle_connection_data)
+                if connection is not None:
+                    self.start_poller(connection)
+
+    def close_oracle_connection(self, item_connection):
+        # Let the poller finish its current cycle and update its printed rows first
+        self.logger.debug('Closing Database Connection ' + item_connection.oracle_connection_name + '...')
+        self.stop_poller(item_connection)
+        item_connection.ack_batcher.flush()
+        item_connection.close(self.logger)
+        self.oracle_connections_list.remove(item_connection)
+
+    def reconfigure_wakeup(self, item_connection):
+        for poller in self.pollers:
+            if poller.oracle_connection is item_connection:
+                poller.wakeup.configure(*self.wakeup_pause_settings(item_connection))
+                poller.wakeup.notify()
+
+    def set_log_level(self):
+        # Unknown levels are NOTSET, as in setup_logger
+        level = logging.getLevelName(self.json_data["main"]["logging_set_level"])
+        if not isinstance(level, int):
+            level = logging.NOTSET
+        self.logger.setLevel(level)
+        self.log_listener.set_level(level)
 
     def decrypt_credentials(self):
         # Access the oracle connection instances and their properties
@@ -488,65 +1369,90 @@ class pyAgent:
         fernet = Fernet(self.encryption_key)
 
         for oracle_connection_name, oracle_connection_data in self.json_data["oracle_connections"].items():
-            # Decrypt user and password into memory
-            try:
-                # print(str(oracle_connection_data["oracle_username"]))
-                oracle_connection_data["oracle_username"] = fernet.decrypt(
-                    oracle_connection_data["oracle_username"].encode()).decode()
-                self.logger.info('User Name for Connection ' + oracle_connection_data[
-                    "oracle_connection_name"] + ' Decrypted')
-            except InvalidToken as e:
-                self.logger.critical("Error: Invalid token in Username for Connection " + oracle_connection_data[
-                    "oracle_connection_name"] + ' -> ' + e.__str__())
-                exit(1)
+            self.decrypt_connection_credentials(fernet, oracle_connection_data)
 
-            try:
-                oracle_connection_data["oracle_password"] = fernet.decrypt(
-                    oracle_connection_data["oracle_password"].encode()).decode()
-                self.logger.info('Password for Connection ' + oracle_connection_data[
-                    "oracle_connection_name"] + ' Decrypted')
-            except InvalidToken as e:
-                self.logger.critical("Error: Invalid token in Password for Connection " + oracle_connection_data[
-                    "oracle_connection_name"] + " -> " + e.__str__())
-                exit(1)
-
-    def send_email_on_connection_error(self, sender, receiver, connection_name, error_message):
-
-        subject = 'CoreTechPrintAgent ERROR - ' + self.json_data["main"]["client_name"]
-        body = 'Unable to connect to database - ' + connection_name + ' -> ' + error_message
-        message = EmailMessage()
-        message['From'] = sender
-        message['To'] = receiver
-        message['Subject'] = subject
-        message.set_content(body)
-
-        # Set the SMTP server and port
-        smtp_server = self.json_data["main"]["email_server"]
-        smtp_port = 25  # Replace with the appropriate port number
-
-        # Connect to the SMTP server and send the email
-        self.logger.debug('Sending email...')
+    def decrypt_connection_credentials(self, fernet, oracle_connection_data):
+        # Decrypt user and password into memory
+        try:
+            # print(str(oracle_connection_data["oracle_username"]))
+            oracle_connection_data["oracle_username"] = fernet.decrypt(
+                oracle_connection_data["oracle_username"].encode()).decode()
+            self.logger.info('User Name for Connection ' + oracle_connection_data[
+                "oracle_connection_name"] + ' Decrypted')
+        except InvalidToken as e:
+            self.logger.critical("Error: Invalid token in Username for Connection " + oracle_connection_data[
+                "oracle_connection_name"] + ' -> ' + e.__str__())
+            exit(1)
 
         try:
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.send_message(message)
-                self.logger.debug("Email sent to " + self.json_data["main"]["email_on_error"])
-        except Exception as e:
-            self.logger.error("An error occurred while sending the email: ", str(e))
+            oracle_connection_data["oracle_password"] = fernet.decrypt(
+                oracle_connection_data["oracle_password"].encode()).decode()
+            self.logger.info('Password for Connection ' + oracle_connection_data[
+                "oracle_connection_name"] + ' Decrypted')
+        except InvalidToken as e:
+            self.logger.critical("Error: Invalid token in Password for Connection " + oracle_connection_data[
+                "oracle_connection_name"] + " -> " + e.__str__())
+            exit(1)
+
+
+def run_worker(worker_number, connection_indexes, heartbeat, stop_event):
+    # Supervisor mode: a worker process, the agent for connection_indexes only
+    agent = pyAgent()
+    agent.worker_name = 'worker' + str(worker_number)
+    agent.worker_number = worker_number
+    agent.connection_indexes = connection_indexes
+    agent.heartbeat = heartbeat
+    agent.startup_timer.phase_done('load')
+
+    agent.read_config_json()
+    agent.startup_timer.phase_done('read_config')
+    agent.setup_loggers()
+    agent.startup_timer.phase_done('loggers')
+    agent.decrypt_credentials()
+    agent.startup_timer.phase_done('decrypt_credentials')
+
+    # The supervisor stops the worker like SIGTERM does: the jobs printing are finished and updated. So does a
+    # worker whose supervisor is gone, killed or crashed
+    def wait_stop_event():
+        import multiprocessing
+        supervisor = multiprocessing.parent_process()
+        while not stop_event.wait(1):
+            if supervisor is not None and not supervisor.is_alive():
+                agent.logger.error('Supervisor process gone, stopping the worker')
+                break
+        agent.stop_event.set()
+
+    threading.Thread(target=wait_stop_event, name='SupervisorStop', daemon=True).start()
+    agent.run()
 
 
 def main():
+    # Needed by the worker processes of the supervisor mode in the frozen executable only. Not imported otherwise,
+    # multiprocessing slows down the start of the agent
+    if getattr(sys, 'frozen', False):
+        import multiprocessing
+        multiprocessing.freeze_support()
+
     # Create an instance of the class
     agent = pyAgent()
+    agent.startup_timer.phase_done('load')
 
     # Read the config file
     agent.read_config_json()
+    agent.startup_timer.phase_done('read_config')
 
     # Setup Loggers
     agent.setup_loggers()
+    agent.startup_timer.phase_done('loggers')
+
+    # The workers read and decrypt the config themselves
+    if agent.get_main_config("supervisor_mode", agent.cfg_supervisor_mode):
+        agent.run_supervisor()
+        return
 
     # Decrypt data
     agent.decrypt_credentials()
+    agent.startup_timer.phase_done('decrypt_credentials')
 
     # Call procedures on the instance
     agent.run()  # Call the printing process
@@ -0,0 +1,105 @@
+import time
+
+import cx_Oracle
+
+from agent_metrics import STAGE_DB_UPDATE
+from job_journal import ACKED
+
+ACK_UPDATE_STATEMENT = "UPDATE cent_iface_print SET cip_process_ind = 'Y', cip_process_error = substr(:msg, 1, 250) WHERE cip_id = :id"
+
+# With job leasing, only the rows still leased to this agent are updated: a row whose lease expired and was claimed
+# by another agent belongs to that agent now
+LEASED_ACK_UPDATE_STATEMENT = ACK_UPDATE_STATEMENT + " AND cip_agent_id = :agent_id"
+
+
+class AckBatcher:
+    # Collects the cip_id and cip_process_error of the printed jobs of one Oracle connection and updates them with a
+    # single executemany and a single commit. A flush happens when batch_size jobs are waiting or when the oldest one
+    # has waited max_wait_time seconds. With job leasing agent_id is set, and the rows not updated (no longer leased
+    # to this agent, or deleted) are logged.
+    def __init__(self, oracle_connection, logger, batch_size=50, max_wait_time=2):
+        self.oracle_connection = oracle_connection
+        self.logger = logger
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_time = float(max_wait_time)
+        self.pending_acks = {}
+        self.oldest_ack_time = None
+        # JobJournal, when enabled
+        self.journal = None
+        # AgentMetrics
+        self.metrics = None
+        # Set by the agent when job leasing is on
+        self.agent_id = None
+
+    def add(self, cip_id, msg):
+        if not self.pending_acks:
+            self.oldest_ack_time = time.monotonic()
+        self.pending_acks[cip_id] = msg
+
+        if len(self.pending_acks) >= self.batch_size:
+            self.flush()
+
+    def is_pending(self, cip_id):
+        return cip_id in self.pending_acks
+
+    def flush_if_due(self):
+        if self.pending_acks and time.monotonic() - self.oldest_ack_time >= self.max_wait_time:
+            self.flush()
+
+    def flush(self):
+        if not self.pending_acks:
+            return True
+
+        if self.oracle_connection.connection_status == 'NOT_SUCCESS':
+            self.logger.warning(str(len(self.pending_acks)) + " printed rows waiting for connection " +
+                                self.oracle_connection.oracle_connection_name + " to be updated")
+            return False
+
+        agent_id = self.agent_id
+        acks = [{"id": cip_id, "msg": str(msg)} for cip_id, msg in self.pending_acks.items()]
+        if agent_id is not None:
+            for ack in acks:
+                ack["agent_id"] = agent_id
+
+        try:
+            with self.metrics.timer(STAGE_DB_UPDATE, connection=self.oracle_connection.oracle_connection_name):
+                cursor = self.oracle_connection.connection.cursor()
+                if agent_id is None:
+                    cursor.executemany(ACK_UPDATE_STATEMENT, acks)
+                    row_counts = None
+                else:
+                    cursor.executemany(LEASED_ACK_UPDATE_STATEMENT, acks, arraydmlrowcounts=True)
+                    row_counts = cursor.getarraydmlrowcounts()
+                self.oracle_connection.connection.commit()
+                cursor.close()
+        except cx_Oracle.Error as error:
+            # Keep the rows so they are updated in the next flush
+            self.logger.error(str(len(acks)) + " rows could not be updated to Printed Status in " +
+                              self.oracle_connection.oracle_connection_name + " -> " + str(error))
+            try:
+                self.oracle_connection.connection.rollback()
+            except cx_Oracle.Error:
+                pass
+            return False
+
+        lost_ids = []
+        if row_counts is not None:
+            lost_ids = [ack["id"] for ack, row_count in zip(acks, row_counts) if row_count == 0]
+        if lost_ids:
+            self.logger.warning(str(len(lost_ids)) + ' printed rows not updated in ' +
+                                self.oracle_connection.oracle_connection_name + ', no longer leased to ' +
+                                str(agent_id) + ': ' + ', '.join(str(cip_id) for cip_id in lost_ids))
+
+        self.logger.debug("%s rows updated to Printed Status in %s", len(acks) - len(lost_ids),
+                          self.oracle_connection.oracle_connection_name)
+
+        if self.journal is not None:
+            self.journal.record(self.oracle_connection, list(self.pending_acks.keys()), ACKED)
+
+        self.pending_acks = {}
+        self.oldest_ack_time = None
+        return True
+
+# #######################################################################################################################
+# ############################ END OF CLASS AckBatcher ##################################################################
+# #######################################################################################################################
@@ -0,0 +1,101 @@
+import json
+import logging
+import queue
+import zlib
+from logging.handlers import QueueHandler, QueueListener
+
+# Fields of the job a record is about, passed with extra=job_log_fields(job)
+JOB_LOG_FIELDS = ('cip_id', 'file_id', 'printer', 'connection')
+
+
+def job_log_fields(job):
+    return {"cip_id": job.cip_id, "file_id": job.file_id, "printer": job.printer_name,
+            "connection": job.oracle_connection.oracle_connection_name}
+
+
+class JsonLinesFormatter(logging.Formatter):
+    # One JSON object per line, with the job fields when the record has them, for machine analysis
+    def format(self, record):
+        entry = {"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + '.%03d' % record.msecs,
+                 "level": record.levelname,
+                 "logger": record.name,
+                 "thread": record.threadName,
+                 "message": record.getMessage()}
+        for field in JOB_LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+# #######################################################################################################################
+# ############################ END OF CLASS JsonLinesFormatter ##########################################################
+# #######################################################################################################################
+
+
+class JobSampleFilter(logging.Filter):
+    # Keeps the DEBUG and INFO records of sample_rate (0 to 1) of the jobs, chosen by cip_id so all the records of
+    # a job are kept or dropped together. Warnings and errors, and records not about a job, are always kept
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.threshold = int(max(0.0, min(1.0, float(sample_rate))) * 10000)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.threshold >= 10000:
+            return True
+        cip_id = getattr(record, 'cip_id', None)
+        if cip_id is None:
+            return True
+        return zlib.crc32(str(cip_id).encode('utf-8')) % 10000 < self.threshold
+
+# #######################################################################################################################
+# ############################ END OF CLASS JobSampleFilter #############################################################
+# #######################################################################################################################
+
+
+class DeferredQueueHandler(QueueHandler):
+    # Puts the records on the queue as they are: the message is formatted by the listener thread, not by the
+    # poller or the print worker logging it
+    def prepare(self, record):
+        return record
+
+# #######################################################################################################################
+# ############################ END OF CLASS DeferredQueueHandler ########################################################
+# #######################################################################################################################
+
+
+class LogListener:
+    # Runs the handlers of a logger (the rotating log files) on a background thread. The logger only puts the
+    # records on a queue, so writing and rotating the files never holds up the threads logging
+    def __init__(self, logger, handlers, sample_rate=1.0):
+        self.logger = logger
+        self.handlers = handlers
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = DeferredQueueHandler(self.queue)
+        if sample_rate < 1:
+            self.queue_handler.addFilter(JobSampleFilter(sample_rate))
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.started = False
+
+    def start(self):
+        self.logger.addHandler(self.queue_handler)
+        self.listener.start()
+        self.started = True
+
+    def stop(self):
+        # The records already queued are written first
+        self.logger.removeHandler(self.queue_handler)
+        if self.started:
+            self.listener.stop()
+            self.started = False
+        for handler in self.handlers:
+            handler.close()
+
+    def set_level(self, level):
+        for handler in self.handlers:
+            handler.setLevel(level)
+
+# #######################################################################################################################
+# ############################ END OF CLASS LogListener #################################################################
+# #######################################################################################################################
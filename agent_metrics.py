@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+
+# Stages of a job, in order
+STAGE_QUERY = 'query'
+STAGE_LOB_READ = 'lob_read'
+STAGE_QUEUE_WAIT = 'queue_wait'  # In the print queues, by category and priority
+STAGE_TEMP_FILE_WRITE = 'temp_file_write'
+STAGE_PRINT_SPAWN = 'print_spawn'
+STAGE_DB_UPDATE = 'db_update'
+STAGE_JOB = 'job'  # From fetched to printed
+
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class NullTimer:
+    # Used when the metrics are disabled, so timing a stage costs one method call
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class StageTimer:
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+        self.start_time = None
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start_time, self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = 0
+        while index < len(HISTOGRAM_BUCKETS) and value > HISTOGRAM_BUCKETS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q quantile
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return HISTOGRAM_BUCKETS[index] if index < len(HISTOGRAM_BUCKETS) else float('inf')
+        return float('inf')
+
+
+def format_labels(labels):
+    return ','.join(name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                    for name, value in labels)
+
+
+class AgentMetrics:
+    # Counters, stage latency histograms and gauges of the agent, exported in Prometheus text format to a file
+    # and/or an HTTP endpoint. With enabled=False every call returns straight away.
+    def __init__(self, logger, enabled=True):
+        self.logger = logger
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # (name, labels) -> value. labels is a tuple of (name, value) pairs
+        self.counters = {}
+        self.histograms = {}
+        # name -> function returning the current value
+        self.gauges = {}
+        self.stop_event = threading.Event()
+        self.export_thread = None
+        self.http_server = None
+
+    def timer(self, stage, **labels):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self, stage, tuple(sorted(labels.items())))
+
+    def observe(self, stage, seconds, labels=()):
+        if not self.enabled:
+            return
+        key = (stage, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def register_gauge(self, name, function):
+        self.gauges[name] = function
+
+    def stage_quantile(self, stage, q):
+        # Quantile of a stage over all its labels
+        merged = Histogram()
+        with self.lock:
+            for (histogram_stage, labels), histogram in self.histograms.items():
+                if histogram_stage == stage:
+                    merged.count += histogram.count
+                    merged.bucket_counts = [a + b for a, b in zip(merged.bucket_counts, histogram.bucket_counts)]
+        return merged.quantile(q)
+
+    def format_prometheus(self):
+        lines = []
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, list(histogram.bucket_counts), histogram.count, histogram.sum)
+                          for key, histogram in self.histograms.items()]
+
+        lines.append('# HELP coretech_jobs_total Jobs by result (fetched, printed, failed)')
+        lines.append('# TYPE coretech_jobs_total counter')
+        for (name, labels), value in sorted(counters):
+            lines.append('coretech_jobs_total{' + format_labels((('result', name),) + labels) + '} ' + str(value))
+
+        lines.append('# HELP coretech_stage_seconds Time spent per job stage')
+        lines.append('# TYPE coretech_stage_seconds histogram')
+        for (stage, labels), bucket_counts, count, total in sorted(histograms, key=lambda item: item[0]):
+            base_labels = (('stage', stage),) + labels
+            cumulative = 0
+            for index, bucket_count in enumerate(bucket_counts):
+                cumulative += bucket_count
+                upper_bound = str(HISTOGRAM_BUCKETS[index]) if index < len(HISTOGRAM_BUCKETS) else '+Inf'
+                lines.append('coretech_stage_seconds_bucket{' + format_labels(base_labels + (('le', upper_bound),)) +
+                             '} ' + str(cumulative))
+            lines.append('coretech_stage_seconds_sum{' + format_labels(base_labels) + '} ' + repr(total))
+            lines.append('coretech_stage_seconds_count{' + format_labels(base_labels) + '} ' + str(count))
+
+        for name, function in sorted(self.gauges.items()):
+            try:
+                value = function()
+            except Exception:
+                continue
+            lines.append('# TYPE coretech_' + name + ' gauge')
+            lines.append('coretech_' + name + ' ' + repr(float(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def start(self, file_name=None, export_interval=15, http_port=0):
+        if not self.enabled:
+            return
+
+        if file_name:
+            self.stop_event.clear()
+            self.export_thread = threading.Thread(target=self.export_loop, args=(file_name, export_interval),
+                                                  name='MetricsExport', daemon=True)
+            self.export_thread.start()
+
+        if http_port:
+            # Only loaded when the endpoint is enabled, http.server slows down the start of the agent
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self
+
+            class MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = metrics.format_prometheus().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self.http_server = ThreadingHTTPServer(('', int(http_port)), MetricsHandler)
+            threading.Thread(target=self.http_server.serve_forever, name='MetricsHttp', daemon=True).start()
+            self.logger.info('Metrics available on http port ' + str(http_port))
+
+    def stop(self):
+        self.stop_event.set()
+        if self.export_thread is not None:
+            self.export_thread.join()
+            self.export_thread = None
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+    def export_loop(self, file_name, export_interval):
+        while not self.stop_event.wait(export_interval):
+            self.write_file(file_name)
+        self.write_file(file_name)
+
+    def write_file(self, file_name):
+        try:
+            with open(file_name + '.tmp', 'w') as file:
+                file.write(self.format_prometheus())
+            # Replace at once so a scraper never reads half a file
+            os.replace(file_name + '.tmp', file_name)
+        except OSError as e:
+            self.logger.error('Unable to write the metrics file ' + file_name + ' -> ' + str(e))
+
+# #######################################################################################################################
+# ############################ END OF CLASS AgentMetrics ################################################################
+# #######################################################################################################################
@@ -0,0 +1,189 @@
+import multiprocessing
+import time
+
+# psutil is optional, without it the memory of the workers is not checked
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def partition_connections(connection_indexes, worker_count=0):
+    # The oracle_connections of config.JSON shared among the workers, worker_count 0 for one worker per connection
+    connection_indexes = sorted(connection_indexes)
+    worker_count = int(worker_count) or len(connection_indexes)
+    worker_count = max(1, min(worker_count, len(connection_indexes)))
+    return [connection_indexes[index::worker_count] for index in range(worker_count)]
+
+
+class WorkerProcess:
+    # A worker process of the supervisor, polling and printing the jobs of its Oracle connections. heartbeat is the
+    # time.monotonic() of the last progress of all its pollers, written by the worker
+    def __init__(self, context, worker_function, worker_number, connection_indexes):
+        self.context = context
+        self.worker_function = worker_function
+        self.worker_number = worker_number
+        self.connection_indexes = connection_indexes
+        self.process = None
+        self.heartbeat = context.Value('d', 0.0, lock=False)
+        self.stop_event = None
+        self.start_time = None
+        # Set when the worker was asked to stop, it has drain_time seconds to finish
+        self.stop_time = None
+        self.restart = False
+        self.failures = 0
+        self.next_start_time = 0.0
+
+    def name(self):
+        return 'Worker ' + str(self.worker_number) + ' (connections ' + ', '.join(self.connection_indexes) + ')'
+
+    def start(self):
+        self.stop_event = self.context.Event()
+        self.heartbeat.value = time.monotonic()
+        self.process = self.context.Process(target=self.worker_function,
+                                            args=(self.worker_number, self.connection_indexes, self.heartbeat,
+                                                  self.stop_event),
+                                            name='Worker-' + str(self.worker_number))
+        self.process.start()
+        self.start_time = time.monotonic()
+        self.stop_time = None
+
+    def running(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, restart=False):
+        # The worker finishes the jobs it is printing, updates them and exits
+        if self.running() and self.stop_time is None:
+            self.stop_event.set()
+            self.stop_time = time.monotonic()
+        self.restart = restart
+
+    def kill(self):
+        if self.running():
+            self.process.kill()
+        if self.process is not None:
+            self.process.join(5)
+
+    def memory(self):
+        # Resident memory in bytes, None when unknown
+        if psutil is None or not self.running():
+            return None
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss
+        except psutil.Error:
+            return None
+
+# #######################################################################################################################
+# ############################ END OF CLASS WorkerProcess ###############################################################
+# #######################################################################################################################
+
+
+class AgentSupervisor:
+    # Supervisor mode: the Oracle connections are shared among worker processes, each one running the agent (pollers,
+    # print workers, updates) for its own connections. A hung cx_Oracle call, a hung print or a worker that grows
+    # too much only holds up the databases of that worker, and the databases are polled on several cores.
+    # The supervisor starts the workers again when they exit, waiting restart_wait_time seconds, twice as long
+    # after every failure in a row up to max_restart_wait_time. A worker whose pollers made no progress for
+    # heartbeat_timeout seconds is hung and killed. A worker using more than max_worker_memory bytes (0 for no
+    # limit, needs psutil) is stopped and started again. Stopped workers have drain_time seconds to finish the jobs
+    # they are printing and update them before they are killed.
+    def __init__(self, logger, worker_function, heartbeat_timeout=300, max_worker_memory=0, drain_time=60,
+                 restart_wait_time=5, max_restart_wait_time=300):
+        self.logger = logger
+        self.worker_function = worker_function
+        self.heartbeat_timeout = float(heartbeat_timeout)
+        self.max_worker_memory = int(max_worker_memory)
+        self.drain_time = float(drain_time)
+        self.restart_wait_time = float(restart_wait_time)
+        self.max_restart_wait_time = max(self.restart_wait_time, float(max_restart_wait_time))
+        # The same way of starting processes on Windows and Linux, safe with the threads of the supervisor
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = []
+        self.restarts = 0
+
+    def start(self, partitions):
+        if self.max_worker_memory and psutil is None:
+            self.logger.warning('psutil is not installed, the memory of the workers is not checked')
+
+        self.workers = [WorkerProcess(self.context, self.worker_function, worker_number, connection_indexes)
+                        for worker_number, connection_indexes in enumerate(partitions, 1)]
+        for worker in self.workers:
+            worker.start()
+            self.logger.info(worker.name() + ' started, pid ' + str(worker.process.pid))
+
+    def check(self):
+        # Called every second or so by the supervisor loop
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.running():
+                self.check_running_worker(worker, now)
+            elif worker.process is not None:
+                self.worker_exited(worker, now)
+            elif now >= worker.next_start_time:
+                worker.start()
+                self.restarts += 1
+                self.logger.info(worker.name() + ' started again, pid ' + str(worker.process.pid))
+
+    def check_running_worker(self, worker, now):
+        if worker.stop_time is not None:
+            if now - worker.stop_time > self.drain_time:
+                self.logger.error(worker.name() + ' did not stop in ' + str(self.drain_time) + ' seconds, killed')
+                worker.kill()
+            return
+
+        silence = now - worker.heartbeat.value
+        if self.heartbeat_timeout and silence > self.heartbeat_timeout:
+            # A hung worker can't drain, the rows it printed and didn't update are printed again (see job_journal)
+            self.logger.critical(worker.name() + ' hung, no progress for ' + str(int(silence)) +
+                                 ' seconds. Killed and started again')
+            worker.kill()
+            worker.restart = True
+            return
+
+        memory = worker.memory() if self.max_worker_memory else None
+        if memory is not None and memory > self.max_worker_memory:
+            self.logger.warning(worker.name() + ' uses ' + str(memory) + ' bytes, more than ' +
+                                str(self.max_worker_memory) + '. Stopped and started again')
+            worker.stop(restart=True)
+
+    def worker_exited(self, worker, now):
+        exitcode = worker.process.exitcode
+        worker.process.join()
+        worker.process = None
+
+        if worker.restart:
+            # Stopped or killed by the supervisor, started again at once
+            worker.restart = False
+            worker.failures = 0
+            worker.next_start_time = now
+            return
+
+        # Crashed. Starting it again and again in a loop would only fill the log
+        if worker.start_time is not None and now - worker.start_time > self.max_restart_wait_time:
+            worker.failures = 0
+        worker.failures += 1
+        wait_time = min(self.restart_wait_time * 2 ** (worker.failures - 1), self.max_restart_wait_time)
+        worker.next_start_time = now + wait_time
+        self.logger.error(worker.name() + ' exited with code ' + str(exitcode) + ', started again in ' +
+                          str(round(wait_time, 1)) + ' seconds')
+
+    def stop(self):
+        # Every worker drains at the same time, drain_time seconds at most
+        for worker in self.workers:
+            worker.stop()
+
+        deadline = time.monotonic() + self.drain_time
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(max(0.0, deadline - time.monotonic()))
+                if worker.running():
+                    self.logger.error(worker.name() + ' did not stop in ' + str(self.drain_time) +
+                                      ' seconds, killed')
+                worker.kill()
+                worker.process = None
+        self.workers = []
+        self.logger.debug('Supervisor stopped')
+
+# #######################################################################################################################
+# ############################ END OF CLASS AgentSupervisor #############################################################
+# #######################################################################################################################
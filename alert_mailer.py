@@ -0,0 +1,175 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+
+ALERT = 'ALERT'
+RESOLVE = 'RESOLVE'
+STOP = 'STOP'
+
+
+class AlertMailer:
+    # Sends the alert emails of the agent from its own thread, so an unreachable mail server never holds up the
+    # pollers. Alerts go through a bounded queue and are dropped when it is full. Repeated alerts with the same key
+    # (e.g. one connection failing) are coalesced into one digest, sent once interval seconds have passed since the
+    # first one. All the digests due at a time are sent over a single SMTP session.
+    def __init__(self, logger, server, port=25, sender='pritning.agent@coretechnology.ie', queue_size=100,
+                 timeout=10, check_interval=1, retry_wait_time=60):
+        self.logger = logger
+        self.server = server
+        self.port = int(port)
+        self.sender = sender
+        self.timeout = float(timeout)
+        self.check_interval = float(check_interval)
+        self.retry_wait_time = float(retry_wait_time)
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        # key -> digest. Only used by the mailer thread
+        self.digests = {}
+        self.dropped_alerts = 0
+        self.sent_emails = 0
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='AlertMailer', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        # The digests already due are sent before the thread ends
+        if self.thread is None:
+            return
+        try:
+            self.queue.put((STOP,), timeout=1)
+        except queue.Full:
+            pass
+        self.thread.join(self.timeout + 1 if timeout is None else timeout)
+        self.thread = None
+
+    def alert(self, key, recipient, subject, message, interval=0):
+        # Never blocks, returns False when the alert was dropped
+        if not recipient:
+            return False
+        try:
+            self.queue.put_nowait((ALERT, key, recipient, subject, message, float(interval), datetime.now()))
+            return True
+        except queue.Full:
+            self.dropped_alerts += 1
+            return False
+
+    def resolve(self, key):
+        # The problem is gone, its digest is not sent if it is not due yet
+        try:
+            self.queue.put_nowait((RESOLVE, key))
+        except queue.Full:
+            self.dropped_alerts += 1
+
+    def run(self):
+        running = True
+        while running:
+            try:
+                item = self.queue.get(timeout=self.check_interval)
+                while True:
+                    if item[0] == STOP:
+                        running = False
+                    else:
+                        self.apply(item)
+                    item = self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            self.send_due_digests()
+
+    def apply(self, item):
+        if item[0] == RESOLVE:
+            if self.digests.pop(item[1], None) is not None:
+                self.logger.debug('Alert ' + str(item[1]) + ' resolved before it was sent')
+            return
+
+        kind, key, recipient, subject, message, interval, alert_time = item
+        digest = self.digests.get(key)
+        if digest is None:
+            digest = self.digests[key] = {"recipient": recipient, "subject": subject, "interval": interval,
+                                          "opened": time.monotonic(), "first_time": alert_time, "count": 0}
+        digest["message"] = message
+        digest["last_time"] = alert_time
+        digest["count"] += 1
+
+    def send_due_digests(self):
+        now = time.monotonic()
+        due_keys = [key for key, digest in self.digests.items() if now - digest["opened"] >= digest["interval"]]
+        if not due_keys:
+            return
+
+        # One email per recipient and subject
+        emails = {}
+        for key in due_keys:
+            digest = self.digests[key]
+            emails.setdefault((digest["recipient"], digest["subject"]), []).append(digest)
+
+        if self.dropped_alerts:
+            self.logger.warning(str(self.dropped_alerts) + ' alerts dropped, the alert queue was full')
+            self.dropped_alerts = 0
+
+        # Imported the first time an email is sent: most runs never send one, and loading smtplib and email slows
+        # down the start of the agent
+        import smtplib
+
+        try:
+            with smtplib.SMTP(self.server, self.port, timeout=self.timeout) as server:
+                for (recipient, subject), digests in emails.items():
+                    server.send_message(self.format_email(recipient, subject, digests))
+                    self.sent_emails += 1
+                    self.logger.debug("Email sent to " + recipient)
+        except (OSError, smtplib.SMTPException) as e:
+            # Kept and tried again retry_wait_time seconds later at the earliest
+            self.logger.error("An error occurred while sending the email: " + str(e))
+            for key in due_keys:
+                digest = self.digests[key]
+                digest["opened"] = now + max(0.0, self.retry_wait_time - digest["interval"])
+            return
+
+        for key in due_keys:
+            del self.digests[key]
+
+    def format_email(self, recipient, subject, digests):
+        from email.message import EmailMessage
+
+        lines = []
+        for digest in digests:
+            if digest["count"] == 1:
+                lines.append(digest["message"])
+            else:
+                lines.append(digest["message"] + ' (' + str(digest["count"]) + ' times between ' +
+                             digest["first_time"].strftime('%Y-%m-%d %H:%M:%S') + ' and ' +
+                             digest["last_time"].strftime('%Y-%m-%d %H:%M:%S') + ')')
+
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content('\n'.join(lines))
+        return message
+
+# #######################################################################################################################
+# ############################ END OF CLASS AlertMailer #################################################################
+# #######################################################################################################################
+
+
+class AlertMailerHandler(logging.Handler):
+    # Sends the CRITICAL records of the agent logger through the AlertMailer
+    def __init__(self, mailer, recipient, subject):
+        super().__init__(logging.CRITICAL)
+        self.mailer = mailer
+        self.recipient = recipient
+        self.subject = subject
+
+    def emit(self, record):
+        try:
+            # Same message again and again ends up in one email
+            self.mailer.alert('CRITICAL ' + record.getMessage(), self.recipient, self.subject, record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+# #######################################################################################################################
+# ############################ END OF CLASS AlertMailerHandler ##########################################################
+# #######################################################################################################################
@@ -0,0 +1,348 @@
+# Throughput benchmark of the agent with a fake Oracle (bench/fake_oracle) and stub printers (bench/stubs),
+# so pyAgent.run can be measured without a database or printers.
+#
+#   python bench/benchmark.py                         all the scenarios, one process each
+#   python bench/benchmark.py --scenario backlog_drain --jobs 5000 --set print_worker_count=8
+#   python bench/benchmark.py --json results.json     keep the results to compare runs
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+PRINTERS = tuple('PRN%02d' % index for index in range(1, 9))
+
+SCENARIOS = {
+    # Tens of thousands of rows queued after an outage, all there when the agent starts
+    "backlog_drain": {"initial_jobs": 2000},
+    # New jobs arriving at a steady rate, latency matters more than throughput
+    "steady_trickle": {"initial_jobs": 0, "trickle_rate": 10, "trickle_time": 30},
+    # One jammed printer must not hold up the others
+    "slow_printer": {"initial_jobs": 1000, "slow_printer": PRINTERS[0], "slow_printer_latency": 1.0},
+    # Queries failing and connections refused
+    "reconnect_storm": {"initial_jobs": 1000, "execute_failure_rate": 0.01, "connect_failure_rate": 0.3},
+    # Restart after an update: the Oracle client is slow to load and four databases slow to connect to. What
+    # matters is the time to the first job (first_job_ms)
+    "cold_start": {"initial_jobs": 40, "connections": 4, "init_client_latency": 0.2, "connect_latency": 0.3},
+    # Short LASER jobs, starting SumatraPDF takes longer than printing. Compare the backends with
+    # --set laser_print_backend=SPAWN
+    "laser_burst": {"initial_jobs": 1000, "laser_ratio": 1.0, "print_latency": 0.15, "print_file_latency": 0.01,
+                    "config": {"laser_print_backend": "BATCH"}},
+    # A site that has kept years of processed rows: the job queries read the pending index instead of the table
+    # and the housekeeping purges the history in the background. Compare with --set fetch_pending_index=false
+    # housekeeping=false (db_rows_scanned)
+    "long_history": {"history_jobs": 200000, "trickle_rate": 20, "trickle_time": 20,
+                     "config": {"fetch_pending_index": True, "housekeeping": True, "housekeeping_interval": 1}},
+    # One printer hangs: its print commands are killed, its jobs parked, the other printers keep printing. The
+    # scenario ends when the jobs of the other printers are printed
+    "offline_printer": {"initial_jobs": 1000, "offline_printer": PRINTERS[0],
+                        "config": {"print_command_timeout": 1, "printer_failure_threshold": 2,
+                                   "printer_open_time": 5, "print_retry_wait_time": 1}},
+}
+
+SCENARIO_DEFAULTS = {
+    "initial_jobs": 0,
+    # Rows processed 60 days ago, in the table before the jobs
+    "history_jobs": 0,
+    "trickle_rate": 0,
+    "trickle_time": 0,
+    "laser_ratio": 0.5,
+    "blob_size": 50000,
+    "clob_size": 2000,
+    # Different PDFs among the LASER jobs, 0 for a different one per job (see document_cache)
+    "documents": 1,
+    "print_latency": 0.05,
+    "print_file_latency": 0.0,
+    "print_failure_rate": 0.0,
+    "slow_printer": None,
+    "slow_printer_latency": 1.0,
+    "offline_printer": None,
+    # config.JSON "main" settings of the scenario, --set wins
+    "config": {},
+    "query_latency": 0.002,
+    # Databases, each with its share of the jobs, and how long loading the Oracle client and connecting take
+    "connections": 1,
+    "init_client_latency": 0.0,
+    "connect_latency": 0.0,
+    "execute_failure_rate": 0.0,
+    "connect_failure_rate": 0.0,
+    "timeout": 600,
+}
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        # KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+def write_config(work_dir, overrides, connections=1):
+    with open(os.path.join(REPO_DIR, 'config.JSON'), 'r') as file:
+        config = json.load(file)
+
+    stub_command = [sys.executable, os.path.join(BENCH_DIR, 'stubs', 'stub_printer.py')]
+    config["main"].update({
+        "logging_set_level": "INFO",
+        "sumatra_command": stub_command,
+        "lpr_command": stub_command,
+        "print_command_shell": False,
+        "metrics_http_port": 0,
+        # The scenarios measure the pickup latency of adaptive polling, --set wakeup_adaptive_polling=false for the
+        # fixed execution_pause_time
+        "wakeup_adaptive_polling": True,
+    })
+    config["main"].update(overrides)
+    config["oracle_connections"] = {}
+    for index in range(connections):
+        config["oracle_connections"][str(index)] = {
+            "oracle_connection_name": "BENCH" if index == 0 else "BENCH" + str(index),
+            "oracle_username": "bench",
+            "oracle_password": "bench",
+            "oracle_host": "localhost",
+            "oracle_port": 1521,
+            "oracle_service": service_name(index),
+            "oracle_retry_wait_time": "1",
+            "email_on_error": "",
+            # No emails to a real server during the benchmark
+            "email_on_error_freq": 86400
+        }
+
+    with open(os.path.join(work_dir, 'config.JSON'), 'w') as file:
+        json.dump(config, file, indent=4)
+
+
+def service_name(index):
+    return "bench" if index == 0 else "bench" + str(index)
+
+
+def run_scenario(name, parameters, overrides, text_transport):
+    # The fake cx_Oracle must be imported before the agent
+    sys.path.insert(0, os.path.join(BENCH_DIR, 'fake_oracle'))
+    sys.path.insert(1, REPO_DIR)
+    sys.path.insert(2, BENCH_DIR)
+    import cx_Oracle
+
+    database = cx_Oracle.DATABASE
+    database.query_latency = parameters["query_latency"]
+    database.execute_failure_rate = parameters["execute_failure_rate"]
+    database.connect_failure_rate = parameters["connect_failure_rate"]
+    database.init_client_latency = parameters["init_client_latency"]
+    database.connect_latency = parameters["connect_latency"]
+
+    os.environ["BENCH_PRINT_LATENCY"] = str(parameters["print_latency"])
+    os.environ["BENCH_PRINT_FILE_LATENCY"] = str(parameters["print_file_latency"])
+    os.environ["BENCH_PRINT_FAILURE_RATE"] = str(parameters["print_failure_rate"])
+    if parameters["slow_printer"]:
+        os.environ["BENCH_SLOW_PRINTER"] = parameters["slow_printer"]
+        os.environ["BENCH_SLOW_PRINTER_LATENCY"] = str(parameters["slow_printer_latency"])
+    if parameters["offline_printer"]:
+        os.environ["BENCH_OFFLINE_PRINTER"] = parameters["offline_printer"]
+    overrides = dict(parameters["config"], **overrides)
+
+    text_printers = PRINTERS
+    fake_printer = None
+    if text_transport == 'STDIN':
+        overrides = dict(overrides, text_print_transport=text_transport)
+    elif text_transport != 'LPR':
+        from fake_lpd_server import FakePrinterServer
+        fake_printer = FakePrinterServer(text_transport, delay=parameters["print_latency"]).start()
+        text_printers = (fake_printer.address,)
+        overrides = dict(overrides, text_print_transport=text_transport)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_' + name + '_')
+    os.chdir(work_dir)
+    write_config(work_dir, overrides, parameters["connections"])
+
+    # As CoreTechPrintAgent.main(), the phases of the startup timing report
+    import CoreTechPrintAgent
+    agent = CoreTechPrintAgent.pyAgent()
+    agent.startup_timer.phase_done('load')
+    agent.read_config_json()
+    agent.startup_timer.phase_done('read_config')
+    agent.setup_loggers()
+    agent.startup_timer.phase_done('loggers')
+    # Time spent by the agent threads in logger.handle: what logging costs the pollers and the print workers
+    log_cost = {"records": 0, "seconds": 0.0}
+    log_cost_lock = threading.Lock()
+    logger_handle = agent.logger.handle
+
+    def timed_handle(record):
+        start = time.perf_counter()
+        logger_handle(record)
+        with log_cost_lock:
+            log_cost["records"] += 1
+            log_cost["seconds"] += time.perf_counter() - start
+
+    agent.logger.handle = timed_handle
+    # The fake database doesn't check the credentials, they are left as they are
+
+    services = [service_name(index) for index in range(parameters["connections"])]
+
+    def insert(count):
+        database.insert_jobs(count, parameters["laser_ratio"], parameters["blob_size"], parameters["clob_size"],
+                             PRINTERS, text_printers, parameters["documents"],
+                             services if len(services) > 1 else None)
+
+    if parameters["history_jobs"]:
+        database.insert_jobs(parameters["history_jobs"], parameters["laser_ratio"], parameters["blob_size"],
+                             parameters["clob_size"], PRINTERS, text_printers, processed_age_days=60)
+    insert(parameters["initial_jobs"])
+    total_jobs = parameters["initial_jobs"] + int(parameters["trickle_rate"] * parameters["trickle_time"])
+    if parameters["offline_printer"]:
+        total_jobs -= sum(1 for row in database.rows.values()
+                          if row["cip_printer_name"] == parameters["offline_printer"])
+
+    def trickle():
+        interval = 1.0 / parameters["trickle_rate"]
+        for index in range(int(parameters["trickle_rate"] * parameters["trickle_time"])):
+            insert(1)
+            time.sleep(interval)
+
+    def monitor():
+        deadline = time.monotonic() + parameters["timeout"]
+        while time.monotonic() < deadline:
+            if len(database.ack_times) >= total_jobs:
+                break
+            time.sleep(0.05)
+        agent.stop_event.set()
+
+    if parameters["trickle_rate"]:
+        threading.Thread(target=trickle, daemon=True).start()
+    threading.Thread(target=monitor, daemon=True).start()
+
+    start_time = time.monotonic()
+    agent.run()
+    elapsed = time.monotonic() - start_time
+
+    if fake_printer is not None:
+        fake_printer.stop()
+
+    latencies = database.latencies()
+    acked_jobs = len(latencies)
+    last_ack = max(database.ack_times.values()) - start_time if database.ack_times else elapsed
+    failed_jobs = sum(1 for row in database.rows.values()
+                      if row["cip_process_ind"] == 'Y' and row["cip_process_error"] and
+                      ('returncode=0' not in row["cip_process_error"] and ' OK ' not in row["cip_process_error"]))
+
+    cache = agent.document_cache
+    startup_timer = agent.startup_timer
+    agent.stop_log_listeners()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "scenario": name,
+        "jobs": total_jobs,
+        "printed": acked_jobs,
+        "failed": failed_jobs,
+        "seconds": round(last_ack, 3),
+        "jobs_per_second": round(acked_jobs / last_ack, 2) if last_ack > 0 else 0.0,
+        "p50_latency": round(percentile(latencies, 0.50), 3),
+        "p99_latency": round(percentile(latencies, 0.99), 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "db_round_trips": database.round_trips,
+        "db_rows_scanned": database.rows_scanned,
+        "db_rows_left": len(database.rows),
+        "cache_hit_ratio": round(cache.hit_ratio(), 3) if cache is not None else None,
+        "cache_mb_saved": round(cache.bytes_saved / (1024 * 1024), 1) if cache is not None else None,
+        "log_records": log_cost["records"],
+        "log_us_per_job": round(log_cost["seconds"] * 1000000 / acked_jobs, 1) if acked_jobs else 0.0,
+        "startup_ms": round(startup_timer.ready_time * 1000) if startup_timer.ready_time is not None else None,
+        "first_job_ms": (round(startup_timer.first_job_time * 1000)
+                         if startup_timer.first_job_time is not None else None),
+        # Only in the --json results
+        "startup_phases_ms": {name: round(seconds * 1000) for name, seconds in startup_timer.phases},
+    }
+
+
+def print_results(results):
+    columns = ["scenario", "jobs", "printed", "failed", "seconds", "jobs_per_second", "p50_latency", "p99_latency",
+               "peak_rss_mb", "db_round_trips", "db_rows_scanned", "db_rows_left", "cache_hit_ratio", "cache_mb_saved",
+               "log_records", "log_us_per_job", "startup_ms", "first_job_ms"]
+    print(' '.join('%-16s' % column for column in columns))
+    for result in results:
+        print(' '.join('%-16s' % result.get(column) for column in columns))
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CoreTechPrintAgent benchmark')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--jobs', type=int, help='initial jobs of the scenario')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='scenario parameter, e.g. print_latency=0.2 (see SCENARIO_DEFAULTS)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='config.JSON "main" setting for the agent, e.g. print_worker_count=8')
+    parser.add_argument('--text-transport', choices=['LPR', 'STDIN', 'LPD', 'RAW'], default='LPR')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    if args.scenario == 'all':
+        # One process per scenario, so the peak RSS of one doesn't hide the next one
+        results = []
+        for name in sorted(SCENARIOS):
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as file:
+                result_file = file.name
+            command = [sys.executable, os.path.abspath(__file__), '--scenario', name, '--json', result_file,
+                       '--text-transport', args.text_transport]
+            if args.jobs is not None:
+                command += ['--jobs', str(args.jobs)]
+            for option in args.param:
+                command += ['--param', option]
+            for option in args.set:
+                command += ['--set', option]
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+            with open(result_file, 'r') as file:
+                results.extend(json.load(file))
+            os.remove(result_file)
+    else:
+        parameters = dict(SCENARIO_DEFAULTS, **SCENARIOS[args.scenario])
+        if args.jobs is not None:
+            parameters["initial_jobs"] = args.jobs
+        for option in args.param:
+            key, value = option.split('=', 1)
+            parameters[key] = parse_value(value)
+        overrides = {}
+        for option in args.set:
+            key, value = option.split('=', 1)
+            overrides[key] = parse_value(value)
+        results = [run_scenario(args.scenario, parameters, overrides, args.text_transport)]
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
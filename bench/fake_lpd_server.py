@@ -0,0 +1,119 @@
+import argparse
+import socketserver
+import threading
+import time
+
+
+class FakePrinterServer:
+    # Local LPD (RFC 1179) or RAW (9100) printer for tests and benchmarks. It accepts the jobs, keeps them in
+    # memory and can be slowed down or made to refuse a share of the jobs.
+    def __init__(self, protocol='LPD', host='127.0.0.1', port=0, delay=0.0, failure_rate=0.0):
+        self.protocol = protocol
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.jobs = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        handler = LpdHandler if protocol == 'LPD' else RawHandler
+        self.server = socketserver.ThreadingTCPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.fake_printer = self
+        self.thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address
+        return host + ':' + str(port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def should_fail(self):
+        # Deterministic: every 1/failure_rate-th job fails
+        with self.lock:
+            self.connections += 1
+            return self.failure_rate > 0 and self.connections % max(1, round(1 / self.failure_rate)) == 0
+
+    def add_job(self, job):
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.jobs.append(job)
+
+
+class LpdHandler(socketserver.StreamRequestHandler):
+    def read_command(self):
+        return self.rfile.readline().rstrip(b'\n')
+
+    def handle(self):
+        printer = self.server.fake_printer
+
+        command = self.read_command()
+        if not command.startswith(b'\x02') or printer.should_fail():
+            self.wfile.write(b'\x01')
+            return
+        self.wfile.write(b'\x00')
+
+        job = {'queue': command[1:].decode('ascii'), 'control': None, 'data': None}
+
+        while True:
+            command = self.read_command()
+            if not command:
+                break
+
+            count, name = command[1:].split(b' ', 1)
+            self.wfile.write(b'\x00')
+            content = self.rfile.read(int(count))
+            # Every file ends with a 0 octet
+            self.rfile.read(1)
+
+            if command.startswith(b'\x02'):
+                job['control'] = content
+            else:
+                job['data'] = content
+            self.wfile.write(b'\x00')
+
+        printer.add_job(job)
+
+
+class RawHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        printer = self.server.fake_printer
+        if printer.should_fail():
+            return
+
+        # A kept connection can carry several jobs, each write of the client is a job here
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            printer.add_job({'queue': None, 'control': None, 'data': data})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake LPD/RAW printer')
+    parser.add_argument('--protocol', choices=['LPD', 'RAW'], default='LPD')
+    parser.add_argument('--port', type=int, default=5515)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds per job')
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    printer = FakePrinterServer(args.protocol, port=args.port, delay=args.delay,
+                                failure_rate=args.failure_rate).start()
+    print('Fake ' + args.protocol + ' printer listening on ' + printer.address)
+    try:
+        while True:
+            time.sleep(5)
+            print(str(len(printer.jobs)) + ' jobs received')
+    except KeyboardInterrupt:
+        printer.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,429 @@
+# Stand-in for cx_Oracle used by the benchmarks. It serves a synthetic cent_iface_print held in memory and
+# understands the statements the agent runs. Put bench/fake_oracle first in sys.path to use it.
+import hashlib
+import random
+import re
+import threading
+import time
+
+
+DB_TYPE_BLOB = 'DB_TYPE_BLOB'
+DB_TYPE_CLOB = 'DB_TYPE_CLOB'
+DB_TYPE_LONG = 'DB_TYPE_LONG'
+DB_TYPE_LONG_RAW = 'DB_TYPE_LONG_RAW'
+
+LOB_TYPES = {"cip_blob": DB_TYPE_BLOB, "cip_clob": DB_TYPE_CLOB}
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class FakeDatabase:
+    # The table and the knobs of the benchmark scenarios
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.rows = {}
+        # Keys of schema_support.PENDING_JOBS_INDEX_DDL: the rows not processed
+        self.pending_ids = set()
+        self.archived_rows = {}
+        self.next_cip_id = 1
+        self.query_latency = 0.0
+        # Loading the Oracle client and opening a session pool, the start of the agent
+        self.init_client_latency = 0.0
+        self.connect_latency = 0.0
+        self.connect_failure_rate = 0.0
+        self.execute_failure_rate = 0.0
+        self.insert_times = {}
+        self.ack_times = {}
+        self.statements = 0
+        self.round_trips = 0
+        # Rows read by the job queries, through the table or the pending index
+        self.rows_scanned = 0
+        self.random = random.Random(42)
+
+    def insert_jobs(self, count, laser_ratio=0.5, blob_size=50000, clob_size=2000, printers=('PRN01',),
+                    text_printers=None, documents=1, services=None, processed_age_days=None):
+        # documents = number of different PDFs printed, 0 for a different one per job. With services the rows are
+        # shared among them: a connection to one of them only sees its own rows. With processed_age_days the rows
+        # are the history of the table, processed that many days ago
+        text_printers = text_printers or printers
+        blob = b'%PDF-1.4\n' + b'x' * max(0, blob_size - 9)
+        clob = ('LABEL LINE\n' * (clob_size // 11 + 1))[:clob_size]
+        with self.lock:
+            for index in range(count):
+                cip_id = self.next_cip_id
+                self.next_cip_id += 1
+                laser = self.random.random() < laser_ratio
+                self.rows[cip_id] = {
+                    "cip_id": cip_id,
+                    "cip_file_id": 'doc' + str(cip_id) + ('.pdf' if laser else ''),
+                    "cip_printer_name": self.random.choice(printers if laser else text_printers),
+                    "cip_printer_category": 'LASER' if laser else 'TEXT',
+                    "cip_priority": None,
+                    "cip_blob": (self.document(blob, cip_id, documents) if laser else None),
+                    "cip_clob": None if laser else clob,
+                    "cip_process_ind": 'N' if processed_age_days is None else 'Y',
+                    "cip_process_error": None,
+                    "cip_agent_id": None,
+                    "cip_lease_expiry": None,
+                    "cip_insert_date": time.time() - (processed_age_days or 0) * 86400,
+                    "service": self.random.choice(services) if services else None,
+                }
+                if processed_age_days is None:
+                    self.pending_ids.add(cip_id)
+                    self.insert_times[cip_id] = time.monotonic()
+            self.lock.notify_all()
+
+    def document(self, blob, cip_id, documents):
+        if documents == 1:
+            return blob
+        number = cip_id if documents == 0 else self.random.randrange(documents)
+        return blob[:-12] + b'%012d' % number
+
+    def pending_count(self):
+        with self.lock:
+            return sum(1 for row in self.rows.values() if row["cip_process_ind"] != 'Y')
+
+    def latencies(self):
+        with self.lock:
+            return [self.ack_times[cip_id] - self.insert_times[cip_id] for cip_id in self.ack_times]
+
+
+DATABASE = FakeDatabase()
+
+
+def init_oracle_client(lib_dir=None, **kwargs):
+    time.sleep(DATABASE.init_client_latency)
+
+
+def makedsn(host, port, service_name=None, **kwargs):
+    return str(host) + ':' + str(port) + '/' + str(service_name)
+
+
+def connect(user=None, password=None, dsn=None, **kwargs):
+    if DATABASE.random.random() < DATABASE.connect_failure_rate:
+        raise DatabaseError('ORA-12541: TNS:no listener (fake)')
+    return Connection(dsn)
+
+
+SPOOL_ATTRVAL_WAIT = 1
+
+
+class SessionPool:
+    def __init__(self, user=None, password=None, dsn=None, min=1, max=2, increment=1, **kwargs):
+        time.sleep(DATABASE.connect_latency)
+        self.dsn = dsn
+        self.max = max
+        self.busy = 0
+
+    def acquire(self):
+        connection = connect(dsn=self.dsn)
+        self.busy += 1
+        return connection
+
+    def release(self, connection):
+        self.busy -= 1
+
+    def drop(self, connection):
+        connection.close()
+        self.busy -= 1
+
+    def close(self, force=False):
+        pass
+
+
+class LOB:
+    def __init__(self, value):
+        self.value = value
+
+    def size(self):
+        return len(self.value)
+
+    def read(self, offset=1, amount=None):
+        DATABASE.round_trips += 1
+        if amount is None:
+            return self.value[offset - 1:]
+        return self.value[offset - 1:offset - 1 + amount]
+
+    def getchunksize(self):
+        return 8132
+
+
+class Var:
+    def __init__(self, type=None):
+        self.type = type
+        self.value = None
+
+    def getvalue(self):
+        return self.value
+
+    def setvalue(self, position, value):
+        self.value = value
+
+
+class Connection:
+    def __init__(self, dsn=None):
+        self.closed = False
+        self.service = dsn.rsplit('/', 1)[-1] if dsn else None
+
+    def cursor(self):
+        if self.closed:
+            raise DatabaseError('DPI-1001: not connected (fake)')
+        return Cursor(self)
+
+    def commit(self):
+        DATABASE.round_trips += 1
+
+    def rollback(self):
+        pass
+
+    def ping(self):
+        DATABASE.round_trips += 1
+        if DATABASE.random.random() < DATABASE.execute_failure_rate:
+            raise DatabaseError('ORA-03113: end-of-file on communication channel (fake)')
+
+    def close(self):
+        self.closed = True
+
+
+def normalize(statement):
+    return re.sub(r'\s+', ' ', statement.strip().lower())
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 100
+        self.prefetchrows = 2
+        self.rowcount = 0
+        self.row_counts = None
+        self.rows = []
+        self.position = 0
+        self.description = None
+        self.outputtypehandler = None
+
+    def var(self, type, *args, **kwargs):
+        return Var(type)
+
+    def close(self):
+        self.rows = []
+
+    def execute(self, statement, parameters=None, **kwargs):
+        binds = dict(parameters or {})
+        binds.update(kwargs)
+
+        DATABASE.statements += 1
+        DATABASE.round_trips += 1
+        if DATABASE.query_latency:
+            time.sleep(DATABASE.query_latency)
+        if DATABASE.random.random() < DATABASE.execute_failure_rate:
+            self.connection.closed = True
+            raise DatabaseError('ORA-03113: end-of-file on communication channel (fake)')
+
+        sql = normalize(statement)
+        with DATABASE.lock:
+            if sql.startswith('select'):
+                self.rows = self.select(sql, binds)
+                self.position = 0
+                self.rowcount = 0
+            elif sql.startswith('update'):
+                self.rowcount = self.update(sql, binds)
+            elif sql.startswith('delete'):
+                self.rowcount = self.delete(sql, binds)
+            elif sql.startswith('insert into'):
+                self.rowcount = self.insert(sql, binds)
+            else:
+                self.rowcount = 0
+
+    def executemany(self, statement, parameters, arraydmlrowcounts=False, **kwargs):
+        row_counts = []
+        for binds in parameters:
+            self.execute(statement, binds)
+            row_counts.append(self.rowcount)
+            DATABASE.round_trips -= 1
+        DATABASE.round_trips += 1
+        self.rowcount = sum(row_counts)
+        self.row_counts = row_counts if arraydmlrowcounts else None
+
+    def getarraydmlrowcounts(self):
+        return self.row_counts
+
+    def callproc(self, name, parameters=()):
+        DATABASE.round_trips += 1
+        if name.upper() == 'DBMS_ALERT.WAITONE':
+            # Wait for an insert, status 0 = alert, 1 = timeout
+            alert_name, message, status, timeout = parameters
+            with DATABASE.lock:
+                next_cip_id = DATABASE.next_cip_id
+                DATABASE.lock.wait_for(lambda: DATABASE.next_cip_id != next_cip_id, timeout)
+                status.value = 0 if DATABASE.next_cip_id != next_cip_id else 1
+        return parameters
+
+    def pending(self, row, binds):
+        if row["cip_process_ind"] == 'Y':
+            return False
+        if row["service"] is not None and row["service"] != self.connection.service:
+            return False
+        if "last_cip_id" in binds and row["cip_id"] <= binds["last_cip_id"]:
+            return False
+        # cip_printer_name NOT IN (:printer0, ...)
+        if "printer0" in binds and row["cip_printer_name"] in \
+                {value for name, value in binds.items() if name.startswith("printer")}:
+            return False
+        return True
+
+    def select(self, sql, binds):
+        if 'cip_insert_date < sysdate' in sql:
+            # Housekeeping, through the primary key from last_cip_id until batch_size rows are found
+            cutoff = time.time() - binds["retention_days"] * 86400
+            cip_ids = []
+            for row in DATABASE.rows.values():
+                if row["cip_id"] > binds["last_cip_id"] and row["cip_process_ind"] == 'Y' and \
+                        row["cip_insert_date"] < cutoff:
+                    cip_ids.append((row["cip_id"],))
+                    if len(cip_ids) == binds["batch_size"]:
+                        break
+            return cip_ids
+
+        # Inserted in cip_id order. The pending index only holds the rows not processed
+        if "(case when cip_process_ind = 'y' then null else cip_id end)" in sql:
+            rows = [DATABASE.rows[cip_id] for cip_id in sorted(DATABASE.pending_ids)]
+        else:
+            rows = list(DATABASE.rows.values())
+
+        if 'cip_id in (' in sql:
+            ids = set(binds.values())
+            rows = [row for row in rows if row["cip_id"] in ids]
+            if "cip_process_ind = 'y'" in sql:
+                rows = [row for row in rows if row["cip_process_ind"] == 'Y']
+        elif 'for update skip locked' in sql:
+            # Claim query, the fake has no concurrent agents so nothing is locked
+            DATABASE.rows_scanned += len(rows)
+            now = time.time()
+            return [(row["cip_id"],) for row in rows if self.pending(row, binds) and
+                    (row["cip_process_ind"] != 'P' or (row["cip_lease_expiry"] or 0) < now)]
+
+        elif "cip_agent_id = :agent_id" in sql:
+            rows = [row for row in rows if row["cip_process_ind"] == 'P' and
+                    row["cip_agent_id"] == binds["agent_id"] and
+                    binds["first_cip_id"] <= row["cip_id"] <= binds["last_cip_id"]]
+        else:
+            DATABASE.rows_scanned += len(rows)
+            rows = [row for row in rows if row["cip_process_ind"] in ('N', None) and self.pending(row, binds)]
+
+        if "page_size" in binds:
+            rows = rows[:binds["page_size"]]
+
+        # The columns in the order of the select list. LOBs as locators, unless the output type handler reads them
+        # inline
+        columns = [column.strip() for column in
+                   re.split(r',(?![^()]*\))', sql[len('select '):sql.index(' from ')])]
+        inline = {column: self.outputtypehandler is not None and
+                  self.outputtypehandler(self, column, LOB_TYPES[column], 0, 0, 0) is not None
+                  for column in columns if column in LOB_TYPES}
+        return [tuple(self.column_value(row, column, inline) for column in columns) for row in rows]
+
+    def column_value(self, row, column, inline):
+        if column.startswith('dbms_lob.getlength('):
+            value = row[column[len('dbms_lob.getlength('):-1]]
+            return None if value is None else len(value)
+        if column.startswith('dbms_crypto.hash('):
+            value = row[column[len('dbms_crypto.hash('):column.index(',')]]
+            return None if value is None else hashlib.sha256(value).digest()
+        if column in LOB_TYPES and row[column] is not None and not inline[column]:
+            return LOB(row[column])
+        return row.get(column)
+
+    def update(self, sql, binds):
+        now = time.time()
+        if "set cip_process_ind = 'y'" in sql:
+            row = DATABASE.rows.get(binds["id"])
+            if row is None or ("agent_id" in binds and row["cip_agent_id"] != binds["agent_id"]):
+                return 0
+            row["cip_process_ind"] = 'Y'
+            DATABASE.pending_ids.discard(binds["id"])
+            row["cip_process_error"] = str(binds.get("msg"))[:250]
+            DATABASE.ack_times.setdefault(binds["id"], time.monotonic())
+            return 1
+
+        if "set cip_process_ind = 'p'" in sql:
+            row = DATABASE.rows[binds["id"]]
+            row["cip_process_ind"] = 'P'
+            row["cip_agent_id"] = binds["agent_id"]
+            row["cip_lease_expiry"] = now + binds["lease_time"]
+            return 1
+
+        if "set cip_process_ind = 'n'" in sql:
+            count = 0
+            rows = DATABASE.rows.values()
+            if "cip_id = :id" in sql:
+                rows = [DATABASE.rows[binds["id"]]] if binds["id"] in DATABASE.rows else []
+            for row in rows:
+                if row["cip_process_ind"] == 'P' and row["cip_agent_id"] == binds["agent_id"]:
+                    row["cip_process_ind"] = 'N'
+                    row["cip_agent_id"] = None
+                    row["cip_lease_expiry"] = None
+                    count += 1
+            return count
+
+        if "set cip_lease_expiry" in sql:
+            row = DATABASE.rows.get(binds["id"])
+            if row is None or row["cip_process_ind"] != 'P' or row["cip_agent_id"] != binds["agent_id"]:
+                return 0
+            row["cip_lease_expiry"] = now + binds["lease_time"]
+            return 1
+
+        return 0
+
+    def delete(self, sql, binds):
+        # Housekeeping, processed rows by cip_id
+        if "cip_process_ind = 'y' and cip_id in (" not in sql:
+            return 0
+        cip_ids = [cip_id for cip_id in binds.values()
+                   if cip_id in DATABASE.rows and DATABASE.rows[cip_id]["cip_process_ind"] == 'Y']
+        for cip_id in cip_ids:
+            del DATABASE.rows[cip_id]
+        return len(cip_ids)
+
+    def insert(self, sql, binds):
+        # Housekeeping archive, INSERT INTO ... SELECT * of processed rows by cip_id
+        if "cip_process_ind = 'y' and cip_id in (" not in sql:
+            return 0
+        cip_ids = [cip_id for cip_id in binds.values()
+                   if cip_id in DATABASE.rows and DATABASE.rows[cip_id]["cip_process_ind"] == 'Y']
+        for cip_id in cip_ids:
+            DATABASE.archived_rows[cip_id] = dict(DATABASE.rows[cip_id])
+        return len(cip_ids)
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self.rows[self.position:self.position + size]
+        self.position += len(rows)
+        self.rowcount = self.position
+        return rows
+
+    def fetchall(self):
+        rows = self.rows[self.position:]
+        self.position = len(self.rows)
+        self.rowcount = self.position
+        return rows
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
@@ -0,0 +1,101 @@
+import argparse
+import email
+import socketserver
+import threading
+import time
+
+
+class SmtpSink:
+    # Local SMTP server that keeps the emails in memory, to try the alert emails of the agent without a mail
+    # server. It can be slowed down to see that the agent doesn't wait for it.
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0):
+        self.delay = delay
+        self.messages = []
+        self.sessions = 0
+        self.lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), SmtpHandler)
+        self.server.daemon_threads = True
+        self.server.smtp_sink = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_message(self, data):
+        with self.lock:
+            self.messages.append(email.message_from_bytes(data))
+
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        sink = self.server.smtp_sink
+        with sink.lock:
+            sink.sessions += 1
+        if sink.delay:
+            time.sleep(sink.delay)
+
+        self.reply('220 smtp sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.strip().split(b' ', 1)[0].upper()
+
+            if command in (b'HELO', b'EHLO'):
+                self.reply('250 smtp sink')
+            elif command in (b'MAIL', b'RCPT', b'RSET', b'NOOP'):
+                self.reply('250 OK')
+            elif command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line == b'.\r\n':
+                        break
+                    # Dot stuffing
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                sink.add_message(b''.join(lines))
+                self.reply('250 OK queued')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SMTP sink')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds before the greeting')
+    args = parser.parse_args()
+
+    sink = SmtpSink(port=args.port, delay=args.delay).start()
+    print('SMTP sink listening on port ' + str(sink.port) + ', set "email_server": "127.0.0.1" and "email_port": ' +
+          str(sink.port) + ' in config.JSON')
+    received = 0
+    try:
+        while True:
+            time.sleep(1)
+            for message in sink.messages[received:]:
+                print('To: ' + str(message['To']) + ' - ' + str(message['Subject']))
+                print(message.get_payload())
+            received = len(sink.messages)
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
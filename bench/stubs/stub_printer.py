@@ -0,0 +1,45 @@
+# Stub for SumatraPDF.exe and lpr used by the benchmarks. It only waits (reading stdin when lpr gets no file) and
+# exits, with the latency and the failure rate taken from the environment:
+#   BENCH_PRINT_LATENCY          seconds per run, starting up and printing (default 0.05)
+#   BENCH_PRINT_FILE_LATENCY     seconds per file printed, for the batches of SumatraPDF files (default 0)
+#   BENCH_PRINT_FAILURE_RATE     share of jobs failing, a run exits with 1 when any of its files fails (default 0)
+#   BENCH_SLOW_PRINTER           printer name (SumatraPDF -print-to) or host (lpr -S) that is slower
+#   BENCH_SLOW_PRINTER_LATENCY   seconds per job on the slow printer (default 1)
+#   BENCH_OFFLINE_PRINTER        printer name or host that hangs until killed by the agent
+import os
+import random
+import sys
+import time
+
+
+def main():
+    args = sys.argv[1:]
+    printer_name = None
+    files = 1
+    for option in ('-print-to', '-S'):
+        if option in args and args.index(option) + 1 < len(args):
+            printer_name = args[args.index(option) + 1]
+    # SumatraPDF -silent -print-to printer file...
+    if '-print-to' in args:
+        files = max(1, len(args) - args.index('-print-to') - 2)
+
+    # lpr -S host -P queue without a file reads the job from stdin
+    if len(args) >= 2 and args[-2] == '-P':
+        sys.stdin.buffer.read()
+
+    if printer_name is not None and printer_name == os.environ.get('BENCH_OFFLINE_PRINTER'):
+        time.sleep(3600)
+        sys.exit(1)
+
+    latency = float(os.environ.get('BENCH_PRINT_LATENCY', '0.05'))
+    if printer_name is not None and printer_name == os.environ.get('BENCH_SLOW_PRINTER'):
+        latency = float(os.environ.get('BENCH_SLOW_PRINTER_LATENCY', '1'))
+    time.sleep(latency + files * float(os.environ.get('BENCH_PRINT_FILE_LATENCY', '0')))
+
+    if random.random() < 1 - (1 - float(os.environ.get('BENCH_PRINT_FAILURE_RATE', '0'))) ** files:
+        print('Stub printer error on ' + str(printer_name), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
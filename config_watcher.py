@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+
+# watchdog is optional, without it the file is polled
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+
+def changed_keys(section_differences, old_section, new_section):
+    # Keys of a config section (e.g. "main") changed according to its jsondiff result, compact syntax. With
+    # section_differences = replace the old and new sections are compared key by key
+    if not section_differences:
+        return set()
+
+    from jsondiff import delete, replace
+
+    if not isinstance(section_differences, dict) or replace in section_differences:
+        # The whole section was replaced, compare it key by key
+        old_section = old_section if isinstance(old_section, dict) else {}
+        new_section = new_section if isinstance(new_section, dict) else {}
+        return {key for key in set(old_section) | set(new_section) if old_section.get(key) != new_section.get(key)}
+
+    keys = {key for key in section_differences if isinstance(key, str)}
+    keys.update(section_differences.get(delete, []))
+    return keys
+
+
+class ConfigFileEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        # Editors often write a temporary file and rename it over the config file
+        for path in (getattr(event, 'src_path', None), getattr(event, 'dest_path', None)):
+            if path and os.path.abspath(path) == self.watcher.file_name:
+                self.watcher.file_changed()
+                return
+
+
+class ConfigWatcher:
+    # Notices changes of the config file and sets changed_event once the file has been quiet for debounce_time
+    # seconds, so a file saved in several writes is reloaded once. Uses file system notifications through watchdog
+    # when installed, otherwise the modification time and size are checked every poll_interval seconds.
+    def __init__(self, logger, file_name, debounce_time=1, poll_interval=5):
+        self.logger = logger
+        self.file_name = os.path.abspath(file_name)
+        self.debounce_time = float(debounce_time)
+        self.poll_interval = float(poll_interval)
+        self.changed_event = threading.Event()
+        self.event = threading.Event()
+        self.last_change_time = None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.observer = None
+        self.file_state = self.read_file_state()
+
+    def start(self):
+        self.stop_event.clear()
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(ConfigFileEventHandler(self), os.path.dirname(self.file_name), recursive=False)
+            self.observer.daemon = True
+            self.observer.start()
+            self.logger.debug('Watching ' + self.file_name + ' for changes')
+        else:
+            self.logger.debug('watchdog not installed, polling ' + self.file_name + ' every ' +
+                              str(self.poll_interval) + ' seconds')
+
+        self.thread = threading.Thread(target=self.run, name='ConfigWatcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.event.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def read_file_state(self):
+        try:
+            stat = os.stat(self.file_name)
+            return stat.st_mtime, stat.st_size
+        except OSError:
+            return None
+
+    def file_changed(self):
+        self.last_change_time = time.monotonic()
+        self.event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            # Wait for a notification, or poll the file when there are none
+            if Observer is None:
+                if not self.event.wait(self.poll_interval):
+                    file_state = self.read_file_state()
+                    if file_state == self.file_state:
+                        continue
+                    self.file_changed()
+            else:
+                self.event.wait()
+
+            if self.stop_event.is_set():
+                break
+
+            # Debounce: wait until the file has not changed for debounce_time seconds
+            file_state = self.read_file_state()
+            while not self.stop_event.is_set():
+                self.event.clear()
+                quiet_time = time.monotonic() - self.last_change_time
+                if quiet_time >= self.debounce_time:
+                    break
+                self.event.wait(self.debounce_time - quiet_time)
+
+                # Without notifications, the writes are noticed by the state of the file
+                new_file_state = self.read_file_state()
+                if new_file_state != file_state:
+                    file_state = new_file_state
+                    self.last_change_time = time.monotonic()
+
+            if self.stop_event.is_set():
+                break
+            if file_state is None or file_state == self.file_state:
+                # Removed while being replaced, or saved without changes
+                continue
+            self.file_state = file_state
+            self.changed_event.set()
+
+# #######################################################################################################################
+# ############################ END OF CLASS ConfigWatcher ###############################################################
+# #######################################################################################################################
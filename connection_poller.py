@@ -0,0 +1,325 @@
+import threading
+import time
+
+import cx_Oracle
+
+from agent_metrics import STAGE_QUERY, STAGE_LOB_READ, STAGE_JOB
+from document_cache import CachedBlob
+from job_journal import FETCHED
+from print_dispatcher import PrintJob
+
+
+class ConnectionPoller:
+    # Polls one Oracle connection on its own thread, with its own pause time, so a slow query or a hung network on
+    # one database doesn't delay the others. The fetched jobs go to the shared PrintDispatcher and the poller updates
+    # its own printed rows, so each Oracle connection is only used by its poller thread.
+    # The agent (pyAgent) is the coordinator: it starts and stops the pollers on shutdown and config reload.
+    def __init__(self, agent, oracle_connection, wakeup):
+        self.agent = agent
+        self.oracle_connection = oracle_connection
+        # Decides how long the poller sleeps between cycles
+        self.wakeup = wakeup
+        self.stop_event = threading.Event()
+        self.abort = False
+        self.thread = None
+        self.rows_fetched = 0
+        # Rows fetched for the first time, the ones still queued from the previous cycles don't count
+        self.jobs_submitted = 0
+        self.jobs_printed = 0
+        self.jobs_failed = 0
+        self.leases_released = False
+        self.journal_reconciled = False
+        self.last_lease_renewal = None
+        # Last time the poller made progress, for the heartbeat of the supervisor mode. Sleeping between cycles
+        # counts as progress
+        self.last_active = time.monotonic()
+        self.sleeping = False
+
+    def start(self):
+        self.stop_event.clear()
+        self.abort = False
+        self.last_active = time.monotonic()
+        self.thread = threading.Thread(target=self.run,
+                                       name='Poller-' + self.oracle_connection.oracle_connection_name, daemon=True)
+        self.thread.start()
+
+    def stop(self, drain=True):
+        # drain=True lets the current cycle finish and update its rows, drain=False stops as soon as possible
+        self.abort = not drain
+        self.stop_event.set()
+        self.wakeup.notify()
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def run(self):
+        logger = self.agent.logger
+        logger.debug('Poller for ' + self.oracle_connection.oracle_connection_name + ' started')
+        self.wakeup.start()
+
+        while not self.stop_event.is_set():
+            self.last_active = time.monotonic()
+            try:
+                self.poll()
+            except cx_Oracle.Error as err:
+                # Most likely the connection was lost, it will be reconnected by connection_alive
+                logger.error('Error polling Oracle Database ' + self.oracle_connection.oracle_connection_name +
+                             ': ' + err.__str__())
+                self.oracle_connection.set_failed(logger, err)
+            except Exception as err:
+                logger.error('Unexpected error polling Oracle Database ' +
+                             self.oracle_connection.oracle_connection_name + ': ' + err.__str__())
+
+            if self.stop_event.is_set():
+                break
+
+            # Sleep until the pause time expires or a wakeup source notifies new jobs
+            self.sleeping = True
+            woken_up = self.sleep(self.wakeup.next_pause_time(self.jobs_submitted > 0))
+            self.sleeping = False
+            if woken_up:
+                logger.debug('Poller for %s woken up', self.oracle_connection.oracle_connection_name)
+
+        # Stopped to close the connection: the jobs still printing are updated first. The parked ones are left in
+        # the table
+        try:
+            while not self.abort and self.printing_jobs() > 0:
+                self.acknowledge_completed_jobs(timeout=1)
+            self.oracle_connection.ack_batcher.flush()
+        except cx_Oracle.Error as err:
+            logger.error('Error updating the printed rows of ' + self.oracle_connection.oracle_connection_name +
+                         ': ' + err.__str__())
+
+        self.wakeup.stop()
+        logger.debug('Poller for ' + self.oracle_connection.oracle_connection_name + ' stopped')
+
+    def sleep(self, pause_time):
+        # The jobs of the connection are updated as they finish while the poller sleeps, so a cycle never waits for
+        # its jobs and a slow printer doesn't hold up the jobs of the other printers
+        # The leases of the jobs held (parked ones included) are renewed on time while it sleeps
+        deadline = time.monotonic() + pause_time
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                self.renew_leases_if_due()
+                wait_time = min(remaining, self.lease_renewal_wait_time())
+                if self.printing_jobs() <= 0:
+                    # Nothing is left waiting to be updated while the poller sleeps
+                    self.oracle_connection.ack_batcher.flush()
+                    if self.wakeup.sleep(wait_time):
+                        return True
+                    continue
+                if self.wakeup.sleep(0):
+                    return True
+                self.acknowledge_completed_jobs(timeout=min(wait_time, 1))
+            except cx_Oracle.Error as err:
+                self.agent.logger.error('Error updating the printed rows of ' +
+                                        self.oracle_connection.oracle_connection_name + ': ' + err.__str__())
+                self.oracle_connection.set_failed(self.agent.logger, err)
+                return self.wakeup.sleep(remaining)
+        return False
+
+    def is_queued(self, cip_id):
+        return self.agent.dispatcher.is_pending(self.oracle_connection, cip_id) or \
+            self.oracle_connection.ack_batcher.is_pending(cip_id)
+
+    def skipped(self, cip_id, printer_name):
+        # Rows fetched and not submitted, their LOBs are not read
+        return self.is_queued(cip_id) or self.agent.dispatcher.printer_parked(printer_name)
+
+    def printing_jobs(self):
+        # Jobs of the connection queued or printing, the parked ones don't count
+        dispatcher = self.agent.dispatcher
+        return dispatcher.pending_jobs(self.oracle_connection) - dispatcher.parked_jobs(self.oracle_connection)
+
+    def poll(self):
+        agent = self.agent
+        dispatcher = agent.dispatcher
+        metrics = agent.metrics
+        connection_name = self.oracle_connection.oracle_connection_name
+        self.rows_fetched = 0
+        self.jobs_submitted = 0
+        self.jobs_printed = 0
+        self.jobs_failed = 0
+
+        # Check if connection is alive. If it is not, try to reconnect
+        agent.connection_alive(self.oracle_connection)
+
+        # If a connection is down, we don't try to run any query
+        if self.oracle_connection.connection_status == 'NOT_SUCCESS':
+            return
+
+        # The jobs printed but not updated before the last stop are updated without printing them again
+        if agent.journal is not None and not self.journal_reconciled:
+            agent.journal.reconcile(self.oracle_connection)
+            self.journal_reconciled = True
+
+        # With leasing, the rows left in progress by a previous run of this agent are released first
+        if agent.fetcher.leasing and not self.leases_released:
+            agent.fetcher.release_leases(self.oracle_connection)
+            self.leases_released = True
+            self.last_lease_renewal = time.monotonic()
+
+        agent.logger.debug('Run() - Prepare Query in Database %s', self.oracle_connection.oracle_connection_name)
+
+        # Retrieve rows from cent_iface_print table where cip_processed = 'N', page by page in cip_id order,
+        # so the jobs for each printer are dispatched in cip_id order
+        # The rows of the printers parked now are left in the table, not fetched
+        pages = agent.fetcher.fetch_pages(self.oracle_connection, self.skipped, dispatcher.parked_printers())
+        while True:
+
+            with metrics.timer(STAGE_QUERY, connection=connection_name):
+                rows = next(pages, None)
+            if rows is None:
+                break
+
+            self.rows_fetched += len(rows)
+            metrics.increment('fetched', len(rows), connection=connection_name)
+            submitted_ids = []
+            released_ids = []
+
+            # Route each row of the page to its printer queue
+            for row in rows:
+
+                if self.abort:
+                    pages.close()
+                    return
+
+                row_cip_id = row[1]
+
+                # Still queued or printing from a previous fetch, or printed and not updated yet
+                if self.is_queued(row_cip_id):
+                    continue
+
+                # Parked since the cycle started: left in the table while the circuit breaker of the printer is open,
+                # fetched again in a later cycle. A leased row is released, so another agent can print it
+                if dispatcher.printer_parked(row[3]):
+                    if agent.fetcher.leasing:
+                        released_ids.append(row_cip_id)
+                    continue
+
+                # Don't read more LOBs while the print queues are full. The parked jobs don't count, the healthy
+                # printers keep printing
+                while dispatcher.pending_jobs() - dispatcher.parked_jobs() >= agent.print_queue_size and \
+                        not self.abort:
+                    self.acknowledge_completed_jobs(timeout=1)
+
+                # The LOB locators belong to the connection, so they are read here and not in the workers, while
+                # the workers print the jobs already submitted. The BLOB goes to a spool file as it is read, the
+                # CLOB is kept in memory for the TEXT transports. Small LOBs are already in the row
+                with metrics.timer(STAGE_LOB_READ, connection=connection_name):
+                    # Only the LOB of the category is used
+                    blob = row[0] if row[5] == 'LASER' else None
+                    spool_file = None
+                    cached_document = None
+                    if isinstance(blob, CachedBlob):
+                        # Printed from the document cache, or stored in it once spooled
+                        cached_document = agent.document_cache.acquire(blob.key)
+                        if cached_document is None and blob.blob is None:
+                            # Deleted from the cache after the row was fetched
+                            blob.blob = agent.fetcher.read_blob(self.oracle_connection, row_cip_id)
+                        blob = blob.blob if cached_document is None else None
+                    if isinstance(blob, bytes):
+                        spool_file = agent.spool.spool_bytes(blob, row_cip_id, row[2])
+                    elif blob is not None:
+                        spool_file = agent.spool.spool_lob(blob, row_cip_id, row[2])
+                    if spool_file is not None and isinstance(row[0], CachedBlob):
+                        cached_document = agent.document_cache.store(row[0].key, spool_file)
+                    if cached_document is not None:
+                        spool_file = None
+
+                    # Large CLOBs are encoded for their printer chunk by chunk into a spool file
+                    clob_data = row[4]
+                    if row[5] != 'TEXT':
+                        clob_data = None
+                    elif clob_data is not None and not isinstance(clob_data, str):
+                        try:
+                            spool_file = agent.spool.spool_text(clob_data, row_cip_id, row[2],
+                                                                agent.text_encoder(row[3]))
+                        except UnicodeError as e:
+                            self.fail_job(row_cip_id, row[3], str(e))
+                            continue
+                        clob_data = None
+
+                # TEXT or LASER
+                if dispatcher.submit(PrintJob(self.oracle_connection, row_cip_id, row[2], row[3], row[5],
+                                              None, clob_data, spool_file, row[6] if len(row) > 6 else None,
+                                              cached_document)):
+                    submitted_ids.append(row_cip_id)
+                    self.jobs_submitted += 1
+                elif spool_file is not None:
+                    agent.spool.remove(spool_file)
+                elif cached_document is not None:
+                    agent.document_cache.release(cached_document)
+
+            if agent.journal is not None and submitted_ids:
+                agent.journal.record(self.oracle_connection, submitted_ids, FETCHED)
+
+            if released_ids:
+                agent.fetcher.release_rows(self.oracle_connection, released_ids)
+
+            # Update the jobs already printed while the next page is fetched
+            self.acknowledge_completed_jobs(timeout=0)
+
+        agent.logger.debug('Run() - Fetch completed in Database %s', self.oracle_connection.oracle_connection_name)
+
+        # The jobs still printing are updated while the poller sleeps, see sleep()
+        self.acknowledge_completed_jobs(timeout=0)
+        self.oracle_connection.ack_batcher.flush()
+
+        # Log some stats
+        agent.loggerStats.debug(f"{connection_name},{self.rows_fetched},{self.jobs_printed},{self.jobs_failed},"
+                                f"{dispatcher.pending_jobs()},{dispatcher.oldest_pending_age():.3f}")
+
+    def acknowledge_completed_jobs(self, timeout=None):
+        # Queue the printed jobs to be updated as cip_processed = 'Y'
+        self.last_active = time.monotonic()
+        metrics = self.agent.metrics
+        for job in self.agent.dispatcher.get_completed_jobs(timeout, self.oracle_connection):
+            self.oracle_connection.ack_batcher.add(job.cip_id, job.out)
+
+            if job.failed:
+                self.jobs_failed += 1
+            else:
+                self.jobs_printed += 1
+            metrics.increment('failed' if job.failed else 'printed', printer=job.printer_name,
+                              connection=self.oracle_connection.oracle_connection_name)
+            metrics.observe(STAGE_JOB, time.monotonic() - job.fetch_time,
+                            (('printer', job.printer_name),))
+
+        self.oracle_connection.ack_batcher.flush_if_due()
+        self.renew_leases_if_due()
+
+    def fail_job(self, cip_id, printer_name, out):
+        # Job that can't be printed at all, updated like the failed ones
+        self.agent.logger.error('Job %s failed -> %s', cip_id, out,
+                                extra={"cip_id": cip_id, "printer": printer_name,
+                                       "connection": self.oracle_connection.oracle_connection_name})
+        self.oracle_connection.ack_batcher.add(cip_id, out)
+        self.jobs_failed += 1
+        self.agent.metrics.increment('failed', printer=printer_name,
+                                     connection=self.oracle_connection.oracle_connection_name)
+
+    def lease_renewal_wait_time(self):
+        # Seconds until the leases are renewed, three times per lease time
+        fetcher = self.agent.fetcher
+        if not fetcher.leasing or self.last_lease_renewal is None:
+            return float('inf')
+        return max(0.0, self.last_lease_renewal + fetcher.lease_time / 3 - time.monotonic())
+
+    def renew_leases_if_due(self):
+        # Called while fetching, updating and sleeping, whether jobs complete or not
+        if self.lease_renewal_wait_time() > 0 or self.oracle_connection.connection_status == 'NOT_SUCCESS':
+            return
+
+        held_ids = self.agent.dispatcher.pending_cip_ids(self.oracle_connection) + \
+            list(self.oracle_connection.ack_batcher.pending_acks)
+        self.agent.fetcher.renew_leases(self.oracle_connection, sorted(set(held_ids)))
+        self.last_lease_renewal = time.monotonic()
+
+# #######################################################################################################################
+# ############################ END OF CLASS ConnectionPoller ############################################################
+# #######################################################################################################################
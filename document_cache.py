@@ -0,0 +1,168 @@
+import hashlib
+import itertools
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+class CachedBlob:
+    # BLOB of a LASER row read with the document cache enabled. key identifies the content of the BLOB. blob is
+    # None when the document was in the cache when the row was fetched, otherwise it is the BLOB (bytes or locator)
+    # to spool and store in the cache
+    def __init__(self, key, blob=None):
+        self.key = key
+        self.blob = blob
+
+
+class DocumentCache:
+    # LASER documents kept in cache_dir by content, so a document printed again (the same form or label template,
+    # a re-print, the same file sent to several printers) is neither read from Oracle nor written to disk again:
+    # SumatraPDF prints the cached file. The key is a hash of the BLOB computed by the database and its length.
+    # Up to max_size bytes are kept, the least recently used documents are deleted first, never the ones of jobs
+    # queued or printing. cache_dir should be on the same drive as the spool folder, so storing a document is a
+    # rename.
+    def __init__(self, logger, spool, cache_dir='cache', max_size=268435456):
+        self.logger = logger
+        # Deletes the evicted files, retrying the ones still open
+        self.spool = spool
+        self.cache_dir = cache_dir
+        self.max_size = max(0, int(max_size))
+        self.lock = threading.Lock()
+        # File name -> [size, jobs queued or printing it], least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        # Suffix of the evicted files, renamed before they are deleted
+        self.tombstones = itertools.count()
+
+    def open(self):
+        if not os.path.isdir(self.cache_dir):
+            self.logger.warning('Folder ' + self.cache_dir + ' does not exist. Needs to be created.')
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.logger.warning('Folder ' + self.cache_dir + ' created.')
+
+        # The documents cached by the previous run, oldest first
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, file_name)
+            if file_name.endswith('.pdf') and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, file_name, stat.st_size))
+            elif file_name.endswith('.deleted'):
+                # Evicted and not deleted before the last stop
+                self.spool.remove(path)
+
+        with self.lock:
+            for mtime, file_name, size in sorted(files):
+                self.entries[file_name] = [size, 0]
+                self.size += size
+            evicted = self.evict()
+        self.remove_files(evicted)
+
+        self.logger.debug('Document cache ' + self.cache_dir + ' opened with ' + str(len(self.entries)) +
+                          ' documents, ' + str(self.size) + ' bytes')
+
+    def file_name(self, key):
+        # The key can come from any column, the file name is its hash
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() + '.pdf'
+
+    def contains(self, key):
+        with self.lock:
+            return self.file_name(key) in self.entries
+
+    def acquire(self, key):
+        # Path of the cached document, kept until release(). None when it is not in the cache
+        file_name = self.file_name(key)
+        with self.lock:
+            entry = self.entries.get(file_name)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[1] += 1
+            self.entries.move_to_end(file_name)
+            self.hits += 1
+            self.bytes_saved += entry[0]
+        return os.path.join(self.cache_dir, file_name)
+
+    def store(self, key, spool_file):
+        # Moves a spooled document into the cache and acquires it. Returns its path in the cache, or None when it
+        # could not be moved and the spool file is to be printed instead
+        file_name = self.file_name(key)
+        path = os.path.join(self.cache_dir, file_name)
+        with self.lock:
+            entry = self.entries.get(file_name)
+            if entry is not None:
+                # Stored by another poller in the meantime
+                entry[1] += 1
+                self.entries.move_to_end(file_name)
+                self.spool.remove(spool_file)
+                return path
+
+            try:
+                size = os.path.getsize(spool_file)
+                shutil.move(spool_file, path)
+            except OSError as e:
+                self.logger.error('Unable to store ' + spool_file + ' in the document cache -> ' + str(e))
+                return None
+
+            self.entries[file_name] = [size, 1]
+            self.size += size
+            evicted = self.evict()
+        self.remove_files(evicted)
+        return path
+
+    def release(self, path):
+        # The job printing the document is done with it
+        with self.lock:
+            entry = self.entries.get(os.path.basename(path))
+            if entry is not None and entry[1] > 0:
+                entry[1] -= 1
+            evicted = self.evict()
+        self.remove_files(evicted)
+
+    def evict(self):
+        # Called with the lock held. Returns the paths of the evicted documents to delete. They are renamed first,
+        # holding the lock, so the delete, done later by the spool thread, never hits the same document stored again
+        evicted = []
+        if self.size <= self.max_size:
+            return evicted
+        for file_name, entry in list(self.entries.items()):
+            if self.size <= self.max_size:
+                break
+            if entry[1] == 0:
+                path = os.path.join(self.cache_dir, file_name)
+                tombstone = path + '.' + str(next(self.tombstones)) + '.deleted'
+                try:
+                    os.replace(path, tombstone)
+                except FileNotFoundError:
+                    tombstone = None
+                except OSError as e:
+                    # Still open, evicted later
+                    self.logger.debug('Unable to evict %s from the document cache -> %s', path, e)
+                    continue
+                del self.entries[file_name]
+                self.size -= entry[0]
+                if tombstone is not None:
+                    evicted.append(tombstone)
+        return evicted
+
+    def remove_files(self, paths):
+        for path in paths:
+            self.spool.remove(path)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def log_stats(self):
+        self.logger.info('Document cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses (' +
+                         format(self.hit_ratio(), '.1%') + ' hit rate), ' + str(self.bytes_saved) +
+                         ' bytes not read again, ' + str(len(self.entries)) + ' documents cached, ' +
+                         str(self.size) + ' bytes')
+
+# #######################################################################################################################
+# ############################ END OF CLASS DocumentCache ###############################################################
+# #######################################################################################################################
@@ -0,0 +1,345 @@
+import cx_Oracle
+
+from document_cache import CachedBlob
+from schema_support import PENDING_JOBS_KEY
+
+PENDING_JOBS_COLUMNS = "cip_blob, cip_id, cip_file_id, cip_printer_name, cip_clob, cip_printer_category"
+
+# Same row layout with the lengths of the LOBs in their place, the LOB a row needs is read afterwards
+PENDING_JOBS_METADATA_COLUMNS = ("dbms_lob.getlength(cip_blob), cip_id, cip_file_id, cip_printer_name, "
+                                 "dbms_lob.getlength(cip_clob), cip_printer_category")
+
+# Position in the row of the LOB printed for each category, the other LOB is never read
+CATEGORY_LOB_POSITIONS = {'LASER': 0, 'TEXT': 4}
+LOB_COLUMNS = {0: "cip_blob", 4: "cip_clob"}
+
+# Columns needed by job leasing. cip_process_ind = 'P' marks the rows leased (in progress) by an agent
+JOB_LEASING_DDL = """ALTER TABLE cent_iface_print ADD (cip_agent_id VARCHAR2(64), cip_lease_expiry TIMESTAMP)"""
+
+# Pending rows and rows leased by an agent that didn't renew its lease in time (crashed or stopped)
+CLAIMABLE_JOBS_PREDICATE = "(nvl(cip_process_ind, 'N') = 'N' OR (cip_process_ind = 'P' AND cip_lease_expiry < SYSTIMESTAMP)) "
+
+PENDING_JOBS_PREDICATE = "nvl(cip_process_ind, 'N') = 'N' "
+
+
+class JobFetcher:
+    # Reads the pending rows of cent_iface_print. In streaming mode the rows are read page by page with keyset
+    # pagination on cip_id, so only one page of LOB locators is held at a time and the first page can be printed
+    # while the rest of the backlog is still in the database. At most max_rows_per_cycle rows are read per cycle,
+    # the rest are picked up in the next cycle.
+    # With leasing, each page is claimed first with SELECT ... FOR UPDATE SKIP LOCKED and marked as in progress
+    # ('P') by agent_id for lease_time seconds, so several agents can drain the same table without printing a job
+    # twice. The leases of an agent that stops renewing them expire and are claimed by the other agents.
+    # With lazy_lobs the page query only reads the lengths of the LOBs, and then only the LOB of the category of
+    # each row is read: up to lob_inline_threshold bytes inline in the rows of one query (bytes or str, no round trip
+    # per LOB), above it as a locator, streamed to the spool file in chunks by the poller. With a document_cache,
+    # the BLOBs are first identified by document_hash_expression and the ones already cached are not read at all.
+    # With pending_index the rows are looked up and paged by the key of schema_support.PENDING_JOBS_INDEX_DDL (the
+    # cip_id of the rows not processed), so a cycle reads the index of the backlog instead of the whole table.
+    def __init__(self, logger, streaming=True, page_size=50, arraysize=50, prefetchrows=50, max_rows_per_cycle=1000,
+                 leasing=False, agent_id=None, lease_time=300, priority_column=None, lazy_lobs=True,
+                 lob_inline_threshold=262144, document_cache=None,
+                 document_hash_expression="DBMS_CRYPTO.HASH(cip_blob, 4)", pending_index=False):
+        self.logger = logger
+        self.streaming = streaming
+        self.page_size = max(1, int(page_size))
+        self.arraysize = max(1, int(arraysize))
+        self.prefetchrows = max(0, int(prefetchrows))
+        self.max_rows_per_cycle = max(0, int(max_rows_per_cycle))
+        self.leasing = leasing
+        self.agent_id = agent_id
+        self.lease_time = int(lease_time)
+        self.lazy_lobs = lazy_lobs
+        self.lob_inline_threshold = max(0, int(lob_inline_threshold))
+        # Needs lazy_lobs. The expression is a hash column or, by default, the SHA-256 of the BLOB computed by the
+        # database (needs EXECUTE on DBMS_CRYPTO)
+        self.document_cache = document_cache if lazy_lobs else None
+        self.document_hash_expression = document_hash_expression
+        # Optional priority column of cent_iface_print, read after PENDING_JOBS_COLUMNS
+        self.columns = (PENDING_JOBS_METADATA_COLUMNS if lazy_lobs else PENDING_JOBS_COLUMNS) + \
+            (", " + priority_column if priority_column else "")
+        # Equal to cip_id for the rows the queries return, so the pages are in cip_id order either way
+        self.pending_key = PENDING_JOBS_KEY if pending_index else "cip_id"
+        self.pending_predicate = PENDING_JOBS_PREDICATE
+        self.claimable_predicate = CLAIMABLE_JOBS_PREDICATE
+        if pending_index:
+            self.pending_predicate = PENDING_JOBS_KEY + " IS NOT NULL AND " + PENDING_JOBS_PREDICATE
+            self.claimable_predicate = PENDING_JOBS_KEY + " IS NOT NULL AND " + CLAIMABLE_JOBS_PREDICATE
+
+    def build_query(self, first_page, printer_filter=""):
+        query = "SELECT " + self.columns + " FROM cent_iface_print WHERE " + self.pending_predicate + printer_filter
+
+        if not self.streaming:
+            return query + "ORDER BY " + self.pending_key
+
+        if not first_page:
+            query += "AND " + self.pending_key + " > :last_cip_id "
+
+        return query + "ORDER BY " + self.pending_key + " FETCH FIRST :page_size ROWS ONLY"
+
+    def fetch_pages(self, oracle_connection, skipped=None, excluded_printers=()):
+        # Generator of pages (lists of rows). The LOB locators of a page must be read before asking for the next one.
+        # skipped(cip_id, printer_name) is True for the rows the poller won't submit (still queued or printing from a
+        # previous cycle, or for a parked printer), their LOBs are not read. The rows of excluded_printers (parked
+        # when the cycle starts) are not fetched at all, so they don't use up max_rows_per_cycle and the rows of
+        # the other printers behind them are still fetched
+        printer_filter, printer_binds = self.printer_filter(excluded_printers)
+        cursor = oracle_connection.connection.cursor()
+        cursor.arraysize = self.arraysize
+        cursor.prefetchrows = self.prefetchrows
+        lob_cursor = None
+        if self.lazy_lobs:
+            lob_cursor = oracle_connection.connection.cursor()
+            lob_cursor.arraysize = self.arraysize
+            lob_cursor.outputtypehandler = inline_lob_type_handler
+
+        try:
+            if self.leasing:
+                yield from self.fetch_leased_pages(oracle_connection, cursor, lob_cursor, skipped, printer_filter,
+                                                   printer_binds)
+                return
+
+            if not self.streaming:
+                cursor.execute(self.build_query(True, printer_filter), printer_binds)
+                rows = cursor.fetchall()
+                self.logger.debug('Number of rows fetched to be printed: %s', len(rows))
+                if rows:
+                    yield self.read_lobs(cursor, lob_cursor, rows, skipped)
+                return
+
+            rows_fetched = 0
+            last_cip_id = None
+
+            while self.max_rows_per_cycle == 0 or rows_fetched < self.max_rows_per_cycle:
+                page_size = self.page_size
+                if self.max_rows_per_cycle:
+                    page_size = min(page_size, self.max_rows_per_cycle - rows_fetched)
+
+                if last_cip_id is None:
+                    cursor.execute(self.build_query(True, printer_filter), page_size=page_size, **printer_binds)
+                else:
+                    cursor.execute(self.build_query(False, printer_filter), page_size=page_size,
+                                   last_cip_id=last_cip_id, **printer_binds)
+
+                rows = cursor.fetchall()
+                self.logger.debug('Page of %s rows fetched from %s after cip_id %s', len(rows),
+                                  oracle_connection.oracle_connection_name, last_cip_id)
+
+                if not rows:
+                    return
+
+                rows_fetched += len(rows)
+                last_cip_id = rows[-1][1]
+
+                yield self.read_lobs(cursor, lob_cursor, rows, skipped)
+
+                # Last page
+                if len(rows) < page_size:
+                    return
+
+            self.logger.debug('Max rows per cycle (' + str(self.max_rows_per_cycle) + ') reached in ' +
+                              oracle_connection.oracle_connection_name)
+        finally:
+            cursor.close()
+            if lob_cursor is not None:
+                lob_cursor.close()
+
+    def fetch_leased_pages(self, oracle_connection, cursor, lob_cursor, skipped=None, printer_filter="",
+                           printer_binds=None):
+        rows_fetched = 0
+        last_cip_id = None
+
+        while self.max_rows_per_cycle == 0 or rows_fetched < self.max_rows_per_cycle:
+            page_size = self.page_size if self.streaming else max(self.page_size, self.max_rows_per_cycle)
+            if self.max_rows_per_cycle:
+                page_size = min(page_size, self.max_rows_per_cycle - rows_fetched)
+
+            claimed_ids = self.claim_page(oracle_connection, cursor, last_cip_id, page_size, printer_filter,
+                                          printer_binds)
+            if not claimed_ids:
+                return
+
+            cursor.execute("SELECT " + self.columns + " FROM cent_iface_print WHERE cip_process_ind = 'P' "
+                           "AND cip_agent_id = :agent_id AND cip_id BETWEEN :first_cip_id AND :last_cip_id "
+                           "ORDER BY cip_id",
+                           agent_id=self.agent_id, first_cip_id=claimed_ids[0], last_cip_id=claimed_ids[-1])
+            rows = cursor.fetchall()
+
+            rows_fetched += len(claimed_ids)
+            last_cip_id = claimed_ids[-1]
+
+            if rows:
+                yield self.read_lobs(cursor, lob_cursor, rows, skipped)
+
+            # Last page
+            if len(claimed_ids) < page_size:
+                return
+
+    def read_lobs(self, cursor, lob_cursor, rows, skipped=None):
+        # Puts in place of the LOB lengths the LOB printed for the category of each row, the other one is None.
+        # One query per LOB column for the small LOBs, read inline by lob_cursor, and one for the locators of the
+        # large ones
+        if lob_cursor is None:
+            return rows
+
+        rows = [list(row) for row in rows]
+        rows_by_id = {row[1]: row for row in rows}
+        requested_ids = {}
+        blob_lengths = {}
+        for row in rows:
+            lob_position = CATEGORY_LOB_POSITIONS.get(row[5])
+            if skipped is not None and skipped(row[1], row[3]):
+                lob_position = None
+            for position in LOB_COLUMNS:
+                length = row[position]
+                row[position] = None
+                # NULL LOBs have no length
+                if position != lob_position or length is None:
+                    continue
+                if position == 0 and self.document_cache is not None:
+                    blob_lengths[row[1]] = length
+                else:
+                    requested_ids.setdefault((position, length <= self.lob_inline_threshold), []).append(row[1])
+
+        # The BLOBs of the documents already cached are not read
+        document_keys = {}
+        if blob_lengths:
+            for cip_id, document_hash in self.select_by_cip_ids(cursor, self.document_hash_expression,
+                                                                list(blob_lengths)):
+                if document_hash is not None:
+                    key = (document_hash.hex() if isinstance(document_hash, bytes) else str(document_hash)) + \
+                        '_' + str(blob_lengths[cip_id])
+                    if self.document_cache.contains(key):
+                        rows_by_id[cip_id][0] = CachedBlob(key)
+                    else:
+                        document_keys[cip_id] = key
+            for cip_id, length in blob_lengths.items():
+                if rows_by_id[cip_id][0] is None:
+                    requested_ids.setdefault((0, length <= self.lob_inline_threshold), []).append(cip_id)
+
+        for (position, inline), lob_cip_ids in requested_ids.items():
+            for cip_id, lob in self.select_by_cip_ids(lob_cursor if inline else cursor, LOB_COLUMNS[position],
+                                                      lob_cip_ids):
+                rows_by_id[cip_id][position] = lob
+
+        for cip_id, key in document_keys.items():
+            row = rows_by_id[cip_id]
+            if row[0] is not None:
+                row[0] = CachedBlob(key, row[0])
+
+        return [tuple(row) for row in rows]
+
+    def printer_filter(self, printer_names):
+        # Predicate and binds leaving out the rows of the given printers
+        if not printer_names:
+            return "", {}
+        binds = {"printer" + str(index): printer_name for index, printer_name in enumerate(printer_names)}
+        return "AND cip_printer_name NOT IN (" + ", ".join(":" + name for name in binds) + ") ", binds
+
+    def select_by_cip_ids(self, cursor, columns, cip_ids):
+        # cip_id and columns of the given rows, 500 binds per query
+        for start in range(0, len(cip_ids), 500):
+            chunk = cip_ids[start:start + 500]
+            binds = {"id" + str(index): cip_id for index, cip_id in enumerate(chunk)}
+            cursor.execute("SELECT cip_id, " + columns + " FROM cent_iface_print WHERE cip_id IN (" +
+                           ", ".join(":" + name for name in binds) + ")", binds)
+            yield from cursor.fetchall()
+
+    def read_blob(self, oracle_connection, cip_id):
+        # BLOB of one row, inline. For a cached document deleted from the cache after its row was fetched
+        cursor = oracle_connection.connection.cursor()
+        try:
+            cursor.outputtypehandler = inline_lob_type_handler
+            cursor.execute("SELECT cip_blob FROM cent_iface_print WHERE cip_id = :cip_id", cip_id=cip_id)
+            row = cursor.fetchone()
+            return row[0] if row is not None else None
+        finally:
+            cursor.close()
+
+    def claim_page(self, oracle_connection, cursor, last_cip_id, page_size, printer_filter="", printer_binds=None):
+        # Lock the next page of claimable rows, skipping the ones locked by other agents, and lease them
+        query = "SELECT cip_id FROM cent_iface_print WHERE " + self.claimable_predicate + printer_filter
+        printer_binds = printer_binds or {}
+        if last_cip_id is None:
+            cursor.execute(query + "ORDER BY " + self.pending_key + " FOR UPDATE SKIP LOCKED", printer_binds)
+        else:
+            cursor.execute(query + "AND " + self.pending_key + " > :last_cip_id ORDER BY " + self.pending_key +
+                           " FOR UPDATE SKIP LOCKED", last_cip_id=last_cip_id, **printer_binds)
+
+        claimed_ids = [row[0] for row in cursor.fetchmany(page_size)]
+
+        if not claimed_ids:
+            oracle_connection.connection.rollback()
+            return claimed_ids
+
+        cursor.executemany("UPDATE cent_iface_print SET cip_process_ind = 'P', cip_agent_id = :agent_id, "
+                           "cip_lease_expiry = SYSTIMESTAMP + NUMTODSINTERVAL(:lease_time, 'SECOND') "
+                           "WHERE cip_id = :id",
+                           [{"id": cip_id, "agent_id": self.agent_id, "lease_time": self.lease_time}
+                            for cip_id in claimed_ids])
+        oracle_connection.connection.commit()
+
+        self.logger.debug('%s rows leased in %s by %s', len(claimed_ids), oracle_connection.oracle_connection_name,
+                          self.agent_id)
+        return claimed_ids
+
+    def renew_leases(self, oracle_connection, cip_ids):
+        # Extend the leases of the rows this agent holds (queued, printing or printed and not updated yet). Returns
+        # the ones no longer leased to it, their lease expired and another agent claimed them
+        if not cip_ids:
+            return []
+        cursor = oracle_connection.connection.cursor()
+        cursor.executemany("UPDATE cent_iface_print "
+                           "SET cip_lease_expiry = SYSTIMESTAMP + NUMTODSINTERVAL(:lease_time, 'SECOND') "
+                           "WHERE cip_id = :id AND cip_process_ind = 'P' AND cip_agent_id = :agent_id",
+                           [{"id": cip_id, "agent_id": self.agent_id, "lease_time": self.lease_time}
+                            for cip_id in cip_ids], arraydmlrowcounts=True)
+        lost_ids = [cip_id for cip_id, row_count in zip(cip_ids, cursor.getarraydmlrowcounts()) if row_count == 0]
+        oracle_connection.connection.commit()
+        cursor.close()
+
+        if lost_ids:
+            self.logger.warning(str(len(lost_ids)) + ' leases of ' + str(self.agent_id) + ' lost in ' +
+                                oracle_connection.oracle_connection_name + ': ' +
+                                ', '.join(str(cip_id) for cip_id in lost_ids))
+        return lost_ids
+
+    def release_rows(self, oracle_connection, cip_ids):
+        # Rows leased by this agent and not dispatched (e.g. for a parked printer) are pending again, any agent can
+        # claim them
+        cursor = oracle_connection.connection.cursor()
+        cursor.executemany("UPDATE cent_iface_print SET cip_process_ind = 'N', cip_agent_id = NULL, "
+                           "cip_lease_expiry = NULL "
+                           "WHERE cip_id = :id AND cip_process_ind = 'P' AND cip_agent_id = :agent_id",
+                           [{"id": cip_id, "agent_id": self.agent_id} for cip_id in cip_ids])
+        released_rows = cursor.rowcount
+        oracle_connection.connection.commit()
+        cursor.close()
+        self.logger.debug('%s rows released in %s by %s', released_rows, oracle_connection.oracle_connection_name,
+                          self.agent_id)
+
+    def release_leases(self, oracle_connection):
+        # On start, the rows left in progress by a previous run of this agent are pending again
+        cursor = oracle_connection.connection.cursor()
+        cursor.execute("UPDATE cent_iface_print SET cip_process_ind = 'N', cip_agent_id = NULL, "
+                       "cip_lease_expiry = NULL WHERE cip_process_ind = 'P' AND cip_agent_id = :agent_id",
+                       agent_id=self.agent_id)
+        released_rows = cursor.rowcount
+        oracle_connection.connection.commit()
+        cursor.close()
+
+        if released_rows:
+            self.logger.warning(str(released_rows) + ' rows left in progress by ' + str(self.agent_id) + ' in ' +
+                                oracle_connection.oracle_connection_name + ' released')
+
+# #######################################################################################################################
+# ############################ END OF CLASS JobFetcher ##################################################################
+# #######################################################################################################################
+
+
+def inline_lob_type_handler(cursor, name, default_type, size, precision, scale):
+    # Output type handler of the LOB queries: the LOBs come in the rows as bytes and str instead of locators
+    if default_type == cx_Oracle.DB_TYPE_BLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
+    if default_type == cx_Oracle.DB_TYPE_CLOB:
+        return cursor.var(cx_Oracle.DB_TYPE_LONG, arraysize=cursor.arraysize)
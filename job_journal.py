@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+
+FETCHED = 'FETCHED'
+DISPATCHED = 'DISPATCHED'
+PRINTED = 'PRINTED'
+ACKED = 'ACKED'
+
+
+class JobJournal:
+    # Append-only local journal of the jobs (one JSON line per state change), so a job printed but not updated in
+    # cent_iface_print before a crash is not printed again: on start the journal is replayed and the printed rows
+    # are reconciled against the database. Writes are flushed to the OS straight away and fsync'ed in batches,
+    # at most fsync_interval seconds apart.
+    def __init__(self, logger, file_name, fsync_interval=0.2, max_file_size=10485760):
+        self.logger = logger
+        self.file_name = file_name
+        self.fsync_interval = float(fsync_interval)
+        self.max_file_size = int(max_file_size)
+        # (oracle_connection_name, cip_id) -> [state, cip_process_error] of the jobs not acknowledged yet
+        self.open_jobs = {}
+        self.lock = threading.Lock()
+        self.file = None
+        self.unsynced_writes = 0
+        self.stop_event = threading.Event()
+        self.sync_thread = None
+
+    def open(self):
+        self.replay()
+        self.compact()
+        self.stop_event.clear()
+        self.sync_thread = threading.Thread(target=self.sync_loop, name='JournalSync', daemon=True)
+        self.sync_thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        if self.sync_thread is not None:
+            self.sync_thread.join()
+        with self.lock:
+            if self.file is not None:
+                self.sync()
+                self.file.close()
+                self.file = None
+
+    def replay(self):
+        self.open_jobs = {}
+        if not os.path.exists(self.file_name):
+            return
+
+        with open(self.file_name, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line torn by a crash
+                    continue
+                self.apply(entry["c"], entry["id"], entry["s"], entry.get("m"))
+
+        self.logger.info('Job journal replayed, ' + str(len(self.open_jobs)) + ' jobs not acknowledged')
+
+    def apply(self, oracle_connection_name, cip_id, state, msg):
+        key = (oracle_connection_name, cip_id)
+        if state == ACKED:
+            self.open_jobs.pop(key, None)
+        else:
+            self.open_jobs[key] = [state, msg]
+
+    def compact(self):
+        # Rewrite the journal with the open jobs only
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+
+            temp_file_name = self.file_name + '.tmp'
+            with open(temp_file_name, 'w', encoding='utf-8') as file:
+                for (oracle_connection_name, cip_id), (state, msg) in self.open_jobs.items():
+                    file.write(self.format_entry(oracle_connection_name, cip_id, state, msg))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file_name, self.file_name)
+
+            self.file = open(self.file_name, 'a', encoding='utf-8')
+            self.unsynced_writes = 0
+
+    def format_entry(self, oracle_connection_name, cip_id, state, msg):
+        entry = {"t": round(time.time(), 3), "c": oracle_connection_name, "id": cip_id, "s": state}
+        if msg is not None:
+            entry["m"] = str(msg)[:250]
+        return json.dumps(entry) + '\n'
+
+    def record(self, oracle_connection, cip_ids, state, msg=None):
+        oracle_connection_name = oracle_connection.oracle_connection_name
+        with self.lock:
+            if self.file is None:
+                # Closed, for a print worker still printing after the drain time: the job stays DISPATCHED and is
+                # printed again
+                return
+            for cip_id in cip_ids:
+                self.apply(oracle_connection_name, cip_id, state, msg)
+                self.file.write(self.format_entry(oracle_connection_name, cip_id, state, msg))
+            self.file.flush()
+            self.unsynced_writes += 1
+            compact_needed = self.file.tell() > self.max_file_size
+
+        if compact_needed:
+            self.compact()
+
+    def record_job(self, job, state):
+        self.record(job.oracle_connection, [job.cip_id], state, job.out if state == PRINTED else None)
+
+    def sync(self):
+        # Must be called holding the lock
+        if self.unsynced_writes:
+            os.fsync(self.file.fileno())
+            self.unsynced_writes = 0
+
+    def sync_loop(self):
+        while not self.stop_event.wait(self.fsync_interval):
+            with self.lock:
+                self.sync()
+
+    def printed_jobs(self, oracle_connection):
+        # Jobs of the connection printed but not acknowledged, as {cip_id: cip_process_error}
+        with self.lock:
+            return {cip_id: msg for (oracle_connection_name, cip_id), (state, msg) in self.open_jobs.items()
+                    if oracle_connection_name == oracle_connection.oracle_connection_name and state == PRINTED}
+
+    def reconcile(self, oracle_connection):
+        # Called once the connection is open: the rows printed and still pending in cent_iface_print are queued to
+        # be acknowledged, the ones already updated are closed in the journal. Jobs fetched or dispatched but not
+        # printed are left to be fetched and printed again.
+        printed_jobs = self.printed_jobs(oracle_connection)
+        if not printed_jobs:
+            return
+
+        processed_ids = []
+        cip_ids = list(printed_jobs.keys())
+        cursor = oracle_connection.connection.cursor()
+        for start in range(0, len(cip_ids), 500):
+            chunk = cip_ids[start:start + 500]
+            binds = {"id" + str(index): cip_id for index, cip_id in enumerate(chunk)}
+            cursor.execute("SELECT cip_id FROM cent_iface_print WHERE cip_process_ind = 'Y' AND cip_id IN (" +
+                           ", ".join(":" + name for name in binds) + ")", binds)
+            processed_ids.extend(row[0] for row in cursor.fetchall())
+        cursor.close()
+
+        if processed_ids:
+            self.record(oracle_connection, processed_ids, ACKED)
+
+        for cip_id in processed_ids:
+            printed_jobs.pop(cip_id, None)
+
+        if not printed_jobs:
+            return
+
+        for cip_id, msg in printed_jobs.items():
+            oracle_connection.ack_batcher.add(cip_id, msg)
+
+        self.logger.warning(str(len(printed_jobs)) + ' jobs printed before the last stop will be updated in ' +
+                            oracle_connection.oracle_connection_name + ' without printing them again')
+        oracle_connection.ack_batcher.flush()
+
+# #######################################################################################################################
+# ############################ END OF CLASS JobJournal ##################################################################
+# #######################################################################################################################
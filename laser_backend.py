@@ -0,0 +1,59 @@
+import subprocess
+
+from print_command import run_command
+
+SPAWN = 'SPAWN'
+BATCH = 'BATCH'
+
+
+class SpawnLaserBackend:
+    # Prints the PDF files of LASER jobs with one SumatraPDF process per file, as the agent always did
+    def __init__(self, logger, command, shell=False, timeout=None):
+        self.logger = logger
+        self.command = command
+        self.shell = shell
+        self.timeout = timeout
+
+    def file_command(self, printer_name, file):
+        return self.command + ['-silent', '-print-to', printer_name, file]
+
+    def print_files(self, printer_name, files):
+        # Returns a CompletedProcess per file, in the same order. Raises subprocess.TimeoutExpired (the process
+        # tree was killed) or OSError when a command can't run
+        return [run_command(self.file_command(printer_name, file), self.shell, self.timeout, text=True)
+                for file in files]
+
+# #######################################################################################################################
+# ############################ END OF CLASS SpawnLaserBackend ###########################################################
+# #######################################################################################################################
+
+
+class BatchLaserBackend(SpawnLaserBackend):
+    # Prints all the files of a printer given at once with a single SumatraPDF process (SumatraPDF prints every
+    # file on its command line), so starting SumatraPDF and its PDF engine is paid once per batch instead of once
+    # per job. SumatraPDF only has one exit code and doesn't tell which files it printed before failing (e.g. with
+    # one broken PDF in the batch): the files are not printed again, all the jobs of the batch fail for good with a
+    # note that they may have printed (see pyAgent.print_job_batch). A batch that times out fails the same way.
+    # The output of SumatraPDF is shared by the batch, it is logged once and the result of every file only
+    # refers to the batch.
+    def print_files(self, printer_name, files):
+        if len(files) == 1:
+            return super().print_files(printer_name, files)
+
+        command = self.command + ['-silent', '-print-to', printer_name] + list(files)
+        timeout = self.timeout * len(files) if self.timeout else None
+        out = run_command(command, self.shell, timeout, text=True)
+        if out.returncode != 0:
+            self.logger.warning('SumatraPDF failed printing a batch of ' + str(len(files)) + ' files on ' +
+                                printer_name + ', all its jobs failed -> ' + str(out))
+            note = 'Batch of ' + str(len(files)) + ' files failed, the file may have printed already'
+        else:
+            self.logger.debug('Batch of %s files printed on %s -> %s', len(files), printer_name, out)
+            note = ''
+
+        return [subprocess.CompletedProcess(self.file_command(printer_name, file), out.returncode, '', note)
+                for file in files]
+
+# #######################################################################################################################
+# ############################ END OF CLASS BatchLaserBackend ###########################################################
+# #######################################################################################################################
@@ -0,0 +1,42 @@
+import os
+import signal
+import subprocess
+
+# Seconds the output of a killed command is waited for. A process of the tree that could not be killed keeps its
+# pipes open, it is not waited for
+KILL_WAIT_TIME = 5
+
+
+def kill_process_tree(process):
+    # With a shell the process is cmd.exe or sh: killing only it leaves SumatraPDF or lpr running, holding the pipes
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True)
+    else:
+        # The command runs in its own process group, see run_command
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        process.kill()
+    except OSError:
+        pass
+
+
+def run_command(command, shell=False, timeout=None, input=None, stdin=None, text=False):
+    # subprocess.run with a timeout that kills the whole process tree of the command, not only its first process,
+    # and doesn't block on the pipes once it is killed. Returns a CompletedProcess, raises subprocess.TimeoutExpired
+    # (the command was killed) or OSError when the command can't run
+    process = subprocess.Popen(command, shell=shell, stdin=subprocess.PIPE if input is not None else stdin,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text,
+                               start_new_session=os.name != 'nt')
+    try:
+        stdout, stderr = process.communicate(input, timeout)
+    except subprocess.TimeoutExpired as error:
+        kill_process_tree(process)
+        try:
+            error.stdout, error.stderr = process.communicate(timeout=KILL_WAIT_TIME)
+        except subprocess.TimeoutExpired:
+            pass
+        raise
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
@@ -0,0 +1,421 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+
+from agent_metrics import STAGE_QUEUE_WAIT
+from agent_logging import job_log_fields
+from printer_health import PrinterHealth, OPEN, CLOSED
+
+
+class PrintJob:
+    def __init__(self, oracle_connection, cip_id, file_id, printer_name, printer_category, blob_data, clob_data,
+                 spool_file=None, priority=None, cached_document=None):
+        self.oracle_connection = oracle_connection
+        self.cip_id = cip_id
+        self.file_id = file_id
+        self.printer_name = printer_name
+        self.printer_category = printer_category
+        self.blob_data = blob_data
+        self.clob_data = clob_data
+        # BLOB already copied to a PrintSpool file, instead of blob_data
+        self.spool_file = spool_file
+        # Path of the BLOB in the DocumentCache, acquired for this job, instead of spool_file
+        self.cached_document = cached_document
+        # From the priority column of cent_iface_print, None to use the printer or category priority
+        self.priority = priority
+        # Output of the print command, stored later in cip_process_error
+        self.out = None
+        self.failed = False
+        # False when printing the job again could print it twice, it fails for good
+        self.retry = True
+        self.fetch_time = time.monotonic()
+        # Times it was printed, and when it can be printed again after a failure
+        self.attempts = 0
+        self.not_before = 0.0
+        self.sort_key = None
+
+    def key(self):
+        return self.oracle_connection.oracle_connection_index, self.cip_id
+
+
+# #######################################################################################################################
+# ############################ END OF CLASS PrintJob ####################################################################
+# #######################################################################################################################
+class PrintDispatcher:
+    # Jobs are routed into one queue per printer (cip_printer_name). A pool of worker threads takes jobs from the
+    # printer queues, never running more than printer_max_concurrency jobs on the same printer.
+    # Scheduling: every job has a priority (the priority column, else printer_priorities, else category_priorities,
+    # else 0; higher prints first) that grows by one every aging_time seconds it waits, so nothing starves. The
+    # printer whose next job has the highest priority goes first, printers on the same priority are served in
+    # round-robin order. Within a printer the jobs are printed by priority, then in the order they were submitted.
+    # A printer with a rate limit starts at most that many jobs per minute.
+    # Failed jobs are printed again up to max_attempts times, retry_wait_time seconds later, and each printer has a
+    # PrinterHealth circuit breaker: the jobs of a printer failing again and again are parked, not attempted, so the
+    # workers keep printing on the healthy printers. release_function is called with every job that won't be
+    # printed again, to record its result and delete its files.
+    # With batching configured, a worker takes up to max_batch_size jobs of the batch categories queued for the same
+    # printer and prints them with one call to batch_function, which sets the out, failed and retry of every job. A
+    # batch counts as one job for printer_max_concurrency. Retries, printers with a rate limit and printers that failed
+    # recently print one job at a time, so every failure is their own.
+    def __init__(self, print_function, logger, worker_count=4, printer_max_concurrency=1, release_function=None,
+                 batch_function=None):
+        self.print_function = print_function
+        self.release_function = release_function
+        self.batch_function = batch_function
+        self.max_batch_size = 1
+        self.batch_categories = ()
+        self.logger = logger
+        self.worker_count = max(1, int(worker_count))
+        self.printer_max_concurrency = max(1, int(printer_max_concurrency))
+        # printer_name -> heap of (sort key, sequence, job)
+        self.printer_queues = OrderedDict()
+        self.printer_active_jobs = {}
+        self.sequence = itertools.count()
+        self.printer_priorities = {}
+        self.category_priorities = {}
+        self.aging_time = 0.0
+        self.printer_rate_limit = 0
+        self.printer_rate_limits = {}
+        # printer_name -> earliest time its next job can start, for the rate limits
+        self.printer_next_start = {}
+        # printer_name -> PrinterHealth, for the printers that failed at least once
+        self.printer_health = {}
+        self.failure_threshold = 5
+        self.open_time = 30.0
+        self.max_open_time = 600.0
+        self.max_attempts = 1
+        self.retry_wait_time = 0.0
+        # AgentMetrics, queue wait time per category and priority
+        self.metrics = None
+        self.pending_keys = set()
+        # Completed jobs by oracle_connection_index, each connection updates its own jobs
+        self.completed_jobs = {}
+        self.condition = threading.Condition()
+        self.workers = []
+        self.stopping = False
+
+    def configure_scheduler(self, printer_priorities=None, category_priorities=None, aging_time=0,
+                            printer_rate_limit=0, printer_rate_limits=None):
+        # Also used by the config hot-reload, applies to the jobs submitted from now on
+        with self.condition:
+            self.printer_priorities = printer_priorities or {}
+            self.category_priorities = category_priorities or {}
+            self.aging_time = max(0.0, float(aging_time))
+            self.printer_rate_limit = float(printer_rate_limit)
+            self.printer_rate_limits = printer_rate_limits or {}
+            self.condition.notify_all()
+
+    def configure_printer_health(self, failure_threshold=5, open_time=30, max_open_time=600, max_attempts=1,
+                                 retry_wait_time=0):
+        # Also used by the config hot-reload, the printers keep their state
+        with self.condition:
+            self.failure_threshold = max(1, int(failure_threshold))
+            self.open_time = max(0.0, float(open_time))
+            self.max_open_time = max(self.open_time, float(max_open_time))
+            self.max_attempts = max(1, int(max_attempts))
+            self.retry_wait_time = max(0.0, float(retry_wait_time))
+            for health in self.printer_health.values():
+                health.failure_threshold = self.failure_threshold
+                health.open_time = self.open_time
+                health.max_open_time = self.max_open_time
+            self.condition.notify_all()
+
+    def configure_batching(self, max_batch_size=1, batch_categories=()):
+        # Also used by the config hot-reload
+        with self.condition:
+            self.max_batch_size = max(1, int(max_batch_size))
+            self.batch_categories = tuple(batch_categories)
+
+    def job_priority(self, job):
+        if job.priority is not None:
+            return float(job.priority)
+        priority = self.printer_priorities.get(job.printer_name)
+        if priority is None:
+            priority = self.category_priorities.get(job.printer_category, 0)
+        return float(priority)
+
+    def current_priority(self, job, now):
+        # Whole levels, so the printers on the same level are still served in round-robin order
+        if not self.aging_time:
+            return job.priority
+        return math.floor(job.priority + (now - job.fetch_time) / self.aging_time)
+
+    def start(self):
+        self.stopping = False
+        for worker_index in range(self.worker_count):
+            worker = threading.Thread(target=self.worker_loop, name='PrintWorker-' + str(worker_index), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        self.logger.debug('PrintDispatcher started with ' + str(self.worker_count) + ' workers')
+
+    def stop(self, timeout=None):
+        # The workers finish the jobs they are printing, timeout seconds at most for all of them. Returns the
+        # number of workers still printing
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        if self.workers:
+            self.logger.warning('PrintDispatcher stopped with ' + str(len(self.workers)) + ' workers still printing')
+        else:
+            self.logger.debug('PrintDispatcher stopped')
+        return len(self.workers)
+
+    def submit(self, job):
+        with self.condition:
+            # The same row can be fetched again while it is still queued or printing
+            if job.key() in self.pending_keys:
+                return False
+
+            self.pending_keys.add(job.key())
+            job.priority = self.job_priority(job)
+            # All the jobs of a printer age at the same rate, so the order in the queue never changes
+            job.sort_key = -job.priority + (job.fetch_time / self.aging_time if self.aging_time else 0)
+            heapq.heappush(self.printer_queues.setdefault(job.printer_name, []),
+                           (job.sort_key, next(self.sequence), job))
+            self.condition.notify_all()
+            return True
+
+    def is_pending(self, oracle_connection, cip_id):
+        with self.condition:
+            return (oracle_connection.oracle_connection_index, cip_id) in self.pending_keys
+
+    def pending_jobs(self, oracle_connection=None):
+        with self.condition:
+            if oracle_connection is None:
+                return len(self.pending_keys)
+            return sum(1 for key in self.pending_keys if key[0] == oracle_connection.oracle_connection_index)
+
+    def pending_cip_ids(self, oracle_connection):
+        # cip_id of the jobs of the connection queued, printing or completed and not collected yet
+        with self.condition:
+            return [key[1] for key in self.pending_keys if key[0] == oracle_connection.oracle_connection_index]
+
+    def printer_parked(self, printer_name):
+        # True while the circuit breaker of the printer doesn't let its jobs start
+        with self.condition:
+            health = self.printer_health.get(printer_name)
+            return health is not None and health.parked(time.monotonic())
+
+    def parked_printers(self):
+        # Printers whose circuit breaker doesn't let their jobs start
+        now = time.monotonic()
+        with self.condition:
+            return [printer_name for printer_name, health in self.printer_health.items() if health.parked(now)]
+
+    def parked_jobs(self, oracle_connection=None):
+        # Jobs queued for printers whose circuit breaker is open
+        now = time.monotonic()
+        with self.condition:
+            count = 0
+            for printer_name, health in self.printer_health.items():
+                if health.parked(now):
+                    for sort_key, sequence, job in self.printer_queues.get(printer_name, ()):
+                        if oracle_connection is None or \
+                                job.oracle_connection.oracle_connection_index == oracle_connection.oracle_connection_index:
+                            count += 1
+            return count
+
+    def oldest_pending_age(self):
+        # Seconds the oldest job still queued has been waiting since it was fetched
+        with self.condition:
+            fetch_times = [job.fetch_time for printer_queue in self.printer_queues.values()
+                           for sort_key, sequence, job in printer_queue]
+        return time.monotonic() - min(fetch_times) if fetch_times else 0.0
+
+    def get_completed_jobs(self, timeout=None, oracle_connection=None):
+        # Wait until at least one job is completed (or the timeout expires) and return the completed jobs,
+        # all of them or only the ones of oracle_connection
+        def completed_indexes():
+            if oracle_connection is None:
+                return [index for index, jobs in self.completed_jobs.items() if jobs]
+            if self.completed_jobs.get(oracle_connection.oracle_connection_index):
+                return [oracle_connection.oracle_connection_index]
+            return []
+
+        with self.condition:
+            if timeout != 0:
+                self.condition.wait_for(lambda: self.stopping or completed_indexes(), timeout)
+
+            jobs = []
+            for index in completed_indexes():
+                jobs.extend(self.completed_jobs.pop(index))
+
+            for job in jobs:
+                self.pending_keys.discard(job.key())
+
+            return jobs
+
+    def next_jobs(self):
+        # Must be called holding the condition. Returns (jobs, None), a job or a batch of jobs of the same printer,
+        # or (None, seconds until a rate limited printer can start its next job). Printers are visited in
+        # round-robin order, the first one with the highest priority wins
+        now = time.monotonic()
+        best_printer_name = None
+        best_priority = None
+        wait_time = None
+
+        for printer_name, printer_queue in self.printer_queues.items():
+            if self.printer_active_jobs.get(printer_name, 0) >= self.printer_max_concurrency:
+                continue
+
+            # Parked until the breaker lets a probe start
+            health = self.printer_health.get(printer_name)
+            if health is not None and health.parked(now):
+                health_wait_time = health.wait_time(now)
+                if health_wait_time is not None and (wait_time is None or health_wait_time < wait_time):
+                    wait_time = health_wait_time
+                continue
+
+            # Rate limit, or a failed job waiting to be printed again
+            next_start = max(self.printer_next_start.get(printer_name, 0.0), printer_queue[0][2].not_before)
+            if next_start > now:
+                if wait_time is None or next_start - now < wait_time:
+                    wait_time = next_start - now
+                continue
+
+            priority = self.current_priority(printer_queue[0][2], now)
+            if best_priority is None or priority > best_priority:
+                best_printer_name = printer_name
+                best_priority = priority
+
+        if best_printer_name is None:
+            return None, wait_time
+
+        printer_queue = self.printer_queues[best_printer_name]
+        job = heapq.heappop(printer_queue)[2]
+        rate_limit = float(self.printer_rate_limits.get(best_printer_name, self.printer_rate_limit) or 0)
+        health = self.printer_health.get(best_printer_name)
+
+        jobs = [job]
+        if self.batch_function is not None and self.max_batch_size > 1 and rate_limit <= 0 and health is None and \
+                job.attempts == 0 and job.printer_category in self.batch_categories:
+            # The next jobs of the printer in the queue order
+            while printer_queue and len(jobs) < self.max_batch_size:
+                next_job = printer_queue[0][2]
+                if next_job.attempts or next_job.printer_category not in self.batch_categories:
+                    break
+                jobs.append(heapq.heappop(printer_queue)[2])
+
+        if printer_queue:
+            self.printer_queues.move_to_end(best_printer_name)
+        else:
+            del self.printer_queues[best_printer_name]
+
+        if rate_limit > 0:
+            self.printer_next_start[best_printer_name] = now + 60.0 / rate_limit
+        else:
+            self.printer_next_start.pop(best_printer_name, None)
+
+        self.printer_active_jobs[best_printer_name] = self.printer_active_jobs.get(best_printer_name, 0) + 1
+        if health is not None:
+            health.job_started()
+
+        if self.metrics is not None:
+            for job in jobs:
+                self.metrics.observe(STAGE_QUEUE_WAIT, now - job.fetch_time,
+                                     (('category', job.printer_category), ('priority', str(int(job.priority)))))
+        return jobs, None
+
+    def worker_loop(self):
+        while True:
+            with self.condition:
+                jobs = None
+                while not self.stopping:
+                    jobs, wait_time = self.next_jobs()
+                    if jobs is not None:
+                        break
+                    self.condition.wait(wait_time)
+
+                if jobs is None:
+                    return
+
+            for job in jobs:
+                job.failed = False
+            try:
+                if len(jobs) == 1:
+                    jobs[0].out = self.print_function(jobs[0])
+                else:
+                    self.batch_function(jobs)
+            except Exception as e:
+                for job in jobs:
+                    job.out = str(e)
+                    job.failed = True
+                    self.logger.error('Unexpected error printing job %s on printer %s -> %s', job.cip_id,
+                                      job.printer_name, e, extra=job_log_fields(job))
+
+            printer_name = jobs[0].printer_name
+            finished_jobs = []
+            with self.condition:
+                self.printer_active_jobs[printer_name] -= 1
+                if self.printer_active_jobs[printer_name] == 0:
+                    del self.printer_active_jobs[printer_name]
+
+                # A batch is one print on the printer, its jobs printed or failed together: it counts once for
+                # the health of the printer
+                self.update_printer_health(next((job for job in jobs if job.failed), jobs[0]))
+
+                for job in jobs:
+                    job.attempts += 1
+
+                    if job.failed and job.retry and job.attempts < self.max_attempts and not self.stopping:
+                        # Printed again later, before the other jobs of its printer
+                        job.not_before = time.monotonic() + self.retry_wait_time
+                        heapq.heappush(self.printer_queues.setdefault(job.printer_name, []),
+                                       (job.sort_key, next(self.sequence), job))
+                        self.condition.notify_all()
+                        if self.metrics is not None:
+                            self.metrics.increment('retried', printer=job.printer_name)
+                    else:
+                        finished_jobs.append(job)
+
+            for job in finished_jobs:
+                if job.attempts > 1 or (job.failed and job.retry and self.max_attempts > 1):
+                    job.out = 'Attempt ' + str(job.attempts) + ' of ' + str(self.max_attempts) + ': ' + str(job.out)
+
+                # Release the LOB data and the files as soon as the job is printed
+                job.blob_data = None
+                job.clob_data = None
+                if self.release_function is not None:
+                    try:
+                        self.release_function(job)
+                    except Exception as e:
+                        self.logger.error('Unable to release the files of job ' + str(job.cip_id) + ' -> ' + str(e))
+
+            if finished_jobs:
+                with self.condition:
+                    for job in finished_jobs:
+                        self.completed_jobs.setdefault(job.oracle_connection.oracle_connection_index,
+                                                       deque()).append(job)
+                    self.condition.notify_all()
+
+    def update_printer_health(self, job):
+        # Must be called holding the condition
+        health = self.printer_health.get(job.printer_name)
+        if health is None:
+            if not job.failed:
+                return
+            health = self.printer_health[job.printer_name] = PrinterHealth(self.failure_threshold, self.open_time,
+                                                                           self.max_open_time)
+
+        state = health.job_finished(job.failed, time.monotonic())
+        if state == OPEN:
+            self.logger.warning('Printer ' + str(job.printer_name) + ' failed ' + str(health.consecutive_failures) +
+                                ' times in a row, its jobs are parked for ' + str(health.current_open_time) +
+                                ' seconds')
+        elif state == CLOSED:
+            self.logger.info('Printer ' + str(job.printer_name) + ' is printing again')
+
+        # Healthy again, also after failures below the threshold: the entry is dropped so the printer batches again
+        if health.state == CLOSED and health.consecutive_failures == 0:
+            del self.printer_health[job.printer_name]
+
+# #######################################################################################################################
+# ############################ END OF CLASS PrintDispatcher #############################################################
+# #######################################################################################################################
@@ -0,0 +1,122 @@
+import os
+import queue
+import tempfile
+import threading
+
+from text_encoder import iter_text_chunks
+
+
+class PrintSpool:
+    # Files handed to SumatraPDF and lpr. Every file gets a unique name (tempfile.mkstemp) in spool_dir, which can be
+    # a RAM disk. LOBs are copied to the file chunk by chunk, so a large PDF is never held in memory whole, and the
+    # printed files are deleted by a background thread. Windows keeps a file locked while a process has it open,
+    # such files are retried up to max_remove_attempts times.
+    def __init__(self, logger, spool_dir='temp', chunk_size=262144, max_remove_attempts=10, retry_wait_time=2):
+        self.logger = logger
+        self.spool_dir = spool_dir
+        self.chunk_size = max(8192, int(chunk_size))
+        self.max_remove_attempts = int(max_remove_attempts)
+        self.retry_wait_time = float(retry_wait_time)
+        # Paths to delete, with their number of attempts
+        self.remove_queue = queue.Queue()
+        self.thread = None
+
+    def open(self):
+        if not os.path.isdir(self.spool_dir):
+            self.logger.warning('Folder ' + self.spool_dir + ' does not exist. Needs to be created.')
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self.logger.warning('Folder ' + self.spool_dir + ' created.')
+
+        # Files of jobs not printed when the agent stopped, they are spooled again when fetched
+        for file_name in os.listdir(self.spool_dir):
+            if file_name.startswith('spool_'):
+                self.remove(os.path.join(self.spool_dir, file_name))
+
+        self.thread = threading.Thread(target=self.remove_loop, name='SpoolCleanup', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        if self.thread is not None:
+            self.remove_queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def create_file(self, cip_id, file_id, suffix=''):
+        # The cip_id and the file name stay readable in the name, for the print queue and for support
+        file_id = str(file_id).replace('/', '_').replace('\\', '_').replace(':', '_')
+        fd, path = tempfile.mkstemp(suffix='_' + file_id + suffix, prefix='spool_' + str(cip_id) + '_',
+                                    dir=self.spool_dir)
+        return os.fdopen(fd, 'wb'), path
+
+    def spool_lob(self, lob, cip_id, file_id):
+        # Reads the BLOB straight into the file, chunk_size bytes per round trip, until a short read. Asking the LOB
+        # for its size or chunk size would cost a round trip each
+        file, path = self.create_file(cip_id, file_id)
+        try:
+            with file:
+                offset = 1
+                while True:
+                    data = lob.read(offset, self.chunk_size)
+                    if not data:
+                        break
+                    file.write(data)
+                    offset += len(data)
+                    if len(data) < self.chunk_size:
+                        break
+        except BaseException:
+            file.close()
+            self.remove(path)
+            raise
+        return path
+
+    def spool_bytes(self, data, cip_id, file_id):
+        file, path = self.create_file(cip_id, file_id)
+        with file:
+            file.write(data)
+        return path
+
+    def spool_text(self, text, cip_id, file_id, encoder):
+        # The CLOB (str or LOB locator) goes through the TextEncoder of its printer chunk by chunk
+        return self.spool_chunks(encoder.encode_chunks(iter_text_chunks(text, self.chunk_size)), cip_id, file_id,
+                                 '.txt')
+
+    def spool_chunks(self, chunks, cip_id, file_id, suffix=''):
+        file, path = self.create_file(cip_id, file_id, suffix)
+        try:
+            with file:
+                for data in chunks:
+                    file.write(data)
+        except BaseException:
+            file.close()
+            self.remove(path)
+            raise
+        return path
+
+    def remove(self, path):
+        # Never blocks the caller
+        self.remove_queue.put((path, 1))
+
+    def remove_loop(self):
+        while True:
+            item = self.remove_queue.get()
+            if item is None:
+                break
+
+            path, attempt = item
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                if attempt >= self.max_remove_attempts:
+                    self.logger.error('Unable to delete the spool file ' + path + ' -> ' + str(e))
+                    continue
+                # Most likely still open by the print command, tried again later
+                threading.Timer(self.retry_wait_time, self.remove_queue.put, ((path, attempt + 1),)).start()
+                continue
+
+            self.logger.debug('File %s deleted.', path)
+
+# #######################################################################################################################
+# ############################ END OF CLASS PrintSpool ##################################################################
+# #######################################################################################################################
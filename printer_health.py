@@ -0,0 +1,63 @@
+CLOSED = 'CLOSED'
+OPEN = 'OPEN'
+HALF_OPEN = 'HALF_OPEN'
+
+
+class PrinterHealth:
+    # Circuit breaker of one printer, used by the PrintDispatcher holding its lock. CLOSED: the jobs print as usual.
+    # After failure_threshold failures in a row it opens: the jobs of the printer are parked, not attempted, for
+    # open_time seconds. Then it is HALF_OPEN: a single job is printed as a probe. If it prints the breaker closes,
+    # if not it opens again for twice as long, up to max_open_time seconds.
+    def __init__(self, failure_threshold=5, open_time=30, max_open_time=600):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.open_time = max(0.0, float(open_time))
+        self.max_open_time = max(self.open_time, float(max_open_time))
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.current_open_time = self.open_time
+        self.open_until = 0.0
+        self.probe_running = False
+
+    def parked(self, now):
+        # True while the jobs of the printer must not start
+        if self.state == OPEN and now >= self.open_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return self.probe_running
+        return self.state == OPEN
+
+    def wait_time(self, now):
+        # Seconds until the next probe can start, None when waiting for the running one
+        if self.state == OPEN:
+            return max(0.0, self.open_until - now)
+        return None
+
+    def job_started(self):
+        if self.state == HALF_OPEN:
+            self.probe_running = True
+
+    def job_finished(self, failed, now):
+        # Returns the new state when it changed
+        self.probe_running = False
+        if not failed:
+            self.consecutive_failures = 0
+            self.current_open_time = self.open_time
+            if self.state != CLOSED:
+                self.state = CLOSED
+                return CLOSED
+            return None
+
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            # The probe failed
+            self.current_open_time = min(self.max_open_time, self.current_open_time * 2)
+        elif self.state != CLOSED or self.consecutive_failures < self.failure_threshold:
+            return None
+
+        self.state = OPEN
+        self.open_until = now + self.current_open_time
+        return OPEN
+
+# #######################################################################################################################
+# ############################ END OF CLASS PrinterHealth ###############################################################
+# #######################################################################################################################
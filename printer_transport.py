@@ -0,0 +1,242 @@
+import itertools
+import os
+import socket
+import subprocess
+import threading
+import time
+
+from print_command import run_command
+
+LPD_PORT = 515
+RAW_PORT = 9100
+
+
+class PrinterTransportError(Exception):
+    pass
+
+
+def parse_printer_address(printer_name, default_port):
+    # cip_printer_name for TEXT printers is "host[:port][,anything else]", the same host lpr -S gets
+    address = printer_name.split(',')[0].strip()
+    host, separator, port = address.partition(':')
+    if separator and port.isdigit():
+        return host, int(port)
+    return address, default_port
+
+
+def data_size(data):
+    # The job data is bytes or a spool file opened in binary mode
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return os.fstat(data.fileno()).st_size - data.tell()
+
+
+def send_data(connection, data):
+    if isinstance(data, (bytes, bytearray)):
+        connection.sendall(data)
+    else:
+        # Straight from the file, without reading it into memory
+        connection.sendfile(data)
+
+
+class LpdTransport:
+    # Line Printer Daemon protocol client (RFC 1179). The data goes straight from memory to the printer, without a
+    # temp file or an lpr process. LPD only allows one job per connection, so connections are not reused.
+    def __init__(self, logger, queue_name='lp', file_type='f', timeout=30, use_reserved_port=False):
+        self.logger = logger
+        self.queue_name = queue_name
+        # 'f' is plain text, like lpr sends by default. 'l' prints the data as it is (ESC/P, ZPL, PCL)
+        self.file_type = file_type
+        self.timeout = float(timeout)
+        # RFC 1179 asks for a source port in 721-731, most printers don't check it
+        self.use_reserved_port = use_reserved_port
+        self.job_numbers = itertools.cycle(range(1000))
+        self.job_numbers_lock = threading.Lock()
+        self.host_name = socket.gethostname().split('.')[0][:31] or 'agent'
+
+    def connect(self, host, port):
+        if not self.use_reserved_port:
+            return socket.create_connection((host, port), self.timeout)
+
+        last_error = None
+        for source_port in range(721, 732):
+            try:
+                return socket.create_connection((host, port), self.timeout, ('', source_port))
+            except OSError as error:
+                last_error = error
+        raise last_error
+
+    def read_ack(self, connection, step):
+        ack = connection.recv(1)
+        if ack != b'\x00':
+            raise PrinterTransportError('LPD printer refused the ' + step + ' (' + repr(ack) + ')')
+
+    def send(self, printer_name, data, job_name):
+        host, port = parse_printer_address(printer_name, LPD_PORT)
+        size = data_size(data)
+
+        with self.job_numbers_lock:
+            job_number = '%03d' % next(self.job_numbers)
+
+        data_file_name = 'dfA' + job_number + self.host_name
+        control_file = ('H' + self.host_name + '\n' +
+                        'P' + 'CoreTechPrintAgent' + '\n' +
+                        'J' + job_name[:99] + '\n' +
+                        self.file_type + data_file_name + '\n' +
+                        'U' + data_file_name + '\n' +
+                        'N' + job_name[:131] + '\n').encode('ascii', 'replace')
+
+        try:
+            with self.connect(host, port) as connection:
+                # Receive a printer job
+                connection.sendall(b'\x02' + self.queue_name.encode('ascii') + b'\n')
+                self.read_ack(connection, 'queue ' + self.queue_name)
+
+                # Control file
+                connection.sendall(('\x02' + str(len(control_file)) + ' cfA' + job_number + self.host_name +
+                                    '\n').encode('ascii'))
+                self.read_ack(connection, 'control file')
+                connection.sendall(control_file + b'\x00')
+                self.read_ack(connection, 'control file data')
+
+                # Data file
+                connection.sendall(('\x03' + str(size) + ' ' + data_file_name + '\n').encode('ascii'))
+                self.read_ack(connection, 'data file')
+                send_data(connection, data)
+                connection.sendall(b'\x00')
+                self.read_ack(connection, 'data file data')
+        except OSError as error:
+            raise PrinterTransportError('LPD error sending to ' + host + ':' + str(port) + ' -> ' + str(error))
+
+        self.logger.debug('LPD job %s sent to %s:%s queue %s', job_name, host, port, self.queue_name)
+        return 'LPD OK ' + host + ':' + str(port) + ' queue ' + self.queue_name + ' (' + str(size) + ' bytes)'
+
+    def close(self):
+        pass
+
+# #######################################################################################################################
+# ############################ END OF CLASS LpdTransport ################################################################
+# #######################################################################################################################
+class RawTransport:
+    # Raw socket printing (JetDirect, port 9100). With keep_connections the idle connections are kept per printer for
+    # idle_timeout seconds and reused for the next job. sendall() on a connection the printer has closed still
+    # succeeds locally, so every idle connection is checked before it is reused.
+    def __init__(self, logger, timeout=30, keep_connections=False, idle_timeout=30):
+        self.logger = logger
+        self.timeout = float(timeout)
+        self.keep_connections = keep_connections
+        self.idle_timeout = float(idle_timeout)
+        # (host, port) -> list of (socket, last used time)
+        self.idle_connections = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, host, port):
+        now = time.monotonic()
+        with self.lock:
+            connections = self.idle_connections.get((host, port), [])
+            while connections:
+                connection, last_used = connections.pop()
+                if now - last_used < self.idle_timeout and connection_open(connection):
+                    return connection, True
+                connection.close()
+
+        return socket.create_connection((host, port), self.timeout), False
+
+    def release(self, host, port, connection):
+        if not self.keep_connections:
+            connection.close()
+            return
+        with self.lock:
+            self.idle_connections.setdefault((host, port), []).append((connection, time.monotonic()))
+
+    def send(self, printer_name, data, job_name):
+        host, port = parse_printer_address(printer_name, RAW_PORT)
+        size = data_size(data)
+        start = None if isinstance(data, (bytes, bytearray)) else data.tell()
+
+        # A reused connection may have been closed by the printer, then the job is sent again on a new one
+        for attempt in range(2):
+            connection = None
+            reused = False
+            try:
+                connection, reused = self.acquire(host, port)
+                if start is not None:
+                    data.seek(start)
+                send_data(connection, data)
+                self.release(host, port, connection)
+                break
+            except OSError as error:
+                if connection is not None:
+                    connection.close()
+                if attempt == 0 and reused:
+                    continue
+                raise PrinterTransportError('RAW error sending to ' + host + ':' + str(port) + ' -> ' + str(error))
+
+        self.logger.debug('RAW job %s sent to %s:%s', job_name, host, port)
+        return 'RAW OK ' + host + ':' + str(port) + ' (' + str(size) + ' bytes)'
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle_connections.values():
+                for connection, last_used in connections:
+                    connection.close()
+            self.idle_connections = {}
+
+# #######################################################################################################################
+# ############################ END OF CLASS RawTransport ################################################################
+# #######################################################################################################################
+
+
+def connection_open(connection):
+    # Nothing to read on an idle connection still open. recv returns b'' when the printer closed it, and fails when
+    # it was reset; data the printer sent unasked is not expected either
+    timeout = connection.gettimeout()
+    try:
+        connection.setblocking(False)
+        connection.recv(1, socket.MSG_PEEK)
+        return False
+    except BlockingIOError:
+        return True
+    except OSError:
+        return False
+    finally:
+        connection.settimeout(timeout)
+
+
+class CommandTransport:
+    # Runs the lpr command without a file and writes the job to its stdin, for lpr versions that read stdin
+    def __init__(self, logger, command, shell=False, queue_name='lp', timeout=None):
+        self.logger = logger
+        self.command = command
+        self.shell = shell
+        self.queue_name = queue_name
+        self.timeout = timeout
+
+    def send(self, printer_name, data, job_name):
+        command = self.command + ["-S", printer_name.split(',')[0], "-P", self.queue_name]
+        try:
+            # A spool file is read by the command itself, bytes are written by communicate() in chunks, without
+            # copying them
+            from_file = not isinstance(data, (bytes, bytearray))
+            out = run_command(command, self.shell, self.timeout, None if from_file else data,
+                              data if from_file else None)
+            stdout = out.stdout.decode(errors='replace')
+            stderr = out.stderr.decode(errors='replace')
+        except subprocess.TimeoutExpired as error:
+            # run_command killed the command and the processes it started
+            raise PrinterTransportError(str(error))
+        except OSError as error:
+            raise PrinterTransportError('Unable to run ' + str(command) + ' -> ' + str(error))
+
+        if out.returncode != 0:
+            raise PrinterTransportError(str(subprocess.CalledProcessError(out.returncode, command, stdout, stderr)))
+
+        self.logger.debug('Job %s written to %s', job_name, command)
+        return subprocess.CompletedProcess(command, out.returncode, stdout, stderr)
+
+    def close(self):
+        pass
+
+# #######################################################################################################################
+# ############################ END OF CLASS CommandTransport ############################################################
+# #######################################################################################################################
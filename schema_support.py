@@ -0,0 +1,127 @@
+import threading
+import time
+
+import cx_Oracle
+
+# Key of the pending index: the cip_id of the rows not processed yet, NULL for the processed ones ('Y'). Oracle
+# doesn't store the rows whose index key is all NULL, so the index only holds the backlog (pending and leased rows)
+# and stays the same size however many processed rows the table keeps. The queries must use the same expression
+# for the optimizer to pick the index.
+PENDING_JOBS_KEY = "(CASE WHEN cip_process_ind = 'Y' THEN NULL ELSE cip_id END)"
+
+PENDING_JOBS_INDEX_DDL = """CREATE INDEX cent_iface_print_pending_idx ON cent_iface_print
+(CASE WHEN cip_process_ind = 'Y' THEN NULL ELSE cip_id END)"""
+
+# Insert date of the rows, for the retention of the housekeeping. The rows already in the table get the date the
+# column is added. A site with its own date column sets housekeeping_date_column instead
+HOUSEKEEPING_DATE_DDL = """ALTER TABLE cent_iface_print ADD (cip_insert_date DATE DEFAULT SYSDATE)"""
+
+# Archive table of the housekeeping, with the same columns as cent_iface_print and no rows
+ARCHIVE_TABLE_DDL = """CREATE TABLE cent_iface_print_archive AS SELECT * FROM cent_iface_print WHERE 1 = 0"""
+
+
+class Housekeeper:
+    # Removes the processed rows of cent_iface_print older than retention_days (by date_column) every
+    # interval seconds, with their LOBs, so the table only holds the backlog and the recent history. With an
+    # archive_table the rows are copied there first. The rows are removed batch_size at a time, one commit per batch,
+    # and at most max_batches per run, so the undo, the locks and the load on the database stay bounded; a long
+    # history is removed over several runs. The rows are found in cip_id order through the primary key, the oldest
+    # first, without scanning the table.
+    def __init__(self, logger, connections, interval=3600, retention_days=30, batch_size=500, max_batches=20,
+                 date_column="cip_insert_date", archive_table=None):
+        self.logger = logger
+        # Function returning the OracleConnections of the agent, they change with the config hot-reload
+        self.connections = connections
+        self.interval = max(1.0, float(interval))
+        self.retention_days = max(0.0, float(retention_days))
+        # 500 binds per statement at most, as the other queries by cip_id
+        self.batch_size = max(1, min(500, int(batch_size)))
+        self.max_batches = max(1, int(max_batches))
+        self.date_column = date_column
+        self.archive_table = archive_table or None
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.rows_removed = 0
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='Housekeeper', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        # A batch being removed is committed first
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            for oracle_connection in self.connections():
+                if self.stop_event.is_set():
+                    return
+                if oracle_connection.connection_status == 'SUCCESS':
+                    self.clean(oracle_connection)
+
+    def clean(self, oracle_connection):
+        # One run on a connection, on a session of its pool so the poller is not held up
+        start_time = time.perf_counter()
+        try:
+            session = oracle_connection.acquire_session()
+        except cx_Oracle.Error as e:
+            self.logger.error('Housekeeping of ' + oracle_connection.oracle_connection_name + ' failed -> ' + str(e))
+            return
+
+        rows_removed = 0
+        try:
+            cursor = session.cursor()
+            last_cip_id = 0
+            for _ in range(self.max_batches):
+                if self.stop_event.is_set():
+                    break
+                cip_ids = self.select_batch(cursor, last_cip_id)
+                if not cip_ids:
+                    break
+                rows_removed += self.remove_batch(session, cursor, cip_ids)
+                last_cip_id = cip_ids[-1]
+                if len(cip_ids) < self.batch_size:
+                    break
+            cursor.close()
+            oracle_connection.release_session(session)
+        except cx_Oracle.Error as e:
+            self.logger.error('Housekeeping of ' + oracle_connection.oracle_connection_name + ' failed after ' +
+                              str(rows_removed) + ' rows -> ' + str(e))
+            # Broken session, not given back to the pool
+            try:
+                oracle_connection.pool.drop(session)
+            except (cx_Oracle.Error, AttributeError):
+                pass
+
+        self.rows_removed += rows_removed
+        if rows_removed:
+            self.logger.info(str(rows_removed) + ' processed rows ' + ('archived' if self.archive_table else 'purged') +
+                             ' in ' + oracle_connection.oracle_connection_name + ' in ' +
+                             str(round(time.perf_counter() - start_time, 1)) + ' seconds')
+
+    def select_batch(self, cursor, last_cip_id):
+        cursor.execute("SELECT cip_id FROM cent_iface_print WHERE cip_id > :last_cip_id AND cip_process_ind = 'Y' "
+                       "AND " + self.date_column + " < SYSDATE - :retention_days "
+                       "ORDER BY cip_id FETCH FIRST :batch_size ROWS ONLY",
+                       last_cip_id=last_cip_id, retention_days=self.retention_days, batch_size=self.batch_size)
+        return [row[0] for row in cursor.fetchall()]
+
+    def remove_batch(self, session, cursor, cip_ids):
+        # cip_process_ind is checked again, the rows are only removed once processed
+        binds = {"id" + str(index): cip_id for index, cip_id in enumerate(cip_ids)}
+        where = " WHERE cip_process_ind = 'Y' AND cip_id IN (" + ", ".join(":" + name for name in binds) + ")"
+        if self.archive_table:
+            cursor.execute("INSERT INTO " + self.archive_table + " SELECT * FROM cent_iface_print" + where, binds)
+        cursor.execute("DELETE FROM cent_iface_print" + where, binds)
+        rows_removed = cursor.rowcount
+        session.commit()
+        self.logger.debug('%s processed rows removed up to cip_id %s', rows_removed, cip_ids[-1])
+        return rows_removed
+
+# #######################################################################################################################
+# ############################ END OF CLASS Housekeeper #################################################################
+# #######################################################################################################################
@@ -0,0 +1,49 @@
+import threading
+import time
+
+# When the agent started loading its modules, the closest to the start of the process it can measure. In the frozen
+# executable the time spent unpacking it before is not included
+LOAD_START_TIME = time.perf_counter()
+
+
+class StartupTimer:
+    # Time spent in each phase of the start of the agent (loading the modules, reading the config, connecting to
+    # the databases...), logged once the pollers are running, and the time until the first job starts printing:
+    # what a restart costs while the print queues build up. A phase ends when phase_done() is called and starts
+    # when the previous one ended.
+    def __init__(self, start_time=LOAD_START_TIME):
+        self.start_time = start_time
+        self.last_time = start_time
+        self.phases = []
+        self.ready_time = None
+        self.first_job_time = None
+        self.lock = threading.Lock()
+
+    def phase_done(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last_time))
+        self.last_time = now
+
+    def ready(self, logger):
+        # The agent is polling, the report of the phases is logged
+        self.ready_time = time.perf_counter() - self.start_time
+        logger.info('Startup completed in ' + format_ms(self.ready_time) + ': ' +
+                    ', '.join(name + ' ' + format_ms(seconds) for name, seconds in self.phases))
+
+    def job_started(self, logger):
+        # Called by every print worker for every job, only the first one is logged
+        if self.first_job_time is not None:
+            return
+        with self.lock:
+            if self.first_job_time is not None:
+                return
+            self.first_job_time = time.perf_counter() - self.start_time
+        logger.info('First job started printing ' + format_ms(self.first_job_time) + ' after the start of the agent')
+
+# #######################################################################################################################
+# ############################ END OF CLASS StartupTimer ################################################################
+# #######################################################################################################################
+
+
+def format_ms(seconds):
+    return str(int(round(seconds * 1000))) + ' ms'
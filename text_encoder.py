@@ -0,0 +1,77 @@
+import codecs
+
+# What happens to the line feeds of the CLOB: removed (as the agent always did), kept, or normalised to CR LF or LF
+NEWLINE_POLICIES = ('strip', 'keep', 'crlf', 'lf')
+
+
+def iter_text_chunks(source, chunk_size):
+    # Characters of a CLOB (str or LOB locator) chunk_size at a time, so a long report is never held whole
+    if isinstance(source, str):
+        for start in range(0, len(source), chunk_size):
+            yield source[start:start + chunk_size]
+        return
+
+    offset = 1
+    while True:
+        data = source.read(offset, chunk_size)
+        if not data:
+            break
+        yield data
+        offset += len(data)
+        if len(data) < chunk_size:
+            break
+
+
+class TextEncoder:
+    # Turns the CLOB of a TEXT job into the bytes sent to its printer, chunk by chunk with an incremental encoder,
+    # so the memory used doesn't depend on the size of the job. newline is one of NEWLINE_POLICIES, encoding the
+    # codepage of the printer and errors what to do with the characters it doesn't have (any Python codec error
+    # handler: strict fails the job, replace prints '?', ignore drops them). passthrough is for data already in the
+    # printer language (ESC/P, ZPL): sent as it is, one byte per character.
+    def __init__(self, encoding='ISO-8859-1', newline='strip', errors='replace', passthrough=False):
+        if passthrough:
+            encoding = 'latin-1'
+            newline = 'keep'
+            errors = 'strict'
+        if newline not in NEWLINE_POLICIES:
+            raise ValueError('Unknown newline policy ' + str(newline) + ', expected one of ' +
+                             ', '.join(NEWLINE_POLICIES))
+        # Raise LookupError when unknown
+        codecs.lookup(encoding)
+        codecs.lookup_error(errors)
+        self.encoding = encoding
+        self.newline = newline
+        self.errors = errors
+
+    def encode_chunks(self, chunks):
+        # Generator of the encoded chunks
+        encoder = codecs.getincrementalencoder(self.encoding)(self.errors)
+        # A CR at the end of a chunk may be the first half of a CR LF
+        pending_cr = ''
+        for chunk in chunks:
+            if self.newline == 'strip':
+                chunk = chunk.replace('\n', '')
+            elif self.newline != 'keep':
+                chunk = pending_cr + chunk
+                pending_cr = ''
+                if chunk.endswith('\r'):
+                    chunk = chunk[:-1]
+                    pending_cr = '\r'
+                chunk = chunk.replace('\r\n', '\n')
+                if self.newline == 'crlf':
+                    chunk = chunk.replace('\n', '\r\n')
+
+            data = encoder.encode(chunk)
+            if data:
+                yield data
+
+        data = encoder.encode(pending_cr, final=True)
+        if data:
+            yield data
+
+    def encode(self, text, chunk_size=65536):
+        return b''.join(self.encode_chunks(iter_text_chunks(text, chunk_size)))
+
+# #######################################################################################################################
+# ############################ END OF CLASS TextEncoder #################################################################
+# #######################################################################################################################
@@ -0,0 +1,162 @@
+import threading
+
+import cx_Oracle
+
+PRINT_ALERT_NAME = "CENT_IFACE_PRINT"
+
+# Statement level trigger needed by the DBMS_ALERT wakeup source. The alert is only delivered when the inserting
+# transaction commits, so the agent never wakes up before the new rows are visible.
+PRINT_ALERT_TRIGGER_DDL = """CREATE OR REPLACE TRIGGER cent_iface_print_alert_trg
+AFTER INSERT ON cent_iface_print
+BEGIN
+  DBMS_ALERT.SIGNAL('""" + PRINT_ALERT_NAME + """', 'NEW');
+END;"""
+
+
+class Wakeup:
+    # Decides when a poller queries its database again. The poller sleeps for the pause time unless one of the
+    # wakeup sources notifies that there may be new jobs. With adaptive polling the pause time goes back to
+    # min_pause_time while jobs are flowing and grows by backoff_factor on every idle cycle up to max_pause_time.
+    def __init__(self, logger, min_pause_time, max_pause_time, backoff_factor=2, adaptive=True):
+        self.logger = logger
+        self.event = threading.Event()
+        self.sources = []
+        self.configure(min_pause_time, max_pause_time, backoff_factor, adaptive)
+
+    def configure(self, min_pause_time, max_pause_time, backoff_factor=2, adaptive=True):
+        # Also used by the config hot-reload, the poller wakes up to use the new pause time
+        self.min_pause_time = float(min_pause_time)
+        self.max_pause_time = max(float(max_pause_time), self.min_pause_time)
+        self.backoff_factor = max(1.0, float(backoff_factor))
+        self.adaptive = adaptive
+        self.pause_time = self.min_pause_time
+
+    def add_source(self, source):
+        self.sources.append(source)
+
+    def start(self):
+        for source in self.sources:
+            source.start(self)
+
+    def stop(self):
+        for source in self.sources:
+            source.stop()
+        self.notify()
+
+    def notify(self):
+        self.event.set()
+
+    def next_pause_time(self, jobs_found):
+        if not self.adaptive:
+            return self.max_pause_time
+
+        if jobs_found:
+            self.pause_time = self.min_pause_time
+        else:
+            self.pause_time = min(self.pause_time * self.backoff_factor, self.max_pause_time)
+
+        return self.pause_time
+
+    def wait(self, jobs_found):
+        # Returns True when woken up by a source, False when the pause time expired
+        return self.sleep(self.next_pause_time(jobs_found))
+
+    def sleep(self, timeout):
+        # Part of a pause, True when woken up by a source
+        woken = self.event.wait(timeout)
+        self.event.clear()
+        return woken
+
+# #######################################################################################################################
+# ############################ END OF CLASS Wakeup ######################################################################
+# #######################################################################################################################
+class WakeupSource:
+    # Base class of the wakeup sources. A source calls wakeup.notify() when there may be new jobs to print
+    def __init__(self):
+        self.wakeup = None
+
+    def start(self, wakeup):
+        self.wakeup = wakeup
+
+    def stop(self):
+        pass
+
+
+class DbmsAlertSource(WakeupSource):
+    # Waits on DBMS_ALERT in its own session (WAITONE blocks the session) and wakes the poller up when the
+    # PRINT_ALERT_TRIGGER_DDL trigger signals new rows in cent_iface_print
+    def __init__(self, oracle_connection, logger, alert_name=PRINT_ALERT_NAME, wait_timeout=5, retry_wait_time=15):
+        super().__init__()
+        self.oracle_connection = oracle_connection
+        self.logger = logger
+        self.alert_name = alert_name
+        self.wait_timeout = int(wait_timeout)
+        self.retry_wait_time = float(retry_wait_time)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.connection = None
+
+    def start(self, wakeup):
+        super().start(wakeup)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name='Alert-' + self.oracle_connection.oracle_connection_name)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        # WAITONE returns at most wait_timeout seconds later
+        if self.thread is not None:
+            self.thread.join(self.wait_timeout + 1)
+
+    def register(self):
+        # WAITONE blocks its session, so it gets one of the pool instead of the poller's
+        self.connection = self.oracle_connection.acquire_session()
+        cursor = self.connection.cursor()
+        cursor.callproc("DBMS_ALERT.REGISTER", [self.alert_name])
+        cursor.close()
+        self.logger.debug('Registered to alert ' + self.alert_name + ' in ' +
+                          self.oracle_connection.oracle_connection_name)
+
+    def unregister(self):
+        if self.connection is None:
+            return
+        try:
+            cursor = self.connection.cursor()
+            cursor.callproc("DBMS_ALERT.REMOVE", [self.alert_name])
+            cursor.close()
+            self.oracle_connection.release_session(self.connection)
+        except cx_Oracle.Error:
+            # Broken session, not given back to the pool
+            try:
+                self.oracle_connection.pool.drop(self.connection)
+            except (cx_Oracle.Error, AttributeError):
+                pass
+        self.connection = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.connection is None:
+                    self.register()
+
+                cursor = self.connection.cursor()
+                message = cursor.var(str)
+                status = cursor.var(int)
+                cursor.callproc("DBMS_ALERT.WAITONE", [self.alert_name, message, status, self.wait_timeout])
+                cursor.close()
+
+                # status 0 = alert received, 1 = timeout
+                if status.getvalue() == 0:
+                    self.wakeup.notify()
+            except cx_Oracle.Error as err:
+                self.logger.error('Alert ' + self.alert_name + ' not available in ' +
+                                  self.oracle_connection.oracle_connection_name + ': ' + err.__str__())
+                self.unregister()
+                self.stop_event.wait(self.retry_wait_time)
+
+        self.unregister()
+
+# #######################################################################################################################
+# ############################ END OF CLASS DbmsAlertSource #############################################################
+# #######################################################################################################################